@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+""" Runs the agents of a host configuration in several worker processes """
+
+import logging
+import sys
+from pathlib import Path
+
+import click
+
+sys.path.insert(0, str(Path(__file__).parent / "munggoggo"))
+
+from host import AgentHost, load_host_config
+from utils import setup_logging
+
+
+@click.command()
+@click.argument("config", type=click.Path(exists=True))
+@click.option(
+    "--workers", "-w", type=int, help="number of worker processes, default: CPUs"
+)
+@click.option("--debug", "-d", is_flag=True)
+def run(config, workers, debug):
+    loglevel = "debug" if debug else "info"
+    setup_logging(level=logging.DEBUG if debug else logging.INFO)
+
+    host = AgentHost(load_host_config(config), workers=workers, loglevel=loglevel)
+    host.run()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""
+Control traffic latency under bulk publishing.
+
+Measures RPC Ping round trips of an agent while the same agent bulk publishes to a sink agent.
+With PUBLISH_CHANNELS=0 bulk data and control traffic share one channel, with PUBLISH_CHANNELS>=1
+control latency should stay flat.
+
+Requires a running RabbitMQ (see rmq/README.md)::
+
+    python benchmarks/bench_control_latency.py --messages 20000 --size 4096
+"""
+
+import asyncio
+import logging
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import click
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "munggoggo"))
+
+from core import Core
+from messages import Ping
+from utils import setup_logging
+
+
+async def measure_latency(core: Core, target: str, n: int) -> list:
+    latencies = list()
+    for _ in range(n):
+        start = time.perf_counter()
+        await core.call(Ping().to_rpc(), target=target)
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(0.01)
+    return latencies
+
+
+async def run(publish_channels: int, messages: int, size: int, pings: int) -> None:
+    config = dict(PUBLISH_CHANNELS=publish_channels)
+    async with Core(identity="bench.sink") as sink, Core(
+        identity="bench.producer", config=config
+    ) as producer:
+        idle = await measure_latency(producer, sink.identity, pings)
+
+        payload = "x" * size
+        bulk = producer.send_many(
+            (payload for _ in range(messages)), msg_type="BULK", target=sink.identity
+        )
+        bulk_task = asyncio.ensure_future(bulk)
+        loaded = await measure_latency(producer, sink.identity, pings)
+        result = await bulk_task
+
+    for label, latencies in (("idle", idle), ("bulk", loaded)):
+        latencies = sorted(latencies)
+        click.echo(
+            f"PUBLISH_CHANNELS={publish_channels} {label:5}: "
+            f"median: {statistics.median(latencies) * 1000:8.2f}ms, "
+            f"p99: {latencies[int(len(latencies) * 0.99) - 1] * 1000:8.2f}ms"
+        )
+    click.echo(f"bulk result: {result.sent} sent, {result.failed} failed")
+
+
+@click.command()
+@click.option("--messages", "-n", default=20000)
+@click.option("--size", "-s", default=4096, help="bulk message size in bytes")
+@click.option("--pings", "-p", default=100)
+def main(messages, size, pings):
+    setup_logging(level=logging.WARNING)
+    for publish_channels in (0, 1):
+        asyncio.run(run(publish_channels, messages, size, pings))
+
+
+if __name__ == "__main__":
+    main()
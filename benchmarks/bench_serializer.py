@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""
+Serialization cost per message type: dataclasses_json vs. generated encoders/decoders (serializer.py).
+
+Encodes and decodes the json envelope of each message type, the old way (to_json/from_json plus
+convert_to_utc) and with the codecs, which use the generated code. The binary codec is shown for
+comparison. No broker required::
+
+    python benchmarks/bench_serializer.py --number 20000
+"""
+
+import json
+import sys
+import timeit
+from datetime import datetime
+from pathlib import Path
+
+import click
+import pytz
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "munggoggo"))
+
+from codec import BINARY, JSON, codec_for
+from messages import (
+    CoreStatus,
+    DemoData,
+    GossipDelta,
+    GossipEntry,
+    Heartbeat,
+    Ping,
+    PongControl,
+    ServiceStatus,
+    convert_to_utc,
+    message_class,
+)
+
+STATUS = CoreStatus(
+    name="agent1",
+    state="running",
+    behaviours=[
+        ServiceStatus(name=f"agent1.Behav{i}", state="running") for i in range(5)
+    ],
+)
+
+MESSAGES = [
+    Ping(ping="ping"),
+    Heartbeat(seq=42, join=True),
+    DemoData(message="Hallo", date=datetime(2019, 1, 1, tzinfo=pytz.UTC)),
+    PongControl(status=STATUS),
+    GossipDelta(
+        entries=[
+            GossipEntry(name=f"agent{i}", heartbeat=i, version=1, status=STATUS)
+            for i in range(10)
+        ]
+    ),
+]
+
+
+def dataclasses_json_roundtrip(obj):
+    msg = json.dumps({"c_type": obj.__class__.__name__, "c_data": obj.to_json()})
+    return convert_to_utc(type(obj).from_json(json.loads(msg)["c_data"]))
+
+
+def codec_roundtrip(obj, content_type):
+    codec = codec_for(content_type)
+    envelope = codec.decode(codec.encode(obj))
+    return codec.load(message_class(envelope.c_type), envelope.payload)
+
+
+@click.command()
+@click.option("--number", "-n", default=20000, help="roundtrips per message type")
+def main(number):
+    click.echo(
+        f"{'message type':14} {'dataclasses_json':>18} {'generated':>12} {'speedup':>8} {'binary':>12}"
+    )
+    for obj in MESSAGES:
+        assert (
+            dataclasses_json_roundtrip(obj)
+            == codec_roundtrip(obj, JSON)
+            == codec_roundtrip(obj, BINARY)
+        )
+        old = (
+            timeit.timeit(lambda: dataclasses_json_roundtrip(obj), number=number)
+            / number
+        )
+        new = timeit.timeit(lambda: codec_roundtrip(obj, JSON), number=number) / number
+        binary = (
+            timeit.timeit(lambda: codec_roundtrip(obj, BINARY), number=number) / number
+        )
+        click.echo(
+            f"{type(obj).__name__:14} {old * 1e6:16.1f}us {new * 1e6:10.1f}us {old / new:7.1f}x {binary * 1e6:10.1f}us"
+        )
+
+
+if __name__ == "__main__":
+    main()
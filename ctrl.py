@@ -2,6 +2,7 @@
 
 import asyncio
 import logging
+import shlex
 import sys
 from datetime import datetime
 from pathlib import Path
@@ -12,7 +13,7 @@ sys.path.insert(0, str(Path(__file__).parent / "munggoggo"))
 
 from behaviour import Behaviour
 from core import Core
-from messages import ListBehav, ManageBehav, ListTraceStore
+from messages import ListBehav, ManageBehav, ListTraceStore, RpcError
 from twpy import coro
 from utils import setup_logging
 
@@ -44,6 +45,33 @@ def cli(ctx, debug):
         LOGGING_LEVEL = logging.DEBUG
 
 
+# session commands: name -> coroutine function(ctrl, **params), params as parsed by the click command
+COMMANDS = dict()
+
+
+def session_command(name: str):
+    def decorator(func):
+        COMMANDS[name] = func
+        return func
+
+    return decorator
+
+
+async def run_once(command, **params):
+    """ Runs single command in its own Ctrl session """
+    async with Ctrl(identity="Ctrl") as a:
+        a.logger.setLevel(LOGGING_LEVEL)
+        await command(a, **params)
+        await asyncio.sleep(0.1)  # required for context cleanup
+        # print(f"Duration: {datetime.now() - start}")
+
+
+@session_command("send-message")
+async def do_send_message(a: Ctrl, msg, msg_type, target):
+    click.echo(f"Sending type: '{msg_type}' msg: {msg} to {target}")
+    await a.direct_send(msg=msg, msg_type=msg_type, target=target)
+
+
 @cli.command()
 @click.argument("msg")
 @click.argument("msg_type")
@@ -51,12 +79,13 @@ def cli(ctx, debug):
 @click.pass_context
 @coro
 async def send_message(ctx, msg, msg_type, target):
-    async with Ctrl(identity="Ctrl") as a:
-        a.logger.setLevel(LOGGING_LEVEL)
-        click.echo(f"Sending type: '{msg_type}' msg: {msg} to {target}")
-        await a.direct_send(msg=msg, msg_type=msg_type, target=target)
-        await asyncio.sleep(0.1)  # required for context cleanup
-        # print(f"Duration: {datetime.now() - start}")
+    await run_once(do_send_message, msg=msg, msg_type=msg_type, target=target)
+
+
+@session_command("broadcast")
+async def do_broadcast(a: Ctrl, msg, msg_type):
+    click.echo(f"Broadcasting type: '{msg_type}' msg: {msg}")
+    await a.fanout_send(msg=msg, msg_type=msg_type)
 
 
 @cli.command()
@@ -64,56 +93,85 @@ async def send_message(ctx, msg, msg_type, target):
 @click.argument("msg_type")
 @coro
 async def broadcast(msg, msg_type):
-    async with Ctrl(identity="Ctrl") as a:
-        a.logger.setLevel(LOGGING_LEVEL)
-        click.echo(f"Broadcasting type: '{msg_type}' msg: {msg}")
-        await a.fanout_send(msg=msg, msg_type=msg_type)
-        await asyncio.sleep(0.1)  # required for context cleanup
-        # print(f"Duration: {datetime.now() - start}")
+    await run_once(do_broadcast, msg=msg, msg_type=msg_type)
 
 
-@cli.command()
-@click.argument("agent")
-@click.pass_context
-@coro
-async def list_behaviour(ctx, agent):
-    async with Ctrl(identity="Ctrl") as a:
-        a.logger.setLevel(LOGGING_LEVEL)
-
+@session_command("list-behaviour")
+async def do_list_behaviour(a: Ctrl, agents):
+    if not agents:
+        agents = [peer.get("name") for peer in await a.list_peers()]
+    for agent in agents:
         if not await target_exists(a, agent):
             return False
 
+    obj = ListBehav()
+    # all agents are queried concurrently, results are shown as they arrive
+    async for agent, result in a.call_many(obj.to_rpc(), agents):
         click.echo(f"Listing behaviours of {agent}:")
-        obj = ListBehav()
-        result = await a.call(obj.to_rpc(), agent)
+        if isinstance(result, RpcError):
+            click.secho(result.error, fg="red")
+            continue
         for behav in result.to_dict().get("behavs", list()):
             click.secho(behav, fg="cyan")
-        await asyncio.sleep(0.1)  # required for context cleanup
-        # print(f"Duration: {datetime.now() - start}")
+
+
+@cli.command()
+@click.argument("agents", nargs=-1)
+@click.pass_context
+@coro
+async def list_behaviour(ctx, agents):
+    """ Lists behaviours of AGENTS, default: all peers """
+    await run_once(do_list_behaviour, agents=agents)
+
+
+@session_command("list-peers")
+async def do_list_peers(a: Ctrl):
+    click.echo(f"Listing peers.")
+    peers = await a.list_peers()
+    for peer in peers:
+        click.secho(f"{peer.get('name')}", fg="cyan")
 
 
 @cli.command()
 @click.pass_context
 @coro
 async def list_peers(ctx):
-    async with Ctrl(identity="Ctrl") as a:
-        a.logger.setLevel(LOGGING_LEVEL)
-        click.echo(f"Listing peers.")
-        peers = await a.list_peers()
-        for peer in peers:
-            click.secho(f"{peer.get('name')}", fg="cyan")
-        await asyncio.sleep(0.1)  # required for context cleanup
-        # print(f"Duration: {datetime.now() - start}")
+    await run_once(do_list_peers)
 
 
 async def target_exists(core: Core, target: str) -> bool:
     peers = [peer.get("name") for peer in await core.list_peers()]
+    if target not in peers:
+        # peer table may not be complete yet: ask all peers once
+        await core._update_peers()
+        await asyncio.sleep(0.1)
+        peers = [peer.get("name") for peer in await core.list_peers()]
     if target not in peers:
         click.secho(f"Invalid target: {target}. Choose one of: {peers}.", fg="red")
         return False
     return True
 
 
+@session_command("call")
+async def do_call(a: Ctrl, command, target, behav):
+    if not await target_exists(a, target):
+        return False
+
+    click.echo(f"Sending command: '{command}' to {target}:{behav}")
+    obj = ManageBehav(behav=behav, command=None,)
+    if command in ["Stop", "stop"]:
+        obj.command = "stop"
+    elif command in ["Start", "start"]:
+        obj.command = "start"
+    else:
+        click.secho(f"Invalid command.", fg="red")
+        click.secho(f"Expected one of [start, stop]", fg="red")
+        return False
+
+    result = await a.call(obj.to_rpc(), target=target)
+    click.secho(f"rpc result: {result}", fg="cyan")
+
+
 @cli.command()
 @click.argument("command")
 @click.argument("target")
@@ -121,32 +179,30 @@ async def target_exists(core: Core, target: str) -> bool:
 @click.pass_context
 @coro
 async def call(ctx, command, target, behav):
-    async with Ctrl(identity="Ctrl") as a:
-        a.logger.setLevel(LOGGING_LEVEL)
+    await run_once(do_call, command=command, target=target, behav=behav)
 
-        if not await target_exists(a, target):
-            return False
 
-        # peers = [peer.get("name") for peer in await a.list_peers()]
-        # if target not in peers:
-        #     click.echo(f"Invalid target: {target}. Choose one of: {peers}.")
-        #     return False
-        click.echo(f"Sending command: '{command}' to {target}:{behav}")
-        obj = ManageBehav(behav=behav, command=None,)
-        if command in ["Stop", "stop"]:
-            obj.command = "stop"
-        elif command in ["Start", "start"]:
-            obj.command = "start"
-        else:
-            click.secho(f"Invalid command.", fg="red")
-            click.secho(f"Expected one of [start, stop]", fg="red")
-            return False
+@session_command("list-traces")
+async def do_list_traces(a: Ctrl, target, limit, sender):
+    # assert isinstance(limit, int), f"limit must be integer"
+    if not await target_exists(a, target):
+        return False
 
-        result = await a.call(obj.to_rpc(), target=target)
-        click.secho(f"rpc result: {result}", fg="cyan")
+    if limit is not None:
+        limit = int(limit)
+    obj = ListTraceStore(app_id=sender, limit=limit,)
+
+    # entries are printed chunk by chunk as they arrive
+    total = 0
+    async for chunk in a.call_stream(obj.to_rpc(), target=target):
+        if isinstance(chunk, RpcError):
+            click.secho(chunk.error, fg="red")
+            break
+        for entry in chunk.traces:
+            click.echo(entry[1])
+        total += len(chunk.traces)
 
-        await asyncio.sleep(0.1)  # required for context cleanup
-        # print(f"Duration: {datetime.now() - start}")
+    click.echo(f"Total number of records: {total}.")
 
 
 @cli.command()
@@ -156,25 +212,75 @@ async def call(ctx, command, target, behav):
 @click.pass_context
 @coro
 async def list_traces(ctx, target, limit, sender):
-    # assert isinstance(limit, int), f"limit must be integer"
-    async with Ctrl(identity="Ctrl") as a:
-        a.logger.setLevel(LOGGING_LEVEL)
+    await run_once(do_list_traces, target=target, limit=limit, sender=sender)
+
+
+async def run_line(a: Ctrl, ctx: click.Context, line: str) -> bool:
+    """ Parses command line with the click command and runs it in the session, returns False on error """
+    args = shlex.split(line)
+    if not args:
+        return True
+    name, args = args[0], args[1:]
+    command = COMMANDS.get(name)
+    if command is None:
+        click.secho(
+            f"Invalid command: {name}. Choose one of: {sorted(COMMANDS)}.", fg="red"
+        )
+        return False
+    try:
+        params = cli.get_command(ctx, name).make_context(name, args, parent=ctx).params
+    except click.exceptions.Exit:
+        return True  # --help
+    except click.ClickException as e:
+        click.secho(f"{name}: {e.format_message()}", fg="red")
+        return False
+    return await command(a, **params) is not False
 
-        if not await target_exists(a, target):
-            return False
 
-        if limit is not None:
-            limit = int(limit)
-        obj = ListTraceStore(app_id=sender, limit=limit,)
+@cli.command()
+@click.argument("file", type=click.File("r"))
+@click.option("--concurrency", "-c", default=1, help="Commands running concurrently.")
+@click.pass_context
+@coro
+async def batch(ctx, file, concurrency):
+    """ Runs commands of FILE (one per line, '#' comments) in one session """
+    lines = [
+        line.strip()
+        for line in file
+        if line.strip() and not line.strip().startswith("#")
+    ]
+    running = asyncio.Semaphore(max(concurrency, 1))
+
+    async def _run(a, line):
+        async with running:
+            return await run_line(a, ctx, line)
 
-        result = await a.call(obj.to_rpc(), target=target)
-        for entry in result.traces:
-            click.echo(entry[1])
+    async with Ctrl(identity="Ctrl") as a:
+        a.logger.setLevel(LOGGING_LEVEL)
+        results = await asyncio.gather(*(_run(a, line) for line in lines))
+        await asyncio.sleep(0.1)  # required for context cleanup
+
+    failed = results.count(False)
+    click.echo(f"Commands: {len(results)}, failed: {failed}.")
+    if failed:
+        ctx.exit(1)
 
-        click.echo(f"Total number of records: {len(result.traces)}.")
 
+@cli.command()
+@click.pass_context
+@coro
+async def shell(ctx):
+    """ Interactive session: runs commands on one connection until 'exit' or EOF """
+    loop = asyncio.get_event_loop()
+    async with Ctrl(identity="Ctrl") as a:
+        a.logger.setLevel(LOGGING_LEVEL)
+        while True:
+            click.echo("ctrl> ", nl=False)
+            line = await loop.run_in_executor(None, sys.stdin.readline)
+            if not line or line.strip() in ("exit", "quit"):
+                break
+            await run_line(a, ctx, line)
         await asyncio.sleep(0.1)  # required for context cleanup
-        # print(f"Duration: {datetime.now() - start}")
 
 
 if __name__ == "__main__":
@@ -183,10 +289,13 @@ if __name__ == "__main__":
     
     python ctrl.py broadcast '{"c_type": "DemoData", "c_data": "{\"message\": \"Hallo\", \"date\": 1546300800.0}"}' "CUSTOM"
     python ctrl.py list-behaviour SqlAgent
+    python ctrl.py list-behaviour
     python ctrl.py send-message '{"c_type": "DemoData", "c_data": "{\"message\": \"Hallo2\", \"date\": 1546300800.0}"}' "CUSTOM" SqlAgent
     python ctrl.py call start SqlAgent SqlAgent.SqlBehav
     python ctrl.py call start SqlAgent SqlBehav
     python ctrl.py list-traces SqlAgent --sender Ctrl
+    python ctrl.py batch commands.txt --concurrency 10
+    python ctrl.py shell
     """
     start = datetime.now()
 
@@ -4,11 +4,12 @@ from __future__ import (
 
 import asyncio
 import inspect
+import logging
 import sys
 import traceback
 from asyncio import CancelledError
 from enum import Enum
-from typing import Any, Optional, List, Type, Dict, Tuple, AsyncIterable
+from typing import Any, Optional, List, Type, Dict, Tuple, AsyncIterable, Iterable
 from typing import TYPE_CHECKING
 
 import sqlalchemy
@@ -19,13 +20,17 @@ from sqlalchemy.engine import Engine
 from sqlalchemy.exc import SQLAlchemyError
 from twpy import utcnow
 
-from core import MyService
+from core import MyService, BatchResult
+from incoming import SharedMessage
 from messages import SerializableObject, DemoData, WrongMessageFormatException
+from outgoing import Body
 from mode import Service
 from mode.utils.locks import Event
 from mode.utils.types.trees import NodeT
 from model import TsDb, metadata
-from settings import DB_URL
+from mailboxes import Mailbox
+from routing import Subscription
+from settings import DB_URL, BEHAVIOUR_CHANNELS, MAILBOX_SIZE, MAILBOX_POLICY
 
 if TYPE_CHECKING:
     pass
@@ -61,6 +66,10 @@ class Behaviour(MyService):
         loop: asyncio.AbstractEventLoop = None,
         binding_keys: list = None,
         configure_rpc: bool = False,
+        dedicated_channel: bool = None,
+        mailbox_size: int = None,
+        mailbox_policy: str = None,
+        subscriptions: Iterable[Subscription] = None,
     ) -> None:
 
         super().__init__(identity=core.identity, beacon=beacon, loop=loop)
@@ -77,13 +86,28 @@ class Behaviour(MyService):
         self.rpc: Optional[RPC_SubSystem] = None
         self.configure_rpc = configure_rpc
 
+        # messages of the core's queues, None: all messages (broadcast)
+        self.subscriptions: Optional[List[Subscription]] = (
+            list(subscriptions) if subscriptions is not None else None
+        )
+
+        if dedicated_channel is None:
+            dedicated_channel = core.config.get(
+                "BEHAVIOUR_CHANNELS", BEHAVIOUR_CHANNELS
+            )
+        self.dedicated_channel = dedicated_channel
+        self._channel = None
+
         self.on_start_coros = list()
         self.on_end_coros = list()
 
         self.is_configured_asyncio = False
 
-        # self.queue: Optional[asyncio.Queue[IncomingMessage]] = None
-        self.queue = asyncio.Queue()  # TODO: unlimited queue size
+        if mailbox_size is None:
+            mailbox_size = core.config.get("MAILBOX_SIZE", MAILBOX_SIZE)
+        if mailbox_policy is None:
+            mailbox_policy = core.config.get("MAILBOX_POLICY", MAILBOX_POLICY)
+        self.queue = Mailbox(maxsize=mailbox_size, policy=mailbox_policy)
 
         self.is_configured_asyncio = True
 
@@ -91,6 +115,20 @@ class Behaviour(MyService):
 
         # self.future_store = FutureStore(loop=self.loop)
 
+    async def start(self) -> None:
+        """ Starts behaviour and registers its subscriptions with the core """
+        self.core.routes.add(self, self.subscriptions)
+        await super().start()
+
+    async def stop(self) -> None:
+        self.core.routes.remove(self)
+        await super().stop()
+
+    @property
+    def channel(self):
+        """ Channel for PubSub and RPC: own channel if dedicated_channel, else the core's channel """
+        return self._channel or self.core.channel
+
     def _new_force_kill_event(self) -> Event:
         return Event(loop=self._loop)
 
@@ -123,6 +161,12 @@ class Behaviour(MyService):
         self.on_start_coros = list()
         self.on_end_coros = list()
 
+        if self.dedicated_channel and (
+            self.binding_keys is not None or self.configure_rpc
+        ):
+            self._channel = await self.core.connection.channel()
+            self.log.debug(f"{self.name} opened dedicated channel: {self._channel}")
+
         if self.binding_keys is not None:
             self.pubsub = PubSub(self, binding_keys=self.binding_keys)
             self.on_start_coros.append(self.pubsub.on_start())
@@ -154,6 +198,9 @@ class Behaviour(MyService):
     async def on_shutdown(self):
         self.set_shutdown()
         await asyncio.gather(*self.on_end_coros)
+        if self._channel is not None:
+            await self._channel.close()
+            self._channel = None
         self.log.info(f"{self.name} shutdown: {self.state}")
 
     async def _on_end(self):
@@ -210,35 +257,65 @@ class Behaviour(MyService):
         finally:
             self.log.info(f"---------- loop final ----------")
 
-    async def enqueue(self, message: Message):
-        """ Enqueues a message in the behaviour's incoming mailbox """
-        self.log.debug(f"message enqueued: {message.body}")
-        await self.queue.put(message)
+    async def enqueue(self, message: Message) -> bool:
+        """ Enqueues a message in the behaviour's incoming mailbox
+
+            Full mailbox: see MAILBOX_POLICY, returns False if the message has been dropped,
+            raises MailboxFull if it has to be rejected.
+        """
+        if not await self.queue.deliver(message):
+            self.log.warning(f"Mailbox full, message dropped: {self.queue}")
+            return False
+        if self.log_enabled():
+            self.log.debug(f"message enqueued: {message.body}")
+        return True
 
     def mailbox_size(self) -> int:
         """ returns mailbox size """
         return self.queue.qsize()
 
+    def mailbox_stats(self) -> dict:
+        """ returns mailbox size, limit, high-water mark and number of dropped and rejected messages """
+        return self.queue.stats
+
     async def direct_send(
-        self, msg: str, msg_type: str, target: str = None, correlation_id: str = None
+        self, msg: Body, msg_type: str, target: str = None, correlation_id: str = None
     ):
         """ Sends message to default exchange, 1:1 communication """
         await self.core.direct_send(msg, msg_type, target, correlation_id)
         # self.agent.traces.append(TraceStoreMessage.from_msg(msg), category=str(self))
 
-    async def publish(self, msg: str, routing_key: str):
+    async def publish(self, msg: Body, routing_key: str):
         """ Publishes message to topic, 1:n communication """
         await self.core.publish(msg, routing_key)
         # self.agent.traces.append(TraceStoreMessage.from_msg(msg), category=str(self))
 
-    async def fanout_send(self, msg: str, msg_type: str):
+    async def send_many(
+        self,
+        msgs: Iterable[Body],
+        msg_type: str,
+        target: str = None,
+        window: int = None,
+    ) -> BatchResult:
+        """ Sends batch of messages to default exchange, pipelined 1:1 communication """
+        return await self.core.send_many(msgs, msg_type, target, window=window)
+
+    async def publish_many(
+        self, msgs: Iterable[Body], routing_key: str, window: int = None
+    ) -> BatchResult:
+        """ Publishes batch of messages to topic, pipelined 1:n communication """
+        return await self.core.publish_many(msgs, routing_key, window=window)
+
+    async def fanout_send(self, msg: Body, msg_type: str):
         """ Sends message to fanout exchange, 1:n communication """
         await self.core.fanout_send(msg, msg_type)
         # self.agent.traces.append(TraceStoreMessage.from_msg(msg), category=str(self))
 
-    async def receive(self, timeout: float = None) -> IncomingMessage:
+    async def receive(self, timeout: float = None) -> SharedMessage:
         """ Receives a message from inbox mailbox.
 
+       Messages are shared with other behaviours: read-only, decoded once (``text``, ``deserialize()``).
+
        If timeout is not None it returns the message or "None"
        after timeout is done.
        """
@@ -257,7 +334,7 @@ class Behaviour(MyService):
                 msg = None
         return msg
 
-    async def receive_all(self) -> AsyncIterable[IncomingMessage]:
+    async def receive_all(self) -> AsyncIterable[SharedMessage]:
         """ Receives all messages from inbox mailbox. """
         while self.queue.qsize() != 0:
             yield await self.receive()
@@ -266,7 +343,8 @@ class Behaviour(MyService):
         """ Reads a message from inbox and dispatches it to known handler. """
         msg = await self.receive(timeout=timeout)
         if msg:
-            self.log.info(f"{self.name}: Message: {msg.body.decode()}")
+            if self.log_enabled(logging.INFO):
+                self.log.info(f"{self.name}: Message: {msg.text}")
             return await self.dispatch(msg)
 
     async def dispatch(self, msg: IncomingMessage, handlers: Registry = None) -> None:
@@ -326,6 +404,10 @@ class SqlBehav(Behaviour):
         loop: asyncio.AbstractEventLoop = None,
         binding_keys: list = None,
         configure_rpc: bool = False,
+        dedicated_channel: bool = None,
+        mailbox_size: int = None,
+        mailbox_policy: str = None,
+        subscriptions: Iterable[Subscription] = None,
     ) -> None:
 
         super(SqlBehav, self).__init__(
@@ -334,6 +416,10 @@ class SqlBehav(Behaviour):
             loop=loop,
             binding_keys=binding_keys,
             configure_rpc=configure_rpc,
+            dedicated_channel=dedicated_channel,
+            mailbox_size=mailbox_size,
+            mailbox_policy=mailbox_policy,
+            subscriptions=subscriptions,
         )
         self.db: Optional[Database] = None
         self.engine: Optional[Engine] = None
@@ -378,14 +464,12 @@ class SqlBehav(Behaviour):
         try:
             msg = await self.receive()
             if msg:
-                print(f"{self.name}: Message received: {msg.body.decode()}")
-                msg_type_key = SerializableObject.extract_type(msg.body.decode())
+                print(f"{self.name}: Message received: {msg.text}")
+                msg_type_key = msg.extract_type()
                 msg_type = self.msg_types.get(msg_type_key)
 
                 if msg_type:
-                    obj = SerializableObject.deserialize(
-                        msg.body.decode(), msg_type=msg_type
-                    )
+                    obj = msg.deserialize(msg_type)
                     data = {
                         "sender": msg.app_id,
                         "rmq_type": msg.type,
@@ -0,0 +1,88 @@
+""" Channel pool of a Core
+
+    The consume channel carries all queues, acks and control traffic (CONTROL, RPC).
+    Bulk publishes go over dedicated publish channels, so they cannot head-of-line block
+    acks and RPC replies. The channel is chosen by a stable hash of the routing key (target):
+    AMQP keeps the order of messages only within a channel, so all messages to the same
+    target take the same channel and arrive in the order they were sent.
+"""
+from __future__ import (
+    annotations,
+)  # make all type hints be strings and skip evaluating them
+
+import logging
+import zlib
+from typing import List, Optional
+
+from aio_pika import ExchangeType
+from aio_pika.channel import Channel
+from aio_pika.exchange import Exchange
+
+from settings import BINDING_KEY_FANOUT, BINDING_KEY_TOPIC
+
+_log = logging.getLogger(__name__)
+
+
+class PublishChannel(object):
+    """ Channel with its own handles of the agent exchanges """
+
+    def __init__(self, channel: Channel):
+        self.channel = channel
+        self.topic_exchange: Optional[Exchange] = None
+        self.fanout_exchange: Optional[Exchange] = None
+
+    @property
+    def default_exchange(self) -> Exchange:
+        return self.channel.default_exchange
+
+    async def configure_exchanges(self):
+        """ Exchange declaration is idempotent, exchange objects are bound to their channel. """
+        self.topic_exchange = await self.channel.declare_exchange(
+            name=BINDING_KEY_TOPIC, type=ExchangeType.TOPIC
+        )
+        self.fanout_exchange = await self.channel.declare_exchange(
+            name=BINDING_KEY_FANOUT, type=ExchangeType.FANOUT
+        )
+
+    async def close(self):
+        if not self.channel.is_closed:
+            await self.channel.close()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.channel})"
+
+
+class ChannelPool(object):
+    """ Pool of publish channels, selected by routing key
+
+        With size 0 no channels are opened and all publishes fall back to the consume channel.
+    """
+
+    def __init__(self, size: int = 1):
+        self.size = size
+        self.channels: List[PublishChannel] = list()
+
+    async def open(self, connection) -> None:
+        for _ in range(self.size):
+            publish_channel = PublishChannel(await connection.channel())
+            await publish_channel.configure_exchanges()
+            self.channels.append(publish_channel)
+        _log.debug(f"Publish channels opened: {self.channels}")
+
+    def for_key(self, routing_key: str = None) -> Optional[PublishChannel]:
+        """ Publish channel of routing key, always the same for a key, None if pool is empty """
+        if not self.channels:
+            return None
+        if len(self.channels) == 1:
+            return self.channels[0]
+        return self.channels[
+            zlib.crc32((routing_key or "").encode()) % len(self.channels)
+        ]
+
+    async def close(self) -> None:
+        for publish_channel in self.channels:
+            await publish_channel.close()
+        self.channels = list()
+
+    def __len__(self):
+        return len(self.channels)
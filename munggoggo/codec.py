@@ -0,0 +1,339 @@
+""" Codecs of serialized messages, selected by the ``content_type`` message property
+
+    A codec writes the envelope of a ``SerializableObject``/``RpcObject``: payload type, RPC request type
+    and payload. Two codecs are provided:
+
+    JsonCodec (application/json): self describing nested json, the payload is a json string::
+
+        {"c_type": "Ping", "c_data": "{\"ping\": \"ping\"}", "request_type": 1}
+
+    BinaryCodec (application/x-munggoggo-binary): compact binary format built with ``struct``::
+
+        header: magic (1 byte), request type (1 byte, 0: no RPC), type id (uint32, crc32 of class name)
+        payload: tagged values, see ``pack_value``
+
+    Binary bodies start with ``MAGIC``, which never starts a json document: bodies without content_type
+    are recognized by their first byte.
+
+    Envelope in headers: c_type (class name or type id) and request type travel in the AMQP message headers
+    ``C_TYPE_HEADER`` and ``REQUEST_TYPE_HEADER``, the body is the plain payload: the c_data json document
+    or ``MAGIC`` followed by the tagged payload. The type is known without touching the body (routing).
+    Bodies without ``C_TYPE_HEADER`` are decoded from the nested format.
+"""
+from __future__ import (
+    annotations,
+)  # make all type hints be strings and skip evaluating them
+
+import json
+import struct
+import zlib
+from datetime import datetime
+from enum import Enum
+from functools import lru_cache
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional, Tuple, Type, Union
+
+from serializer import serializer
+
+JSON = "application/json"
+BINARY = "application/x-munggoggo-binary"
+
+MAGIC = 0xB7
+
+C_TYPE_HEADER = "x-c-type"
+REQUEST_TYPE_HEADER = "x-request-type"
+
+# payload: c_data json string (JsonCodec) or dict of fields (BinaryCodec)
+Payload = Union[str, Dict[str, Any]]
+
+
+class Envelope(NamedTuple):
+    c_type: Union[str, int]  # class name (JsonCodec) or type id (BinaryCodec)
+    request_type: Optional[int]  # RpcMessageTypes value, None: SerializableObject
+    payload: Payload
+
+
+@lru_cache(maxsize=None)
+def type_id(c_type: str) -> int:
+    """ Numeric id of a message class name, the same in all agents """
+    return zlib.crc32(c_type.encode())
+
+
+def has_envelope(headers: Optional[Mapping]) -> bool:
+    """ True if c_type and request type travel in headers """
+    return bool(headers) and C_TYPE_HEADER in headers
+
+
+class Codec(object):
+    content_type: str
+
+    def encode(self, obj, request_type: Optional[int] = None) -> Union[str, bytes]:
+        raise NotImplementedError
+
+    def encode_payload(self, obj) -> Union[str, bytes]:
+        """ Body of envelope in headers """
+        raise NotImplementedError
+
+    def header_c_type(self, obj) -> Union[str, int]:
+        return obj.__class__.__name__
+
+    def encode_headers(
+        self, obj, request_type: Optional[int] = None
+    ) -> Tuple[Union[str, bytes], Dict[str, Any]]:
+        """ (body, headers): envelope in headers, body is the plain payload """
+        headers = {C_TYPE_HEADER: self.header_c_type(obj)}
+        if request_type is not None:
+            headers[REQUEST_TYPE_HEADER] = request_type
+        return self.encode_payload(obj), headers
+
+    def decode(
+        self, body: Union[str, bytes], headers: Optional[Mapping] = None
+    ) -> Envelope:
+        """ Raises ValueError, KeyError or TypeError for bodies of wrong format """
+        if has_envelope(headers):
+            return Envelope(
+                headers[C_TYPE_HEADER],
+                headers.get(REQUEST_TYPE_HEADER),
+                self.decode_payload(body),
+            )
+        return self.decode_nested(body)
+
+    def decode_nested(self, body: Union[str, bytes]) -> Envelope:
+        raise NotImplementedError
+
+    def decode_payload(self, body: Union[str, bytes]) -> Payload:
+        raise NotImplementedError
+
+    def peek(
+        self, body: Union[str, bytes], headers: Optional[Mapping] = None
+    ) -> Union[str, int]:
+        """ c_type without decoding the payload (if the format allows), body untouched for envelope in headers """
+        if has_envelope(headers):
+            return headers[C_TYPE_HEADER]
+        return self.decode_nested(body).c_type
+
+    def load(self, cls: Type, payload: Payload):
+        """ Creates instance of cls from decoded payload, datetimes in UTC """
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+    content_type = JSON
+
+    def encode(self, obj, request_type: Optional[int] = None) -> str:
+        envelope = {
+            "c_type": obj.__class__.__name__,
+            "c_data": json.dumps(serializer(obj.__class__)[0](obj)),
+        }
+        if request_type is not None:
+            envelope["request_type"] = request_type
+        return json.dumps(envelope)
+
+    def encode_payload(self, obj) -> str:
+        return json.dumps(serializer(obj.__class__)[0](obj))
+
+    def decode_nested(self, body: Union[str, bytes]) -> Envelope:
+        envelope = json.loads(body)
+        return Envelope(
+            envelope["c_type"], envelope.get("request_type"), envelope["c_data"]
+        )
+
+    def decode_payload(self, body: Union[str, bytes]) -> Union[str, bytes]:
+        return body  # c_data json document, parsed by load
+
+    def load(self, cls: Type, payload: str):
+        return serializer(cls)[1](json.loads(payload))
+
+
+################################################################################
+# binary values: tag (1 byte) followed by value
+################################################################################
+_HEADER = struct.Struct("!BBI")
+_TAG = struct.Struct("!B")
+_INT = struct.Struct("!q")
+_INT32 = struct.Struct("!i")
+_FLOAT = struct.Struct("!d")
+_SIZE = struct.Struct("!I")
+_SIZE8 = struct.Struct("!B")
+
+# short variants: 32 bit int, 1 byte size of str/list/dict up to 255
+(
+    T_NONE,
+    T_TRUE,
+    T_FALSE,
+    T_INT,
+    T_FLOAT,
+    T_STR,
+    T_LIST,
+    T_DICT,
+    T_INT32,
+    T_STR8,
+    T_LIST8,
+    T_DICT8,
+) = range(12)
+_INT32_MIN, _INT32_MAX = -(2 ** 31), 2 ** 31 - 1
+
+
+def _pack_size(tag: int, tag8: int, size: int) -> bytes:
+    if size < 256:
+        return _TAG.pack(tag8) + _SIZE8.pack(size)
+    return _TAG.pack(tag) + _SIZE.pack(size)
+
+
+def pack_value(value: Any, out: List[bytes]) -> None:
+    """ Appends tagged binary representation of value to out
+
+        datetime is packed as timestamp and Enum as its value, like the json encoding of dataclasses_json.
+    """
+    if value is None:
+        out.append(_TAG.pack(T_NONE))
+    elif value is True:
+        out.append(_TAG.pack(T_TRUE))
+    elif value is False:
+        out.append(_TAG.pack(T_FALSE))
+    elif isinstance(value, int):
+        if _INT32_MIN <= value <= _INT32_MAX:
+            out.append(_TAG.pack(T_INT32) + _INT32.pack(value))
+        else:
+            out.append(_TAG.pack(T_INT) + _INT.pack(value))
+    elif isinstance(value, float):
+        out.append(_TAG.pack(T_FLOAT) + _FLOAT.pack(value))
+    elif isinstance(value, str):
+        data = value.encode()
+        out.append(_pack_size(T_STR, T_STR8, len(data)))
+        out.append(data)
+    elif isinstance(value, (list, tuple)):
+        out.append(_pack_size(T_LIST, T_LIST8, len(value)))
+        for item in value:
+            pack_value(item, out)
+    elif isinstance(value, dict):
+        out.append(_pack_size(T_DICT, T_DICT8, len(value)))
+        for key, item in value.items():
+            pack_value(key, out)
+            pack_value(item, out)
+    elif isinstance(value, datetime):
+        out.append(_TAG.pack(T_FLOAT) + _FLOAT.pack(value.timestamp()))
+    elif isinstance(value, Enum):
+        pack_value(value.value, out)
+    else:
+        raise TypeError(f"Type not supported by binary codec: {type(value)}")
+
+
+def unpack_value(data: memoryview, offset: int) -> Tuple[Any, int]:
+    """ Returns value at offset and offset of next value """
+    tag = data[offset]
+    offset += 1
+    if tag == T_NONE:
+        return None, offset
+    if tag == T_TRUE:
+        return True, offset
+    if tag == T_FALSE:
+        return False, offset
+    if tag == T_INT32:
+        return _INT32.unpack_from(data, offset)[0], offset + _INT32.size
+    if tag == T_INT:
+        return _INT.unpack_from(data, offset)[0], offset + _INT.size
+    if tag == T_FLOAT:
+        return _FLOAT.unpack_from(data, offset)[0], offset + _FLOAT.size
+    if tag in (T_STR8, T_LIST8, T_DICT8):
+        size, offset = data[offset], offset + 1
+        tag -= T_STR8 - T_STR  # same as long variant
+    elif tag in (T_STR, T_LIST, T_DICT):
+        (size,) = _SIZE.unpack_from(data, offset)
+        offset += _SIZE.size
+    else:
+        raise ValueError(f"Unknown tag in binary message: {tag}")
+    if tag == T_STR:
+        if offset + size > len(data):
+            raise ValueError("Truncated binary message: str exceeds body")
+        return str(data[offset : offset + size], "utf-8"), offset + size
+    if tag == T_LIST:
+        items = list()
+        for _ in range(size):
+            item, offset = unpack_value(data, offset)
+            items.append(item)
+        return items, offset
+    items = dict()
+    for _ in range(size):
+        key, offset = unpack_value(data, offset)
+        items[key], offset = unpack_value(data, offset)
+    return items, offset
+
+
+class BinaryCodec(Codec):
+    content_type = BINARY
+
+    def encode(self, obj, request_type: Optional[int] = None) -> bytes:
+        out = [_HEADER.pack(MAGIC, request_type or 0, type_id(obj.__class__.__name__))]
+        pack_value(serializer(obj.__class__)[0](obj), out)
+        return b"".join(out)
+
+    def encode_payload(self, obj) -> bytes:
+        out = [_TAG.pack(MAGIC)]
+        pack_value(serializer(obj.__class__)[0](obj), out)
+        return b"".join(out)
+
+    def header_c_type(self, obj) -> int:
+        return type_id(obj.__class__.__name__)
+
+    def decode_nested(self, body: Union[str, bytes]) -> Envelope:
+        if isinstance(body, str):
+            raise ValueError("Binary message expected, got str.")
+        data = memoryview(body)
+        try:
+            magic, request_type, c_type = _HEADER.unpack_from(data)
+            if magic != MAGIC:
+                raise ValueError(f"Not a binary message: {bytes(data[:1])}")
+            payload, _ = unpack_value(data, _HEADER.size)
+        except (struct.error, IndexError) as e:
+            raise ValueError(f"Truncated binary message: {e}")
+        if not isinstance(payload, dict):
+            raise TypeError(f"Binary payload must be dict, got {type(payload)}")
+        return Envelope(c_type, request_type or None, payload)
+
+    def decode_payload(self, body: Union[str, bytes]) -> Dict[str, Any]:
+        if isinstance(body, str):
+            raise ValueError("Binary message expected, got str.")
+        data = memoryview(body)
+        try:
+            if data[0] != MAGIC:
+                raise ValueError(f"Not a binary message: {bytes(data[:1])}")
+            payload, _ = unpack_value(data, 1)
+        except (struct.error, IndexError) as e:
+            raise ValueError(f"Truncated binary message: {e}")
+        if not isinstance(payload, dict):
+            raise TypeError(f"Binary payload must be dict, got {type(payload)}")
+        return payload
+
+    def peek(self, body: Union[str, bytes], headers: Optional[Mapping] = None) -> int:
+        if has_envelope(headers):
+            return headers[C_TYPE_HEADER]
+        if isinstance(body, str):
+            raise ValueError("Binary message expected, got str.")
+        try:
+            magic, _, c_type = _HEADER.unpack_from(body)
+        except struct.error as e:
+            raise ValueError(f"Truncated binary message: {e}")
+        if magic != MAGIC:
+            raise ValueError(f"Not a binary message: {bytes(body[:1])}")
+        return c_type
+
+    def load(self, cls: Type, payload: Dict[str, Any]):
+        return serializer(cls)[1](payload)
+
+
+CODECS: Dict[str, Codec] = {
+    JSON: JsonCodec(),
+    BINARY: BinaryCodec(),
+}
+
+
+def is_binary(body: Union[str, bytes, bytearray, memoryview]) -> bool:
+    return not isinstance(body, str) and len(body) > 0 and body[0] == MAGIC
+
+
+def codec_for(content_type: str = None, body: Union[str, bytes] = None) -> Codec:
+    """ Codec of content_type, else recognized by body: binary or json """
+    codec = CODECS.get(content_type)
+    if codec is None:
+        codec = CODECS[BINARY] if body is not None and is_binary(body) else CODECS[JSON]
+    return codec
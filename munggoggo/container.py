@@ -0,0 +1,138 @@
+""" Agent container: many agents on one connection
+
+    Every Core opens its own connection by default: one TCP connection plus heartbeat per agent.
+    An ``AgentContainer`` owns one connection (``SharedTransport``) and hosts many agents on it,
+    every agent gets its own channels. Agents are started and stopped concurrently.
+
+    Note: every agent uses 1 + PUBLISH_CHANNELS channels (+1 per behaviour with dedicated channel),
+    RabbitMQ limits channels per connection (channel_max, default 2047).
+
+    Usage::
+
+        container = AgentContainer()
+        for i in range(500):
+            container.add(Core(identity=f"agent{i}", config=dict(PUBLISH_CHANNELS=0)))
+        Worker(container, loglevel="info").execute_from_commandline()
+"""
+from __future__ import (
+    annotations,
+)  # make all type hints be strings and skip evaluating them
+
+import asyncio
+import logging
+from typing import Dict, List, Union
+
+from core import Core, MyService
+from mode.utils.types.trees import NodeT
+from settings import CONTAINER_START_CONCURRENCY, TRANSPORT
+from transport import SharedTransport, Transport
+from utils import setup_logging
+
+
+class AgentContainer(MyService):
+    """ Hosts agents on one shared connection """
+
+    def __init__(
+        self,
+        *,
+        identity: str = "container",
+        config: dict = None,
+        transport: Union[str, Transport] = None,
+        beacon: NodeT = None,
+        loop: asyncio.AbstractEventLoop = None,
+    ) -> None:
+        super().__init__(identity=identity, beacon=beacon, loop=loop)
+        self.config = config or {}
+        self.transport = SharedTransport(
+            transport or self.config.get("TRANSPORT", TRANSPORT)
+        )
+        self.agents: Dict[str, Core] = dict()
+        self._semaphore = None
+
+    def add(self, agent: Core) -> Core:
+        """ Adds agent to container, agent uses the shared connection
+
+            Agents added to a running container are started immediately.
+        """
+        if agent.identity in self.agents:
+            raise ValueError(f"Identity already in container: {agent.identity}")
+        if agent.channel_number and agent.channel_number in self.channel_numbers:
+            raise ValueError(f"Channel number already in use: {agent.channel_number}")
+        if agent.started:
+            raise ValueError(f"Agent already started: {agent.identity}")
+
+        agent.transport = self.transport
+        agent.beacon.reattach(self.beacon)
+        self.agents[agent.identity] = agent
+        if self.started:
+            self.add_future(self._start_agent(agent))
+        return agent
+
+    async def remove(self, identity: str) -> None:
+        """ Stops agent and removes it from container """
+        agent = self.agents.pop(identity)
+        await self._stop_agent(agent)
+
+    @property
+    def channel_numbers(self) -> List[int]:
+        return [
+            agent.channel_number
+            for agent in self.agents.values()
+            if agent.channel_number
+        ]
+
+    @property
+    def connection(self):
+        return self.transport.connection
+
+    async def on_start(self) -> None:
+        self._semaphore = asyncio.Semaphore(
+            self.config.get("CONTAINER_START_CONCURRENCY", CONTAINER_START_CONCURRENCY)
+        )
+        await self.transport.connect()
+        self.log.info(f"Starting {len(self.agents)} agents on {self.connection}.")
+        await asyncio.gather(
+            *(self._start_agent(agent) for agent in list(self.agents.values()))
+        )
+
+    async def on_stop(self) -> None:
+        self.log.info(f"Stopping {len(self.agents)} agents.")
+        await asyncio.gather(
+            *(self._stop_agent(agent) for agent in list(self.agents.values()))
+        )
+        await self.transport.close()
+
+    async def _start_agent(self, agent: Core) -> None:
+        """ A failing agent is removed, the other agents keep running """
+        async with self._semaphore:
+            try:
+                await agent.start()
+            except Exception as e:
+                self.log.exception(f"Cannot start agent {agent.identity}: {e}")
+                self.agents.pop(agent.identity, None)
+                if agent.channel is not None and not agent.channel.is_closed:
+                    await agent.channel.close()
+
+    async def _stop_agent(self, agent: Core) -> None:
+        async with self._semaphore:
+            try:
+                await agent.stop()
+            except Exception as e:
+                self.log.exception(f"Cannot stop agent {agent.identity}: {e}")
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({len(self.agents)} agents)"
+
+
+if __name__ == "__main__":
+    logging.getLogger("aio_pika").setLevel(logging.INFO)
+    logging.getLogger("asyncio").setLevel(logging.INFO)
+
+    setup_logging(logging.INFO)
+    from mode import Worker
+
+    app = AgentContainer()
+    for i in range(100):
+        app.add(Core(identity=f"core{i}", config=dict(PUBLISH_CHANNELS=0)))
+
+    Worker(app, loglevel="info").execute_from_commandline()
@@ -0,0 +1,82 @@
+""" Compression of message bodies, announced by the ``content_encoding`` property
+
+    Outgoing bodies of at least ``threshold`` bytes are compressed by the ``MessageTemplate``,
+    incoming bodies are decompressed in place when the message is received, so handlers,
+    behaviours and the trace store always see the decoded body. Bodies which decode to more
+    than ``max_size`` bytes are rejected without decoding them completely (compression bombs).
+
+    Encodings of the standard library: 'deflate' (zlib) and 'gzip'. Messages with other or
+    without content_encoding are passed through.
+"""
+from __future__ import (
+    annotations,
+)  # make all type hints be strings and skip evaluating them
+
+import gzip
+import zlib
+from typing import Callable, Dict, Tuple, Union
+
+from aio_pika import Message
+
+MAX_SIZE = 64 * 1024 * 1024  # bytes, default limit of decompressed bodies
+
+# compress(body), decompress(body, max_size)
+Codec = Tuple[Callable[[bytes], bytes], Callable[[bytes, int], bytes]]
+
+
+class UnknownEncoding(ValueError):
+    pass
+
+
+class BodyTooLarge(ValueError):
+    pass
+
+
+def _decompressor(wbits: int) -> Callable[[bytes, int], bytes]:
+    def decompress(data: bytes, max_size: int) -> bytes:
+        decoder = zlib.decompressobj(wbits)
+        body = decoder.decompress(data, max_size + 1)
+        if len(body) > max_size:
+            raise BodyTooLarge(f"Decompressed body exceeds {max_size} bytes.")
+        if not decoder.eof:
+            raise zlib.error("Incomplete or truncated compressed body.")
+        return body
+
+    return decompress
+
+
+ENCODINGS: Dict[str, Codec] = {
+    "deflate": (zlib.compress, _decompressor(zlib.MAX_WBITS)),
+    # gzip header and trailer
+    "gzip": (gzip.compress, _decompressor(16 + zlib.MAX_WBITS)),
+}
+
+
+def compressor(encoding: str) -> Callable[[bytes], bytes]:
+    try:
+        return ENCODINGS[encoding][0]
+    except KeyError:
+        raise UnknownEncoding(
+            f"Unknown content encoding: {encoding}. Expected one of: {sorted(ENCODINGS)}."
+        )
+
+
+def compress(body: Union[bytes, memoryview], encoding: str) -> bytes:
+    return compressor(encoding)(body)
+
+
+def decompress(message: Message, max_size: int = MAX_SIZE) -> Message:
+    """ Replaces compressed body of received message by decoded body, content_encoding is cleared
+
+        Raises BodyTooLarge if the decoded body exceeds max_size bytes.
+    """
+    codec = ENCODINGS.get(message.content_encoding)
+    if codec is None:
+        return message
+    body = codec[1](bytes(message.body), max_size)
+    # incoming messages are not locked, but bypass Message.__setattr__ like OutgoingMessage
+    _set = object.__setattr__
+    _set(message, "body", body)
+    _set(message, "body_size", len(body))
+    _set(message, "content_encoding", None)
+    return message
@@ -5,21 +5,49 @@ from __future__ import (
 import asyncio
 import logging
 import uuid
-from datetime import datetime
+from dataclasses import dataclass, field
 from types import TracebackType
-from typing import TYPE_CHECKING, Optional, Type, Any
+from typing import (
+    TYPE_CHECKING,
+    Optional,
+    Type,
+    Any,
+    AsyncIterator,
+    Iterable,
+    List,
+    Tuple,
+    Union,
+)
 
 import sys
-from aio_pika import IncomingMessage, Message, connect_robust, ExchangeType
+from aio_pika import IncomingMessage, Message, ExchangeType
+from aio_pika.exchange import Exchange
 from aiormq import ChannelLockedResource
-from async_timeout import timeout
-
-from handler import Registry, SystemHandler, RmqMessageTypes
+from aiormq.exceptions import AMQPError
+
+from channels import ChannelPool, PublishChannel
+from content_encoding import BodyTooLarge, decompress
+from incoming import receive
+from inprocess import InProcessMessage
+from gossip import Gossip
+from mailboxes import MailboxFull, OverflowPolicy
+from membership import Membership, Peer
+from outgoing import Body, MessageTemplate, trace_body
+from routing import RoutingTable
+from rpc import PendingCalls, PendingStreams, STREAM_END_HEADER, STREAM_WINDOW_HEADER
+from handler import Registry, RmqMessageTypes
 from messages import (
-    RpcMessage,
     RpcError,
+    RpcMessageTypes,
+    RpcObject,
+    SerializableObject,
+    peek_c_type,
+    StreamCredit,
     TraceStoreMessage,
-    PingControl,
+    Heartbeat,
+    GetStatus,
+    GossipDigest,
+    GossipDelta,
     ServiceStatus,
     CoreStatus,
 )
@@ -28,13 +56,34 @@ from mode.utils.logging import CompositeLogger
 from mode.utils.times import want_seconds
 from mode.utils.types.trees import NodeT
 from settings import (
-    RMQ_URL,
     BINDING_KEY_FANOUT,
     BINDING_KEY_TOPIC,
     TIMEOUT,
+    PUBLISH_WINDOW,
+    PREFETCH,
+    CONSUMER_CONCURRENCY,
+    CONSUMER_ORDERING,
+    PUBLISH_CHANNELS,
+    LOOPBACK_BYPASS,
+    RPC_REPLY_QUEUE,
+    STREAM_WINDOW,
+    HEARTBEAT_TTL_FACTOR,
+    PEER_GOSSIP,
+    GOSSIP_FANOUT,
+    TRANSPORT,
+    MESSAGE_TIMESTAMP,
+    MESSAGE_LOG_SAMPLE,
+    CONTENT_TYPE,
+    ENVELOPE_HEADERS,
+    COMPRESSION,
+    COMPRESSION_THRESHOLD,
+    MAX_DECOMPRESSED_SIZE,
+    WS_STATUS_INTERVAL,
+    WS_STATUS_TIMEOUT,
 )
 from trace import TraceStore
-from utils import setup_logging, JSONType
+from transport import Transport, create_transport
+from utils import setup_logging, JSONType, MessageLog
 
 sys.setrecursionlimit(1500)  # TODO remove
 
@@ -43,6 +92,19 @@ if TYPE_CHECKING:
     pass
 
 
+@dataclass
+class BatchResult:
+    """ Aggregated outcome of a pipelined batch publish """
+
+    sent: int = 0
+    failed: int = 0
+    errors: List[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return self.failed == 0
+
+
 class MyService(Service):
     """Base class for agent and behaviours
         Defines async service framework.
@@ -56,8 +118,22 @@ class MyService(Service):
         self.identity = identity
         self.log = CompositeLogger(self.logger, formatter=self._format_log)
 
+    _log_prefix: Tuple[Optional[NodeT], str] = (None, "")
+
     def _format_log(self, severity: int, msg: str, *args: Any, **kwargs: Any) -> str:
-        return f'[{self.identity}:^{"-" * (self.beacon.depth - 1)}{self.shortlabel}]: {msg}'
+        # prefix depends on the position in the service tree: recomputed only after reattach
+        parent, prefix = self._log_prefix
+        if not prefix or parent is not self.beacon.parent:
+            parent = self.beacon.parent
+            prefix = (
+                f'[{self.identity}:^{"-" * (self.beacon.depth - 1)}{self.shortlabel}]'
+            )
+            self._log_prefix = (parent, prefix)
+        return f"{prefix}: {msg}"
+
+    def log_enabled(self, level: int = logging.DEBUG) -> bool:
+        """ Level guard for hot paths: format log messages only if they are logged """
+        return self.log.logger.isEnabledFor(level)
 
 
 class Core(MyService):
@@ -75,6 +151,7 @@ class Core(MyService):
         config=None,
         clock=None,
         channel_number: int = None,
+        transport: Transport = None,
         beacon: NodeT = None,
         loop: asyncio.AbstractEventLoop = None,
     ) -> None:
@@ -91,19 +168,61 @@ class Core(MyService):
                 self.log.info(f"Configuration: {config}.")
                 self.config = config
 
+        self.transport = create_transport(
+            transport or self.config.get("TRANSPORT", TRANSPORT)
+        )
         self.connection = None
-        self.channel = None
+        self.channel = None  # consume and control channel
         self.channel_number = channel_number
+        self.control_channel: Optional[PublishChannel] = None
+        self.publish_channels = ChannelPool(
+            size=self.config.get("PUBLISH_CHANNELS", PUBLISH_CHANNELS)
+        )
         self.direct_queue = None
+        self.reply_queue = None  # RPC responses (RPC_REPLY_QUEUE)
         self.topic_exchange = None
         self.fanout_exchange = None
         self.behaviours = self._children
+        # behaviours by subscription, maintained by the behaviours
+        self.routes = RoutingTable()
         self.traces = TraceStore(size=1000)
-        self.peers = TraceStore(size=100)
+        self.peers = self._create_membership()
+        self._heartbeat_seq = 0
+        self.gossip: Optional[Gossip] = None  # PEER_GOSSIP
+        if self.config.get("PEER_GOSSIP", PEER_GOSSIP):
+            self.gossip = Gossip(
+                self.identity,
+                self.peers,
+                fanout=self.config.get("GOSSIP_FANOUT", GOSSIP_FANOUT),
+            )
 
-        self.futures = dict()  # store for RPC futures
+        self.pending_calls = PendingCalls()  # outstanding RPC calls
+        # streaming RPC calls, as caller and as responder
+        self.streams = PendingStreams()
 
-        self.handlers: Registry = Registry()
+        self._deliveries: List[asyncio.Queue] = list()  # consumer worker queues
+        self._ordering: Optional[str] = None
+        self._consume_callback = self.on_message
+        self.loopback_bypass = self.config.get("LOOPBACK_BYPASS", LOOPBACK_BYPASS)
+        self.message_template = MessageTemplate(
+            app_id=self.identity,
+            timestamp=self.config.get("MESSAGE_TIMESTAMP", MESSAGE_TIMESTAMP),
+            compression=self.config.get("COMPRESSION", COMPRESSION),
+            compression_threshold=self.config.get(
+                "COMPRESSION_THRESHOLD", COMPRESSION_THRESHOLD
+            ),
+        )
+        self.max_decompressed_size = self.config.get(
+            "MAX_DECOMPRESSED_SIZE", MAX_DECOMPRESSED_SIZE
+        )
+
+        # codec of system messages
+        self.content_type = self.config.get("CONTENT_TYPE", CONTENT_TYPE)
+        self.envelope_headers = self.config.get("ENVELOPE_HEADERS", ENVELOPE_HEADERS)
+        self.handlers: Registry = Registry(core=self)
+        self.message_log = MessageLog(
+            self.log, self.config.get("MESSAGE_LOG_SAMPLE", MESSAGE_LOG_SAMPLE)
+        )
 
         self.clock = clock
 
@@ -123,13 +242,24 @@ class Core(MyService):
         await super(Core, self).__aexit__()
         return None
 
+    def _create_membership(self) -> Membership:
+        """ Peer table, peers expire only with periodic heartbeats (UPDATE_PEER_INTERVAL) """
+        interval = self.config.get("UPDATE_PEER_INTERVAL")
+        ttl = None
+        if interval is not None:
+            factor = self.config.get("HEARTBEAT_TTL_FACTOR", HEARTBEAT_TTL_FACTOR)
+            ttl = factor * want_seconds(interval)
+        membership = Membership(ttl=ttl)
+        membership.add_listener(self._on_membership_change)
+        return membership
+
     async def on_first_start(self):
         ...
 
     async def on_start(self):
         self.log.info("Starting agent.")
         try:
-            self.connection = await connect_robust(url=RMQ_URL)
+            self.connection = await self.transport.connect()
         except ConnectionError as e:
             self.log.exception(f"Check RabbitMQ: {e}")  # TODO: implement RMW precheck
 
@@ -141,9 +271,10 @@ class Core(MyService):
         else:
             self.channel = await self.connection.channel()
 
-        await self.channel.set_qos(prefetch_count=1)
+        await self.channel.set_qos(prefetch_count=self.config.get("PREFETCH", PREFETCH))
 
         await self.configure_exchanges()
+        await self._configure_publish_channels()
 
         try:
             await self._configure_agent_queues()
@@ -151,11 +282,12 @@ class Core(MyService):
             self.log.error(f"Potential identity conflict: {self.identity}.")
             raise
 
+        callback = self._consume_callback = self._configure_consumer_workers()
         self.log.info(f"Start consuming: {self.direct_queue}, {self.fanout_queue}")
-        await self.direct_queue.consume(
-            consumer_tag=self.identity, callback=self.on_message
-        )
-        await self.fanout_queue.consume(callback=self.on_message)
+        await self.direct_queue.consume(consumer_tag=self.identity, callback=callback)
+        await self.fanout_queue.consume(callback=callback)
+        if self.reply_queue is not None:
+            await self.reply_queue.consume(callback=self._on_reply, no_ack=True)
 
         await self._update_peers()
         # TODO: refactor for better understanding and configuration
@@ -166,6 +298,11 @@ class Core(MyService):
             self.add_future(
                 self.periodic_update_peers(interval)
             )  # service awaits future
+            self.add_future(
+                self.periodic_publish_status(
+                    self.config.get("WS_STATUS_INTERVAL", WS_STATUS_INTERVAL)
+                )
+            )
 
         await self.setup()
 
@@ -185,6 +322,33 @@ class Core(MyService):
             f"Exchanges created: {self.topic_exchange}, {self.fanout_exchange}"
         )
 
+    async def _configure_publish_channels(self):
+        """ Control traffic is published on the consume channel, everything else on the publish channels """
+        self.control_channel = PublishChannel(self.channel)
+        self.control_channel.topic_exchange = self.topic_exchange
+        self.control_channel.fanout_exchange = self.fanout_exchange
+
+        await self.publish_channels.open(self.connection)
+        self.log.info(f"Publish channels: {len(self.publish_channels)}")
+
+    def _publisher(
+        self, msg_type: RmqMessageTypes.name = None, routing_key: str = None
+    ) -> PublishChannel:
+        """ Selects channel for publishing
+
+            CONTROL and RPC messages stay on the consume channel, so that they are never
+            queued behind bulk data on a publish channel. Data messages with the same routing key
+            (target) always take the same publish channel: their order is kept.
+        """
+        if msg_type in (RmqMessageTypes.CONTROL.name, RmqMessageTypes.RPC.name):
+            return self.control_channel
+        return self.publish_channels.for_key(routing_key) or self.control_channel
+
+    async def _delete_agent_queues(self):
+        for queue in (self.direct_queue, self.fanout_queue, self.reply_queue):
+            if queue is not None:
+                await queue.delete(if_unused=False, if_empty=False)
+
     async def _configure_agent_queues(self):
         queue_name = self.identity
         self.direct_queue = await self.channel.declare_queue(
@@ -203,6 +367,65 @@ class Core(MyService):
             f"Binding: {self.fanout_queue} to {self.fanout_exchange}: BindingKey: {BINDING_KEY_FANOUT}"
         )
 
+        if self.config.get("RPC_REPLY_QUEUE", RPC_REPLY_QUEUE):
+            self.reply_queue = await self.channel.declare_queue(
+                name="", auto_delete=False, durable=False, exclusive=True
+            )
+            self.log.info(f"Reply queue declared: {self.reply_queue}")
+
+    def _configure_consumer_workers(self):
+        """ Configures concurrent processing of deliveries (PREFETCH, CONSUMER_CONCURRENCY, CONSUMER_ORDERING)
+
+            Returns the consumer callback: ``on_message`` for strictly sequential processing (the default),
+            otherwise deliveries are dispatched to CONSUMER_CONCURRENCY worker tasks.
+            With CONSUMER_ORDERING ('correlation_id' or 'app_id') deliveries with the same key
+            always go to the same worker and are processed in order.
+        """
+        prefetch = self.config.get("PREFETCH", PREFETCH)
+        concurrency = self.config.get("CONSUMER_CONCURRENCY", CONSUMER_CONCURRENCY)
+        ordering = self.config.get("CONSUMER_ORDERING", CONSUMER_ORDERING)
+
+        if ordering not in (None, "correlation_id", "app_id"):
+            self.log.error(
+                f"Invalid CONSUMER_ORDERING: {ordering}. Expected one of [correlation_id, app_id]. Resetting to None."
+            )
+            ordering = None
+
+        if prefetch <= 1 and concurrency <= 1:
+            return self.on_message
+
+        self._ordering = ordering
+        n_queues = concurrency if ordering else 1
+        self._deliveries = [asyncio.Queue() for _ in range(n_queues)]
+        for i in range(max(concurrency, 1)):
+            # noinspection PyAsyncCall
+            self.add_future(self._consumer_worker(self._deliveries[i % n_queues]))
+
+        self.log.info(
+            f"Consumer workers: {concurrency}, prefetch: {prefetch}, ordering: {ordering}"
+        )
+        return self._dispatch_delivery
+
+    async def _dispatch_delivery(self, message: IncomingMessage):
+        """ Hands delivery over to consumer worker, keeps order per ordering key """
+        if self._ordering is not None:
+            key = getattr(message, self._ordering) or ""
+            deliveries = self._deliveries[hash(key) % len(self._deliveries)]
+        else:
+            deliveries = self._deliveries[0]
+        deliveries.put_nowait(message)
+
+    async def _consumer_worker(self, deliveries: asyncio.Queue):
+        while True:
+            message = await deliveries.get()
+            try:
+                await self.on_message(message)
+            except Exception as e:
+                # message has been rejected by message.process(), keep worker alive
+                self.log.exception(f"Error processing message: {e}")
+            finally:
+                deliveries.task_done()
+
     async def on_started(self):
         ...
 
@@ -230,8 +453,17 @@ class Core(MyService):
     async def on_stop(self):
         """ Stops an agent and kills all its behaviours. """
         await self.teardown()
-        await self.connection.close()
-        await self.channel.close()
+        await self._send_heartbeat(leave=True)
+        self.pending_calls.cancel_all()
+        self.streams.cancel_all()
+        await self.publish_channels.close()
+        if self.transport.shared:
+            # exclusive queues live as long as the connection: remove them explicitly
+            await self._delete_agent_queues()
+            await self.channel.close()
+        else:
+            await self.connection.close()
+            await self.channel.close()
         self.log.info(f"Agent stopped: {self.state}")
 
     async def teardown(self):
@@ -276,84 +508,348 @@ class Core(MyService):
             return None
         return behav[0]
 
-    async def call(self, msg: str, target: str = None) -> str:
-        """ Sends PRC call """
+    async def call(
+        self,
+        msg: Body,
+        target: str = None,
+        timeout: float = None,
+        headers: dict = None,
+        content_type: str = None,
+    ) -> str:
+        """ Sends PRC call
+
+            timeout: seconds to wait for the response, default: config TIMEOUT
+            headers: message headers, e.g. envelope of ``RpcObject.to_envelope``
+            content_type: codec of msg, e.g. codec.BINARY, default: json
+        """
         if target is None:
             target = self.identity  # loopback send
+        if timeout is None:
+            timeout = self.config.get("TIMEOUT", TIMEOUT)
 
-        result = None
         correlation_id = str(uuid.uuid4())
-        future = self.loop.create_future()
-
-        # create awaitable future, so that in background future can be resolved while here awaiting future.result
-        self.futures[correlation_id] = future
+        # future is resolved in background by RpcHandler or expired by the pending calls timer
+        future = self.pending_calls.add(correlation_id, timeout)
 
-        await self.direct_send(msg, RmqMessageTypes.RPC.name, target, correlation_id)
+        try:
+            await self.direct_send(
+                msg,
+                RmqMessageTypes.RPC.name,
+                target,
+                correlation_id,
+                headers=headers,
+                reply_to=self._reply_to,
+                content_type=content_type,
+            )
+        except Exception:
+            self.pending_calls.discard(correlation_id)
+            raise
 
         try:
-            async with timeout(delay=TIMEOUT):
-                result = await future
-        except asyncio.TimeoutError as e:
-            rpc_message = RpcMessage.from_json(msg)
-            err_msg = f"{self}: TimeoutError after {TIMEOUT}s while waiting for RPC request: {rpc_message.c_type}: {correlation_id}"
-            future = self.futures.pop(correlation_id)
-            # future.set_exception(e)
-            future.cancel()
+            result = await future
+        except asyncio.TimeoutError:
+            c_type = peek_c_type(msg, headers=headers)
+            err_msg = f"{self}: TimeoutError after {timeout}s while waiting for RPC request: {c_type}: {correlation_id}"
             self.log.error(err_msg)
 
             result = RpcError(error=err_msg)
+        finally:
+            # no-op when resolved or expired, drops the call when the caller was cancelled
+            self.pending_calls.discard(correlation_id)
 
         return result
 
+    async def call_many(
+        self,
+        msg: Body,
+        targets: Iterable[str],
+        quorum: int = None,
+        first: int = None,
+        timeout: float = None,
+        headers: dict = None,
+        content_type: str = None,
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """ Sends RPC call to all targets concurrently (scatter-gather)
+
+            Yields (target, result) in order of arrival, RpcError for failed or timed out calls.
+            quorum: stop after this number of successful results
+            first: stop after this number of results, successful or not
+            timeout: seconds to wait for all responses, default: config TIMEOUT
+
+            Calls still pending when iteration stops are discarded, their late replies are dropped.
+        """
+        if timeout is None:
+            timeout = self.config.get("TIMEOUT", TIMEOUT)
+
+        calls = dict()  # future -> (target, correlation_id)
+        for target in targets:
+            correlation_id = str(uuid.uuid4())
+            future = self.pending_calls.add(correlation_id, timeout)
+            calls[future] = (target, correlation_id)
+
+        async def _send(target: str, correlation_id: str):
+            try:
+                await self.direct_send(
+                    msg,
+                    RmqMessageTypes.RPC.name,
+                    target,
+                    correlation_id,
+                    headers=headers,
+                    reply_to=self._reply_to,
+                    content_type=content_type,
+                )
+            except Exception as e:
+                # resolve with error, so the failure is yielded like any other result
+                self.pending_calls.resolve(
+                    correlation_id, RpcError(error=f"{type(e).__name__}: {e}")
+                )
+
+        await asyncio.gather(*(_send(*call) for call in calls.values()))
+
+        successes = results = 0
+        pending = set(calls)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for future in done:
+                    target, correlation_id = calls[future]
+                    try:
+                        result = future.result()
+                    except asyncio.TimeoutError:
+                        c_type = peek_c_type(msg, headers=headers)
+                        err_msg = f"{self}: TimeoutError after {timeout}s while waiting for RPC request: {c_type}: {target}: {correlation_id}"
+                        self.log.error(err_msg)
+                        result = RpcError(error=err_msg)
+
+                    results += 1
+                    if not isinstance(result, RpcError):
+                        successes += 1
+                    yield target, result
+
+                    if (quorum is not None and successes >= quorum) or (
+                        first is not None and results >= first
+                    ):
+                        return
+        finally:
+            for future in pending:
+                self.pending_calls.discard(calls[future][1])
+
+    async def call_stream(
+        self,
+        msg: Body,
+        target: str = None,
+        window: int = None,
+        timeout: float = None,
+        headers: dict = None,
+        content_type: str = None,
+    ) -> AsyncIterator[Any]:
+        """ Sends streaming RPC call, yields response chunks as they arrive
+
+            The responder sends at most ``window`` chunks (STREAM_WINDOW) ahead of consumption,
+            a slow consumer is therefore not flooded.
+            timeout: seconds to wait for the next chunk, default: config TIMEOUT. On timeout
+            RpcError is yielded and the stream ends.
+        """
+        if target is None:
+            target = self.identity  # loopback send
+        if window is None:
+            window = self.config.get("STREAM_WINDOW", STREAM_WINDOW)
+        if timeout is None:
+            timeout = self.config.get("TIMEOUT", TIMEOUT)
+
+        correlation_id = str(uuid.uuid4())
+        chunks = self.streams.open_incoming(correlation_id)
+        end = False
+        try:
+            await self.direct_send(
+                msg,
+                RmqMessageTypes.RPC.name,
+                target,
+                correlation_id,
+                headers={**(headers or {}), STREAM_WINDOW_HEADER: window},
+                reply_to=self._reply_to,
+                content_type=content_type,
+            )
+            consumed = 0
+            while not end:
+                try:
+                    chunk, end = await asyncio.wait_for(chunks.get(), timeout)
+                except asyncio.TimeoutError:
+                    c_type = peek_c_type(msg, headers=headers)
+                    err_msg = f"{self}: TimeoutError after {timeout}s while waiting for RPC stream: {c_type}: {correlation_id}"
+                    self.log.error(err_msg)
+                    yield RpcError(error=err_msg)
+                    return
+
+                yield chunk
+                consumed += 1
+                if not end and consumed >= max(window // 2, 1):
+                    await self._send_stream_credit(
+                        target, correlation_id, StreamCredit(credit=consumed)
+                    )
+                    consumed = 0
+        finally:
+            self.streams.close_incoming(correlation_id)
+            if not end:
+                # consumer stopped early or timed out: release responder
+                await self._send_stream_credit(
+                    target, correlation_id, StreamCredit(cancel=True)
+                )
+
+    async def _send_stream_credit(
+        self, target: str, correlation_id: str, credit: StreamCredit
+    ) -> None:
+        msg, headers, content_type = self.encode_message(credit)
+        try:
+            await self.direct_send(
+                msg,
+                RmqMessageTypes.RPC.name,
+                target,
+                correlation_id,
+                headers,
+                content_type=content_type,
+            )
+        except (AMQPError, ConnectionError) as e:
+            self.log.error(f"Could not send stream credit to {target}: {e}")
+
+    def encode_message(
+        self, obj: Union[RpcObject, SerializableObject], rt: RpcMessageTypes = None
+    ) -> Tuple[Body, Optional[dict], str]:
+        """ (body, headers, content_type) of message object: codec CONTENT_TYPE, envelope in headers
+            with ENVELOPE_HEADERS
+        """
+        if isinstance(obj, RpcObject):
+            if self.envelope_headers:
+                return (*obj.to_envelope(rt, self.content_type), self.content_type)
+            return obj.to_rpc(rt, self.content_type), None, self.content_type
+        if self.envelope_headers:
+            return (*obj.to_envelope(self.content_type), self.content_type)
+        return obj.serialize(content_type=self.content_type), None, self.content_type
+
     async def direct_send(
         self,
-        msg: str,
+        msg: Body,
         msg_type: RmqMessageTypes.name,
         target: str = None,
         correlation_id: str = None,
         headers: dict = None,
+        reply_to: str = None,
+        content_type: str = None,
     ) -> None:
-        """ Sends message to default exchange """
+        """ Sends message to default exchange, content_type: codec of serialized msg (default: json) """
         if target is None:
             target = self.identity  # loopback send to itself
 
-        await self.channel.default_exchange.publish(
-            message=self._create_message(msg, msg_type, correlation_id, headers),
-            routing_key=target,
-            timeout=None,
+        message = self._create_message(
+            msg, msg_type, correlation_id, headers, reply_to, content_type
         )
+        if target == self.identity and self.loopback_bypass:
+            self._deliver_local(message, routing_key=target)
+        elif target == self._reply_to and self.loopback_bypass:
+            self._resolve_reply(message)
+        else:
+            await self._publisher(msg_type, target).default_exchange.publish(
+                message=message, routing_key=target, timeout=None
+            )
         self._add_trace_outgoing(correlation_id, headers, msg, msg_type, target, target)
-        self.log.debug(
-            f"Sent message: {msg}, routing_key: {self.identity}, type: {msg_type}"
+        self.message_log("sent", message)
+        if self.log_enabled():
+            self.log.debug(
+                f"Sent message: {msg}, routing_key: {self.identity}, type: {msg_type}"
+            )
+
+    def _deliver_local(self, message: Message, routing_key: str) -> None:
+        """ Delivers self-addressed message without broker round trip (LOOPBACK_BYPASS)
+
+            Processing is scheduled like a broker delivery, so the sender never runs the receiving handlers.
+        """
+        incoming = InProcessMessage(
+            message, routing_key=routing_key, consumer_tag=self.identity
         )
+        task = self.loop.create_task(self._consume_callback(incoming))
+        task.add_done_callback(self._on_local_delivery_done)
+
+    def _on_local_delivery_done(self, task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            self.log.error(f"Error processing loopback message: {task.exception()}")
+
+    @property
+    def _reply_to(self) -> Optional[str]:
+        """ Queue name for RPC responses, None: responses come back on the direct queue """
+        return self.reply_queue.name if self.reply_queue is not None else None
+
+    async def _on_reply(self, message: IncomingMessage) -> None:
+        """ Consumer of the reply queue (no_ack) """
+        self._resolve_reply(message)
+
+    def _resolve_reply(self, message: Message) -> None:
+        """ Completes pending RPC call with response
+
+            Minimal path: no tracing, no handler lookup, so that RPC latency does not depend
+            on the load of the direct queue.
+        """
+        try:
+            body = decompress(message, self.max_decompressed_size).body
+            _, rpc_obj = RpcObject.from_rpc(
+                bytes(body), message.content_type, message.headers
+            )
+        except Exception as e:
+            self.log.error(f"Invalid RPC response: {message.correlation_id}: {e}")
+            return
+        if not self.complete_response(message.correlation_id, rpc_obj, message.headers):
+            self.log.debug(f"Dropped late RPC response: {message.correlation_id}")
+
+    def complete_response(
+        self, correlation_id: str, rpc_obj: Any, headers: dict = None
+    ) -> bool:
+        """ Hands RPC response to waiting call or stream, returns False for late or unknown responses """
+        if correlation_id in self.streams.incoming:
+            end = bool(headers.get(STREAM_END_HEADER)) if headers else True
+            return self.streams.deliver(correlation_id, rpc_obj, end)
+        return self.pending_calls.resolve(correlation_id, rpc_obj)
 
     async def fanout_send(
         self,
-        msg: str,
+        msg: Body,
         msg_type: RmqMessageTypes.name,
         correlation_id: str = None,
         headers: dict = None,
+        content_type: str = None,
     ) -> None:
         """ Sends message to fanout exchange """
 
-        await self.fanout_exchange.publish(
-            message=self._create_message(msg, msg_type, correlation_id, headers),
+        await self._publisher(msg_type, BINDING_KEY_FANOUT).fanout_exchange.publish(
+            message=self._create_message(
+                msg, msg_type, correlation_id, headers, content_type=content_type
+            ),
             routing_key=BINDING_KEY_FANOUT,
             timeout=None,
         )
         self._add_trace_outgoing(
             correlation_id, headers, msg, msg_type, "fanout", BINDING_KEY_FANOUT
         )
-        self.log.debug(f"Sent fanout message: {msg}, routing_key: {BINDING_KEY_FANOUT}")
+        if self.log_enabled():
+            self.log.debug(
+                f"Sent fanout message: {msg}, routing_key: {BINDING_KEY_FANOUT}"
+            )
 
-    async def publish(self, msg: str, routing_key: str, headers: dict = None) -> None:
+    async def publish(
+        self,
+        msg: Body,
+        routing_key: str,
+        headers: dict = None,
+        content_type: str = None,
+    ) -> None:
         """ Publishes message to topic """
-        await self.topic_exchange.publish(
+        await self._publisher(routing_key=routing_key).topic_exchange.publish(
             message=self._create_message(
                 msg,
                 msg_type=RmqMessageTypes.PUBSUB.name,
                 correlation_id=None,
                 headers=headers,
+                content_type=content_type,
             ),
             routing_key=routing_key,
             timeout=None,
@@ -361,24 +857,137 @@ class Core(MyService):
         self._add_trace_outgoing(
             None, headers, msg, RmqMessageTypes.PUBSUB.name, "publish", routing_key
         )
-        self.log.debug(f"Sent: {msg}, routing_key: {routing_key}")
+        if self.log_enabled():
+            self.log.debug(f"Sent: {msg}, routing_key: {routing_key}")
+
+    async def send_many(
+        self,
+        msgs: Iterable[Body],
+        msg_type: RmqMessageTypes.name,
+        target: str = None,
+        headers: dict = None,
+        window: int = None,
+        content_type: str = None,
+    ) -> BatchResult:
+        """ Sends batch of messages to default exchange with pipelined publisher confirms """
+        if target is None:
+            target = self.identity  # loopback send to itself
+
+        def messages():
+            for msg in msgs:
+                self._add_trace_outgoing(None, headers, msg, msg_type, target, target)
+                yield self._create_message(
+                    msg, msg_type, None, headers, content_type=content_type
+                )
+
+        if target == self.identity and self.loopback_bypass:
+            result = BatchResult()
+            for message in messages():
+                self._deliver_local(message, routing_key=target)
+                result.sent += 1
+        else:
+            result = await self._publish_many(
+                self._publisher(msg_type, target).default_exchange,
+                messages(),
+                target,
+                window,
+            )
+        self.log.debug(f"Sent batch to {target}, type: {msg_type}: {result}")
+        return result
+
+    async def publish_many(
+        self,
+        msgs: Iterable[Body],
+        routing_key: str,
+        headers: dict = None,
+        window: int = None,
+        content_type: str = None,
+    ) -> BatchResult:
+        """ Publishes batch of messages to topic with pipelined publisher confirms """
+        msg_type = RmqMessageTypes.PUBSUB.name
+
+        def messages():
+            for msg in msgs:
+                self._add_trace_outgoing(
+                    None, headers, msg, msg_type, "publish", routing_key
+                )
+                yield self._create_message(
+                    msg, msg_type, None, headers, content_type=content_type
+                )
+
+        result = await self._publish_many(
+            self._publisher(routing_key=routing_key).topic_exchange,
+            messages(),
+            routing_key,
+            window,
+        )
+        self.log.debug(f"Published batch, routing_key: {routing_key}: {result}")
+        return result
+
+    async def _publish_many(
+        self,
+        exchange: Exchange,
+        messages: Iterable[Message],
+        routing_key: str,
+        window: int = None,
+    ) -> BatchResult:
+        """ Publishes messages without awaiting each confirm before the next publish.
+
+            At most ``window`` publishes (PUBLISH_WINDOW) are awaiting their publisher confirm at any time.
+            If the batch is cancelled or ``messages`` raises, publishes in flight are cancelled.
+        """
+        if window is None:
+            window = self.config.get("PUBLISH_WINDOW", PUBLISH_WINDOW)
+        if window < 1:
+            raise ValueError(f"Publish window must be >= 1 but is {window}")
+        in_flight = asyncio.Semaphore(window)
+        pending = set()
+        result = BatchResult()
+
+        async def _publish(message: Message):
+            try:
+                await exchange.publish(
+                    message=message, routing_key=routing_key, timeout=None
+                )
+                result.sent += 1
+            except (AMQPError, ConnectionError, asyncio.TimeoutError) as e:
+                result.failed += 1
+                result.errors.append(f"{type(e).__name__}: {e}")
+            finally:
+                in_flight.release()
+
+        try:
+            for message in messages:
+                await in_flight.acquire()
+                task = self.loop.create_task(_publish(message))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+
+            if pending:
+                await asyncio.gather(*pending)
+        finally:
+            if pending:  # aborted: no publish outlives the batch unobserved
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+
+        if result.failed:
+            self.log.error(
+                f"Batch publish to {routing_key}: {result.failed} of {result.sent + result.failed} failed."
+            )
+        return result
 
     def _create_message(
         self,
-        msg: str,
+        msg: Body,
         msg_type: RmqMessageTypes.name,
         correlation_id: str = None,
         headers: dict = None,
+        reply_to: str = None,
+        content_type: str = None,
     ) -> Message:
-        return Message(
-            content_type="application/json",
-            body=msg.encode(),
-            timestamp=datetime.now(),
-            type=msg_type,
-            app_id=self.identity,
-            user_id="guest",
-            headers=headers,
-            correlation_id=correlation_id,
+        return self.message_template.create(
+            msg, msg_type, correlation_id, headers, reply_to, content_type
         )
 
     def _add_trace_outgoing(
@@ -386,7 +995,7 @@ class Core(MyService):
     ):
         self.traces.append(
             TraceStoreMessage(
-                body=msg,
+                body=trace_body(msg),
                 headers=headers,
                 correlation_id=correlation_id,
                 type=msg_type,
@@ -402,58 +1011,189 @@ class Core(MyService):
             Well defined types (RmqMessageTypes) are sent to system handlers,
             all others are enqueued to behaviour mailbox for user handling.
         """
+        try:
+            return await self._process_message(message)
+        except (MailboxFull, BodyTooLarge) as e:
+            # delivery has been rejected by message.process()
+            self.log.warning(f"Message rejected: {e}")
+
+    async def _process_message(self, message: IncomingMessage):
         # If context processor will catch an exception, the message will be returned to the queue.
+        # The ack is sent after all behaviours have accepted the message: a blocking mailbox holds it back.
         async with message.process():
-            self.log.debug(f"Received (info/body:")
-            self.log.debug(f"   {message.info()}")
-            self.log.debug(f"   {message.body.decode()}")
-            self.traces.append(TraceStoreMessage.from_msg(message), category="incoming")
+            # one read-only message for handlers, behaviours and traces: decoded once, on first use
+            message = receive(message, self.max_decompressed_size)
+            debug = self.log_enabled()
+            if debug:
+                self.log.debug(f"Received (info/body:")
+                self.log.debug(f"   {message.info()}")
+                self.log.debug(f"   {message.text}")
+            self.message_log("received", message)
+            trace = message.trace
+            self.traces.append(trace, category="incoming")
 
             if message.type in (RmqMessageTypes.CONTROL.name, RmqMessageTypes.RPC.name):
-                handler = self.handlers.get(handler=message.type)
-                if issubclass(handler, SystemHandler):
-                    handler_instance = handler(core=self)
-                    return await handler_instance.handle(message)
-                else:
-                    return await handler(self, message)
-
-            for behaviour in self.behaviours:
-                await behaviour.enqueue(message)
-                self.log.debug(f"Message enqueued to: {behaviour} --> {message.body}")
-                self.traces.append(
-                    TraceStoreMessage.from_msg(message), category=str(behaviour)
-                )
+                return await self.handlers.dispatcher(message.type)(message)
+
+            # reject is all-or-nothing: check all mailboxes before the first one gets the message,
+            # blocking mailboxes last, so that no reject mailbox can fill up while waiting for them
+            behaviours = sorted(
+                self.routes.route(message),
+                key=lambda behaviour: behaviour.queue.policy is OverflowPolicy.BLOCK,
+            )
+            for behaviour in behaviours:
+                behaviour.queue.check_accept()
+            for behaviour in behaviours:
+                if not await behaviour.enqueue(message):
+                    continue
+                if debug:
+                    self.log.debug(
+                        f"Message enqueued to: {behaviour} --> {message.text}"
+                    )
+                self.traces.append(trace, category=str(behaviour))
 
     async def _update_peers(self) -> None:
-        msg = PingControl().serialize()
-        correlation_id = str(uuid.uuid4())
-        await self.fanout_send(
-            msg=msg,
-            msg_type=RmqMessageTypes.CONTROL.name,
-            correlation_id=correlation_id,
+        """ Announces agent, all peers reply with their heartbeat """
+        await self._send_heartbeat(join=True)
+
+    async def _send_heartbeat(
+        self, target: str = None, join: bool = False, leave: bool = False
+    ) -> None:
+        """ Sends heartbeat to target, default: all peers (fanout) """
+        self._heartbeat_seq += 1
+        msg, headers, content_type = self.encode_message(
+            Heartbeat(seq=self._heartbeat_seq, join=join, leave=leave)
         )
+        try:
+            if target is None:
+                await self.fanout_send(
+                    msg=msg,
+                    msg_type=RmqMessageTypes.CONTROL.name,
+                    headers=headers,
+                    content_type=content_type,
+                )
+            else:
+                await self.direct_send(
+                    msg=msg,
+                    msg_type=RmqMessageTypes.CONTROL.name,
+                    target=target,
+                    headers=headers,
+                    content_type=content_type,
+                )
+        except (AMQPError, ConnectionError) as e:
+            self.log.error(f"Could not send heartbeat: {e}")
+
+    async def on_heartbeat(self, name: str, heartbeat: Heartbeat) -> None:
+        """ Updates peer table, replies to joining peers """
+        if heartbeat.leave:
+            self.peers.leave(name)
+            return
+        self.peers.heartbeat(name, heartbeat.seq)
+        if heartbeat.join and name != self.identity:
+            await self._send_heartbeat(target=name)
+
+    def _on_membership_change(self, event: str, peer: Peer) -> None:
+        self.log.info(f"Peer {event}: {peer.name}")
 
     async def periodic_update_peers(self, interval):
-        """ Sends periodic keepalive message to all peers (if UPDATE_PEER_INTERVAL is set)
-            and publishes the latest peer responses as peer list to websocket.
+        """ Sends periodic heartbeat to all peers (if UPDATE_PEER_INTERVAL is set) and expires silent peers.
+
+            With PEER_GOSSIP a gossip round with a few random peers replaces the heartbeat broadcast.
+            Never waits for replies of peers: a slow peer must not delay the own heartbeat.
         """
         _interval = want_seconds(interval)
         async for _ in self.itertimer(_interval):
-            await self._update_peers()
-            peers = await self.list_peers()
+            if self.gossip is not None:
+                await self._gossip_round()
+            else:
+                await self._send_heartbeat()
+            self.peers.expire()
+
+    async def periodic_publish_status(self, interval):
+        """ Publishes the status of all peers as peer list to the websocket (WS_STATUS_INTERVAL)
+
+            Runs apart from the heartbeat: peers which do not answer within WS_STATUS_TIMEOUT are skipped.
+        """
+        _interval = want_seconds(interval)
+        timeout = self.config.get("WS_STATUS_TIMEOUT", WS_STATUS_TIMEOUT)
+        async for _ in self.itertimer(_interval):
+            if not (self.web and self.web.ws):
+                continue
+            if self.gossip is not None:
+                stati = self.gossip.status()
+            else:
+                stati = await self.peer_status(timeout=timeout)
+            peers = CoreStatus.schema().dump(stati, many=True)
             msg = {"from": self.identity, "peers": peers}
             await self._publish_ws(msg)
 
-    async def list_peers(self) -> TraceStore:  # TODO: make property out of method
-        """ list all peers which have responded to the latest PING """
-        latest = self.peers.latest()
-        corr_id = latest[2]
-        peers = sorted(
-            [status for (ts, status, cor_id) in self.peers.filter(category=corr_id)],
-            key=lambda status: status.name,
-        )
-        peers = CoreStatus.schema().dump(peers, many=True)
-        return peers
+    async def _gossip_round(self) -> None:
+        """ Sends own digest to GOSSIP_FANOUT random peers """
+        self.gossip.update_local(self.status)
+        digest = GossipDigest(digest=self.gossip.digest())
+        for target in self.gossip.targets():
+            await self._send_gossip(target, digest)
+
+    async def on_gossip(self, name: str, gossip: Any) -> None:
+        """ Answers digest with delta, merges delta and sends back requested entries """
+        if self.gossip is None:
+            return
+        self.gossip.stats.messages_received += 1
+        if isinstance(gossip, GossipDigest):
+            entries, request = self.gossip.delta(gossip.digest)
+            if entries or request:
+                reply = GossipDelta(entries=entries, request=request)
+                await self._send_gossip(name, reply)
+
+        elif isinstance(gossip, GossipDelta):
+            self.gossip.merge(gossip.entries)
+            if gossip.request:
+                entries = self.gossip.entries_for(gossip.request, complete=True)
+                if entries:
+                    await self._send_gossip(name, GossipDelta(entries=entries))
+
+    async def _send_gossip(self, target: str, gossip: SerializableObject) -> None:
+        self.gossip.stats.messages_sent += 1
+        msg, headers, content_type = self.encode_message(gossip)
+        try:
+            await self.direct_send(
+                msg=msg,
+                msg_type=RmqMessageTypes.CONTROL.name,
+                target=target,
+                headers=headers,
+                content_type=content_type,
+            )
+        except (AMQPError, ConnectionError) as e:
+            self.log.error(f"Could not send gossip to {target}: {e}")
+
+    async def list_peers(self) -> List[dict]:  # TODO: make property out of method
+        """ list all peers of the membership table """
+        self.peers.expire()
+        peers = [self.peers.get(name) for name in self.peers.names()]
+        return Peer.schema().dump(peers, many=True)
+
+    async def peer_status(
+        self, targets: Iterable[str] = None, timeout: float = None
+    ) -> List[CoreStatus]:
+        """ Fetches full status of peers on demand (default: all members), unreachable peers are skipped
+
+            timeout: seconds to wait for the replies, default: config TIMEOUT
+        """
+        if targets is None:
+            targets = self.peers.names()
+        msg, headers, content_type = self.encode_message(GetStatus())
+        stati = [
+            result.status
+            async for _, result in self.call_many(
+                msg,
+                targets,
+                timeout=timeout,
+                headers=headers,
+                content_type=content_type,
+            )
+            if isinstance(result, GetStatus)
+        ]
+        return sorted(stati, key=lambda status: status.name)
 
     async def _publish_ws(self, msg: JSONType):
         if self.web and self.web.ws:
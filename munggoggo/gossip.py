@@ -0,0 +1,193 @@
+""" Gossip based dissemination of agent status (PEER_GOSSIP)
+
+    Every agent keeps a versioned ``GossipEntry`` per known agent: a heartbeat counter, which increases
+    every gossip round, and a version, which increases when the ``CoreStatus`` changes. Both restart
+    with a new generation (start time of the agent), entries are ordered by (generation, heartbeat) and
+    (generation, version): a restarted agent is not mistaken for stale news of its previous run.
+    Each round an agent sends its digest ``{name: [generation, heartbeat, version]}`` to GOSSIP_FANOUT
+    random peers (push-pull, three messages per exchange):
+
+        A -> B: GossipDigest(digest of A)
+        B -> A: GossipDelta(entries A is missing, request: digest of entries B is missing)
+        A -> B: GossipDelta(requested entries)
+
+    Only deltas travel: a status is sent only with a newer version, otherwise only the heartbeat.
+    The peer table (``Membership``) is fed by the heartbeats received via gossip.
+"""
+from __future__ import (
+    annotations,
+)  # make all type hints be strings and skip evaluating them
+
+import random
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from membership import JOIN, LEAVE, Membership, Peer
+from messages import CoreStatus, GossipEntry
+
+Digest = Dict[str, List[int]]  # name -> [generation, heartbeat, version]
+
+
+@dataclass
+class GossipStats:
+    rounds: int = 0
+    messages_sent: int = 0
+    messages_received: int = 0
+    entries_sent: int = 0
+    entries_received: int = 0  # entries which updated the local state
+    # propagation delay of status versions from their origin to this agent, seconds
+    last_delay: float = 0.0
+    max_delay: float = 0.0
+
+
+class Gossip(object):
+    """ Versioned status of all known agents """
+
+    def __init__(
+        self,
+        identity: str,
+        membership: Membership,
+        fanout: int = 3,
+        generation: int = None,
+    ):
+        self.identity = identity
+        self.membership = membership
+        self.fanout = fanout
+        self.generation = int(time.time() * 1000) if generation is None else generation
+        self.state: Dict[str, GossipEntry] = dict()
+        self.stats = GossipStats()
+        # (generation, heartbeat) of agents which have left
+        self._dead: Dict[str, Tuple[int, int]] = dict()
+        membership.add_listener(self._on_membership_change)
+
+    def update_local(self, status: CoreStatus) -> GossipEntry:
+        """ Starts new round: increases own heartbeat, new version if status has changed """
+        entry = self.state.get(self.identity)
+        if entry is None:
+            entry = self.state[self.identity] = GossipEntry(
+                name=self.identity, generation=self.generation
+            )
+        entry.heartbeat += 1
+        if entry.status != status:
+            entry.version += 1
+            entry.status = status
+            entry.updated = time.time()
+        self.stats.rounds += 1
+        self.membership.heartbeat(self.identity, entry.heartbeat)
+        return entry
+
+    def targets(self) -> List[str]:
+        """ Random peers for this round """
+        peers = [name for name in self.membership.names() if name != self.identity]
+        return random.sample(peers, min(self.fanout, len(peers)))
+
+    def digest(self) -> Digest:
+        return {
+            name: [entry.generation, entry.heartbeat, entry.version]
+            for name, entry in self.state.items()
+        }
+
+    def delta(self, digest: Digest) -> Tuple[List[GossipEntry], Digest]:
+        """ Entries newer than digest, and own digest of entries for which digest is newer """
+        entries = self.entries_for(digest, complete=True)
+        request = dict()
+        for name, (generation, heartbeat, version) in digest.items():
+            entry = self.state.get(name)
+            if (
+                entry is None
+                or (generation, heartbeat) > (entry.generation, entry.heartbeat)
+                or (generation, version) > (entry.generation, entry.version)
+            ):
+                request[name] = (
+                    [entry.generation, entry.heartbeat, entry.version]
+                    if entry
+                    else [0, 0, 0]
+                )
+        return entries, request
+
+    def entries_for(self, digest: Digest, complete: bool = False) -> List[GossipEntry]:
+        """ Entries newer than digest, complete: also entries unknown to digest """
+        entries = list()
+        for name, entry in self.state.items():
+            known = digest.get(name)
+            if known is None:
+                if complete:
+                    entries.append(entry)
+                continue
+            generation, heartbeat, version = known
+            if (entry.generation, entry.version) > (generation, version):
+                entries.append(entry)
+            elif (entry.generation, entry.heartbeat) > (generation, heartbeat):
+                # status is known: heartbeat only
+                entries.append(
+                    GossipEntry(
+                        name=name,
+                        generation=entry.generation,
+                        heartbeat=entry.heartbeat,
+                        version=entry.version,
+                    )
+                )
+        self.stats.entries_sent += len(entries)
+        return entries
+
+    def merge(self, entries: List[GossipEntry]) -> int:
+        """ Takes over newer entries, returns the number of updated entries """
+        updated = 0
+        now = time.time()
+        for remote in entries:
+            if remote.name == self.identity:
+                continue  # own state is authoritative
+            if (remote.generation, remote.heartbeat) <= self._dead.get(
+                remote.name, (-1, -1)
+            ):
+                continue  # stale news of agent which has left
+            local = self.state.get(remote.name)
+            if local is None or remote.generation > local.generation:
+                # unknown or restarted agent: counters of a previous generation do not apply
+                if remote.status is None:
+                    # heartbeat only, status will follow with the next exchange
+                    continue
+                local = self.state[remote.name] = GossipEntry(
+                    name=remote.name, generation=remote.generation
+                )
+            elif remote.generation < local.generation:
+                continue  # stale news of previous run
+
+            changed = False
+            if remote.version > local.version and remote.status is not None:
+                local.version = remote.version
+                local.status = remote.status
+                local.updated = remote.updated
+                self.stats.last_delay = max(now - remote.updated, 0.0)
+                self.stats.max_delay = max(self.stats.max_delay, self.stats.last_delay)
+                changed = True
+            if remote.heartbeat > local.heartbeat:
+                local.heartbeat = remote.heartbeat
+                self._dead.pop(remote.name, None)
+                self.membership.heartbeat(remote.name, remote.heartbeat)
+                changed = True
+            updated += changed
+        self.stats.entries_received += updated
+        return updated
+
+    def status(self) -> List[CoreStatus]:
+        """ Latest known status of all agents """
+        stati = [
+            entry.status for entry in self.state.values() if entry.status is not None
+        ]
+        return sorted(stati, key=lambda status: status.name)
+
+    def get(self, name: str) -> Optional[GossipEntry]:
+        return self.state.get(name)
+
+    def _on_membership_change(self, event: str, peer: Peer) -> None:
+        if event == JOIN:
+            self._dead.pop(peer.name, None)  # (re)started agent
+        elif event == LEAVE and peer.name != self.identity:
+            entry = self.state.pop(peer.name, None)
+            if entry is not None:
+                self._dead[peer.name] = (entry.generation, entry.heartbeat)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(agents={len(self.state)}, {self.stats})"
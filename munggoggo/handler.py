@@ -7,21 +7,53 @@ from __future__ import (
 
 import asyncio
 import functools
-import importlib
 import inspect
 import logging
 from asyncio import Task
 from enum import Enum
-from typing import TYPE_CHECKING, Union, Dict, Optional, Any
+from typing import (
+    TYPE_CHECKING,
+    Union,
+    Dict,
+    Optional,
+    Any,
+    AsyncIterator,
+    Callable,
+    Awaitable,
+    Type,
+    Tuple,
+)
 
 from aio_pika import IncomingMessage
 from async_timeout import timeout
 from marshmallow import Schema, fields
 
-from messages import RpcMessageTypes, RpcMessage, Pong, RpcError, RpcObject, Ping, ListBehav, ManageBehav, \
-    ListTraceStore, Shutdown, ControlMessage, SerializableObject, PongControl, PingControl, RmqMessageTypes
+from codec import has_envelope
+from messages import (
+    RpcMessageTypes,
+    RpcMessage,
+    Pong,
+    RpcError,
+    RpcObject,
+    Ping,
+    ListBehav,
+    ManageBehav,
+    ListTraceStore,
+    Shutdown,
+    ControlMessage,
+    SerializableObject,
+    PongControl,
+    PingControl,
+    RmqMessageTypes,
+    StreamCredit,
+    Heartbeat,
+    GetStatus,
+    GossipDigest,
+    GossipDelta,
+)
 from mode.utils.logging import CompositeLogger, get_logger
-from settings import TIMEOUT
+from rpc import STREAM_WINDOW_HEADER, STREAM_END_HEADER, OutgoingStream
+from settings import TIMEOUT, STREAM_CHUNK_SIZE
 
 if TYPE_CHECKING:
     from behaviour import Behaviour
@@ -97,105 +129,188 @@ class Control(SystemHandler):
     """ Handles messages which do NOT require request/response protocol """
 
     async def handle(self, msg: IncomingMessage, *args, **kwargs):
-        # body = self.schema.loads(msg.body)
-        # control_msg = ControlMessage.deserialize(msg.body)
-        ctrl_obj = SerializableObject.deserialize(msg.body)
-
-        requestor = msg.app_id
-        self.log.debug(f"{self}: got command: {type(ctrl_obj).__name__}")
-
-        if isinstance(ctrl_obj, PingControl):
-            behaviour = self.core.list_behaviour()
-            reply = PongControl(status=self.core.status).serialize()
-            await self.core.direct_send(
-                reply, RmqMessageTypes.CONTROL.name, requestor, msg.correlation_id
-            )
-
-        elif isinstance(ctrl_obj, PongControl):
-            self.log.debug(f"Got pong status from : {msg.app_id}, {msg.correlation_id}")
-            self.core.peers.append(event=ctrl_obj.status, category=msg.correlation_id)
+        ctrl_obj = SerializableObject.deserialize(
+            msg.body, content_type=msg.content_type, headers=msg.headers
+        )
+        c_type = type(ctrl_obj).__name__
+        if self.log.logger.isEnabledFor(logging.DEBUG):
+            self.log.debug(f"{self}: got command: {c_type}")
 
-        else:
+        command = self.core.handlers.control_commands.get(c_type)
+        if command is None:
             self.log.warning(f"{self}: got unknown command: {type(ctrl_obj)}")
+            return
+        await command(self.core, ctrl_obj, msg)
+
+
+def encode_reply(
+    rpc_obj: RpcObject, request: IncomingMessage
+) -> Tuple[Union[str, bytes], Optional[dict], Optional[str]]:
+    """ (body, headers, content_type) of RPC response in the format of the request: codec and envelope
+        in headers
+    """
+    content_type = request.content_type
+    if has_envelope(request.headers):
+        return (
+            *rpc_obj.to_envelope(RpcMessageTypes.RPC_RESPONSE, content_type),
+            content_type,
+        )
+    return (
+        rpc_obj.to_rpc(RpcMessageTypes.RPC_RESPONSE, content_type),
+        None,
+        content_type,
+    )
 
 
 class RpcHandler(SystemHandler):
     """ Handles messages which do require request/response protocol """
 
     async def handle(self, msg: IncomingMessage, *args, **kwargs):
-        self.log.info(f"{self}: received message: {msg.body}")
-        reply = None
-        request_type, rpc_obj = RpcObject.from_rpc(msg.body)
+        if self.log.logger.isEnabledFor(logging.INFO):
+            self.log.info(f"{self}: received message: {msg.body}")
+        request_type, rpc_obj = RpcObject.from_rpc(
+            msg.body, msg.content_type, msg.headers
+        )
 
         if request_type is RpcMessageTypes.RPC_REQUEST:
 
-            if isinstance(rpc_obj, Ping):
-                reply = Pong(pong="pong").to_rpc(rt=RpcMessageTypes.RPC_RESPONSE)
-
-            elif isinstance(rpc_obj, ListBehav):
-                rpc_obj.behavs = self.core.list_behaviour()
-                reply = rpc_obj.to_rpc(rt=RpcMessageTypes.RPC_RESPONSE)
-
-            elif isinstance(rpc_obj, ManageBehav):
-                reply = await self.handle_manage_behav(reply, rpc_obj)
-
-            elif isinstance(rpc_obj, ListTraceStore):
-                rpc_obj.traces = self.core.traces.filter(limit=rpc_obj.limit, app_id=rpc_obj.app_id, category=rpc_obj.category)
-                reply = rpc_obj.to_rpc(rt=RpcMessageTypes.RPC_RESPONSE)
+            if isinstance(rpc_obj, StreamCredit):
+                if rpc_obj.cancel:
+                    self.core.streams.cancel_outgoing(msg.correlation_id)
+                else:
+                    self.core.streams.grant(msg.correlation_id, rpc_obj.credit)
+                return
 
-            elif isinstance(rpc_obj, Shutdown):
-                reply = await self.handle_shutdown(reply, rpc_obj)
+            window = msg.headers.get(STREAM_WINDOW_HEADER) if msg.headers else None
+            if window:
+                return self.start_stream(msg, rpc_obj, int(window))
 
-            else:
-                # path cannot be reached: timeout of rpc.call
-                reply = RpcError(error=f"Unknown RPC request: {type(rpc_obj)}").to_rpc()
+            reply = await self.reply(rpc_obj)
 
         elif request_type is RpcMessageTypes.RPC_RESPONSE:
-            future = self.core.futures.pop(msg.correlation_id)
-            future.set_result(rpc_obj)
+            if not self.core.complete_response(
+                msg.correlation_id, rpc_obj, msg.headers
+            ):
+                self.log.debug(f"Dropped late RPC response: {msg.correlation_id}")
             return
 
         else:
-            reply = RpcError(error="Unknown RPC request").to_rpc(rt=RpcMessageTypes.RPC_RESPONSE)
+            reply = RpcError(error="Unknown RPC request")
 
+        body, headers, content_type = encode_reply(reply, msg)
         try:
             with timeout(TIMEOUT):
+                # reply_to: dedicated reply queue of requestor (RPC_REPLY_QUEUE)
                 await self.core.direct_send(
-                    msg=reply,
+                    msg=body,
                     msg_type=RmqMessageTypes.RPC.name,
-                    target=msg.app_id,
+                    target=msg.reply_to or msg.app_id,
                     correlation_id=msg.correlation_id,
+                    headers=headers,
+                    content_type=content_type,
                 )
         except TimeoutError as e:
-            self.log.error(f"TimeoutError while sending to {msg.app_id}.")
-
-    async def handle_shutdown(self, reply, rpc_obj):
-        rpc_obj.result = f"Shutdown of {self.core.identity} initiated."
-        reply = rpc_obj.to_rpc(rt=RpcMessageTypes.RPC_RESPONSE)
-        # ensure, that response still gets sent back
-        self.core.loop.call_later(delay=0.2, callback=functools.partial(self.core.loop.create_task, self.core.stop()))
-        return reply
-
-    async def handle_manage_behav(self, reply, rpc_obj):
-        behav = self.core.get_behaviour(rpc_obj.behav)
-        if behav:
-            if rpc_obj.command == 'start':
-                if not behav.started:
-                    await behav.start()
-                    rpc_obj.result = f"{behav} started."
-                else:
-                    rpc_obj.result = f"{behav} already running."
-            elif rpc_obj.command == 'stop':
-                if behav.started:
-                    await behav.stop()
-                    behav.service_reset()
-                rpc_obj.result = f"{behav} stopped: {behav.state}"
-            else:
-                rpc_obj.result = f"Unknown command {rpc_obj.command}."
+            self.log.error(
+                f"TimeoutError while sending to {msg.reply_to or msg.app_id}."
+            )
+
+    async def reply(self, rpc_obj: RpcObject) -> RpcObject:
+        """ Executes RPC request by its registered command, returns response
+
+            Streaming commands are called without chunk size and must answer with a single chunk,
+            more chunks are an error (RpcError): nothing is dropped silently.
+        """
+        command = self.core.handlers.rpc_commands.get(type(rpc_obj).__name__)
+        if command is None:
+            return RpcError(error=f"Unknown RPC request: {type(rpc_obj)}")
+        if inspect.isasyncgenfunction(command):
+            chunks = command(self.core, rpc_obj)
+            try:
+                try:
+                    response = await chunks.__anext__()
+                except StopAsyncIteration:
+                    return RpcError(error="streaming command yielded no response")
+                try:
+                    await chunks.__anext__()
+                except StopAsyncIteration:
+                    return response
+            finally:
+                await chunks.aclose()
+            self.log.error(
+                f"{self}: streaming command {command.__name__} yielded multiple chunks for unary call."
+            )
+            return RpcError(
+                error="streaming command yielded multiple chunks; use call_stream"
+            )
+        return await command(self.core, rpc_obj)
+
+    def start_stream(
+        self, msg: IncomingMessage, rpc_obj: RpcObject, window: int
+    ) -> None:
+        """ Sends response as stream of chunks in background
+
+            Runs as task, because the credit of the requestor arrives via on_message.
+        """
+        stream = self.core.streams.open_outgoing(msg.correlation_id, credit=window)
+        stream.task = self.core.loop.create_task(
+            self.send_stream(
+                stream,
+                self.stream_chunks(rpc_obj, msg),
+                msg.reply_to or msg.app_id,
+                msg.correlation_id,
+            )
+        )
+
+    async def stream_chunks(self, rpc_obj: RpcObject, request: IncomingMessage):
+        """ Yields serialized response chunks (body, headers, content_type) in the format of request, at least one
+
+            Streaming commands (async generators) yield the chunks, called with STREAM_CHUNK_SIZE,
+            other requests are answered with a single chunk.
+        """
+        command = self.core.handlers.rpc_commands.get(type(rpc_obj).__name__)
+        if inspect.isasyncgenfunction(command):
+            size = self.core.config.get("STREAM_CHUNK_SIZE", STREAM_CHUNK_SIZE)
+            async for chunk in command(self.core, rpc_obj, size):
+                yield encode_reply(chunk, request)
         else:
-            rpc_obj.result = f"No behaviour {rpc_obj.behav}"
-        reply = rpc_obj.to_rpc(rt=RpcMessageTypes.RPC_RESPONSE)
-        return reply
+            yield encode_reply(await self.reply(rpc_obj), request)
+
+    async def send_stream(
+        self, stream: OutgoingStream, chunks, target: str, correlation_id: str
+    ):
+        timeout = self.core.config.get("TIMEOUT", TIMEOUT)
+        try:
+            chunk = await chunks.__anext__()
+            while chunk is not None:
+                try:
+                    # look ahead for end of stream
+                    next_chunk = await chunks.__anext__()
+                except StopAsyncIteration:
+                    next_chunk = None
+                await stream.acquire(timeout)
+                body, headers, content_type = chunk
+                await self.core.direct_send(
+                    msg=body,
+                    msg_type=RmqMessageTypes.RPC.name,
+                    target=target,
+                    correlation_id=correlation_id,
+                    headers={
+                        **(headers or {}),
+                        STREAM_END_HEADER: int(next_chunk is None),
+                    },
+                    content_type=content_type,
+                )
+                chunk = next_chunk
+        except asyncio.TimeoutError:
+            self.log.error(
+                f"No credit from {target} for stream {correlation_id}, stream aborted."
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.log.exception(f"Stream {correlation_id} to {target} failed: {e}")
+        finally:
+            self.core.streams.close_outgoing(correlation_id)
 
     def __str__(self):
         return "{}/{}".format(
@@ -204,18 +319,184 @@ class RpcHandler(SystemHandler):
         )
 
 
+################################################################################
+# system commands: c_type -> coroutine function
+#   RPC:     async def command(core, rpc_obj) -> RpcObject (response)
+#   RPC streaming: async generator yielding responses (chunks of streaming RPC, see stream_chunks)
+#            async def command(core, rpc_obj, chunk_size: int = None) -> AsyncIterator[RpcObject]
+#            chunk_size None: unary call, the complete response is yielded as one chunk
+#   control: async def command(core, ctrl_obj, msg)
+################################################################################
+RPC_COMMANDS: Dict[str, Callable[..., Awaitable[RpcObject]]] = dict()
+CONTROL_COMMANDS: Dict[str, Callable[..., Awaitable[None]]] = dict()
+
+
+def _c_type(obj_type: Union[Type, str]) -> str:
+    return obj_type if isinstance(obj_type, str) else obj_type.__name__
+
+
+def rpc_command(
+    obj_type: Union[Type, str], commands: Dict[str, Callable] = RPC_COMMANDS
+):
+    """ Registers RPC command for request type, default: for all agents """
+
+    def decorator(func):
+        commands[_c_type(obj_type)] = func
+        return func
+
+    return decorator
+
+
+def control_command(
+    obj_type: Union[Type, str], commands: Dict[str, Callable] = CONTROL_COMMANDS
+):
+    """ Registers control command for message type, default: for all agents """
+    return rpc_command(obj_type, commands=commands)
+
+
+@rpc_command(Ping)
+async def ping(core: Core, rpc_obj: Ping) -> Pong:
+    return Pong(pong="pong")
+
+
+@rpc_command(ListBehav)
+async def list_behav(core: Core, rpc_obj: ListBehav) -> ListBehav:
+    rpc_obj.behavs = core.list_behaviour()
+    return rpc_obj
+
+
+@rpc_command(ManageBehav)
+async def manage_behav(core: Core, rpc_obj: ManageBehav) -> ManageBehav:
+    behav = core.get_behaviour(rpc_obj.behav)
+    if behav:
+        if rpc_obj.command == "start":
+            if not behav.started:
+                await behav.start()
+                rpc_obj.result = f"{behav} started."
+            else:
+                rpc_obj.result = f"{behav} already running."
+        elif rpc_obj.command == "stop":
+            if behav.started:
+                await behav.stop()
+                behav.service_reset()
+            rpc_obj.result = f"{behav} stopped: {behav.state}"
+        else:
+            rpc_obj.result = f"Unknown command {rpc_obj.command}."
+    else:
+        rpc_obj.result = f"No behaviour {rpc_obj.behav}"
+    return rpc_obj
+
+
+@rpc_command(ListTraceStore)
+async def list_trace_store(
+    core: Core, rpc_obj: ListTraceStore, chunk_size: int = None
+) -> AsyncIterator[ListTraceStore]:
+    """ Streaming command: chunks of chunk_size traces """
+    traces = core.traces.filter(
+        limit=rpc_obj.limit, app_id=rpc_obj.app_id, category=rpc_obj.category
+    )
+    size = chunk_size or max(len(traces), 1)
+    for i in range(0, max(len(traces), 1), size):
+        rpc_obj.traces = traces[i : i + size]
+        yield rpc_obj
+
+
+@rpc_command(GetStatus)
+async def get_status(core: Core, rpc_obj: GetStatus) -> GetStatus:
+    rpc_obj.status = core.status
+    return rpc_obj
+
+
+@rpc_command(Shutdown)
+async def shutdown(core: Core, rpc_obj: Shutdown) -> Shutdown:
+    rpc_obj.result = f"Shutdown of {core.identity} initiated."
+    # ensure, that response still gets sent back
+    core.loop.call_later(
+        delay=0.2, callback=functools.partial(core.loop.create_task, core.stop())
+    )
+    return rpc_obj
+
+
+@control_command(Heartbeat)
+async def heartbeat(core: Core, ctrl_obj: Heartbeat, msg: IncomingMessage) -> None:
+    await core.on_heartbeat(msg.app_id, ctrl_obj)
+
+
+@control_command(GossipDigest)
+@control_command(GossipDelta)
+async def gossip(
+    core: Core, ctrl_obj: Union[GossipDigest, GossipDelta], msg: IncomingMessage
+) -> None:
+    await core.on_gossip(msg.app_id, ctrl_obj)
+
+
+@control_command(PingControl)
+async def ping_control(core: Core, ctrl_obj: PingControl, msg: IncomingMessage) -> None:
+    reply, headers, content_type = core.encode_message(PongControl(status=core.status))
+    await core.direct_send(
+        reply,
+        RmqMessageTypes.CONTROL.name,
+        msg.app_id,
+        msg.correlation_id,
+        headers,
+        content_type=content_type,
+    )
+
+
+@control_command(PongControl)
+async def pong_control(core: Core, ctrl_obj: PongControl, msg: IncomingMessage) -> None:
+    core.log.debug(f"Got pong status from : {msg.app_id}, {msg.correlation_id}")
+    core.peers.heartbeat(ctrl_obj.status.name)
+
+
 class Registry(object):
-    def __init__(self):
+    """ Handlers by message type and system commands by c_type
+
+        System handlers are created once per core and cached with their dispatch coroutine,
+        commands registered on the registry apply to its core only.
+    """
+
+    def __init__(self, core: Core = None):
+        self.core = core
         self.handlers = {
             "default": default_handler,
             # "msg": Handler,
             RmqMessageTypes.CONTROL.name: Control,
             RmqMessageTypes.RPC.name: RpcHandler,
         }
+        self.rpc_commands: Dict[str, Callable[..., Awaitable[RpcObject]]] = dict(
+            RPC_COMMANDS
+        )
+        self.control_commands: Dict[str, Callable[..., Awaitable[None]]] = dict(
+            CONTROL_COMMANDS
+        )
+        self._dispatch: Dict[str, Callable[[IncomingMessage], Awaitable]] = dict()
 
     def get(self, handler):
         return self.handlers.get(handler, self.handlers.get("default"))
 
     def add(self, handler):
         self.handlers[str(handler)] = handler
+        self._dispatch.pop(str(handler), None)
         return handler
+
+    def dispatcher(self, msg_type: str) -> Callable[[IncomingMessage], Awaitable]:
+        """ Returns cached coroutine function handling system messages of msg_type """
+        try:
+            return self._dispatch[msg_type]
+        except KeyError:
+            handler = self.get(msg_type)
+            if inspect.isclass(handler) and issubclass(handler, SystemHandler):
+                dispatch = handler(core=self.core).handle
+            else:
+                dispatch = functools.partial(handler, self.core)
+            self._dispatch[msg_type] = dispatch
+            return dispatch
+
+    def rpc_command(self, obj_type: Union[Type, str]):
+        """ Decorator: registers RPC command of this core, e.g. @core.handlers.rpc_command(MyRequest) """
+        return rpc_command(obj_type, commands=self.rpc_commands)
+
+    def control_command(self, obj_type: Union[Type, str]):
+        """ Decorator: registers control command of this core """
+        return rpc_command(obj_type, commands=self.control_commands)
@@ -0,0 +1,321 @@
+""" Multi-process agent host
+
+    A supervisor spreads the agents of a host configuration over N worker processes.
+    Every worker hosts its agents in an ``AgentContainer`` (one connection per process)
+    under ``mode.Worker``. Crashed workers are restarted, every worker reports its load
+    periodically to the supervisor via a pipe of its own: a worker killed while reporting
+    cannot block the reports of the others.
+
+    Host configuration extends the agent configuration format (yaml/json, see ``load_config``)::
+
+        workers: 4                  # default: number of CPUs
+        transport: amqp
+        report_interval: 5.0        # seconds between load reports
+        restart_delay: 1.0          # initial delay before restarting a crashed worker
+        agents:
+          - identity: agent1
+            class: agent1:Agent1    # "module:Class", default: core:Core
+            config:
+              UPDATE_PEER_INTERVAL: 1.0
+          - identity: SqlAgent
+"""
+from __future__ import (
+    annotations,
+)  # make all type hints be strings and skip evaluating them
+
+import asyncio
+import importlib
+import logging
+import multiprocessing
+import os
+import pickle
+import resource
+import signal
+import time
+from dataclasses import dataclass, field
+from multiprocessing.connection import Connection, wait
+from typing import Dict, List, Optional, Type
+
+from container import AgentContainer
+from core import Core
+from mode.utils.times import want_seconds
+from settings import TRANSPORT
+from utils import load_config
+
+_log = logging.getLogger(__name__)
+
+MAX_RESTART_DELAY = 30.0  # seconds
+STABLE_AFTER = 60.0  # seconds without crash until restart delay is reset
+
+
+@dataclass
+class AgentSpec:
+    """ Agent entry of host configuration """
+
+    identity: str
+    cls: str = "core:Core"
+    config: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, d: dict) -> AgentSpec:
+        if "identity" not in d:
+            raise ValueError(f"Agent without identity: {d}")
+        return cls(
+            identity=d["identity"],
+            cls=d.get("class", cls.cls),
+            config=d.get("config") or {},
+        )
+
+    def create(self) -> Core:
+        return load_class(self.cls)(identity=self.identity, config=dict(self.config))
+
+
+@dataclass
+class LoadReport:
+    """ Periodic load report of a worker process """
+
+    worker: int
+    pid: int
+    agents: int
+    running: int
+    cpu: float  # percent of one CPU since last report
+    max_rss: int  # kB
+    loop_lag: float  # seconds
+    ts: float = field(default_factory=time.time)
+
+    def __str__(self):
+        return (
+            f"worker {self.worker} (pid {self.pid}): agents {self.running}/{self.agents}, "
+            f"cpu {self.cpu:5.1f}%, rss {self.max_rss // 1024}MB, lag {self.loop_lag * 1000:.1f}ms"
+        )
+
+
+def load_class(path: str) -> Type[Core]:
+    """ Imports agent class from "module:Class" (or "module.Class") """
+    module_name, sep, class_name = path.partition(":")
+    if not sep:
+        module_name, _, class_name = path.rpartition(".")
+    if not module_name or not class_name:
+        raise ValueError(f"Invalid agent class: {path}. Expected 'module:Class'.")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def load_host_config(config_path) -> dict:
+    config = load_config(config_path) or {}
+    config["agents"] = [
+        AgentSpec.from_dict(agent) for agent in config.get("agents") or []
+    ]
+    identities = [agent.identity for agent in config["agents"]]
+    duplicates = {identity for identity in identities if identities.count(identity) > 1}
+    if duplicates:
+        raise ValueError(f"Duplicate agent identities: {sorted(duplicates)}")
+    return config
+
+
+def assign(agents: List[AgentSpec], workers: int) -> List[List[AgentSpec]]:
+    """ Round-robin assignment of agents to workers, no empty workers """
+    workers = max(1, min(workers, len(agents)))
+    return [agents[i::workers] for i in range(workers)]
+
+
+class WorkerContainer(AgentContainer):
+    """ Agent container of a worker process, reports its load to the supervisor """
+
+    def __init__(
+        self, *, worker: int, reports: Connection, interval: float, **kwargs
+    ) -> None:
+        super().__init__(identity=f"host.worker{worker}", **kwargs)
+        self.worker = worker
+        self.reports = reports
+        self.interval = interval
+
+    async def on_started(self) -> None:
+        self.add_future(self.periodic_report(self.interval))
+
+    async def periodic_report(self, interval):
+        _interval = want_seconds(interval)
+        loop = asyncio.get_event_loop()
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        last_cpu, last_ts = usage.ru_utime + usage.ru_stime, loop.time()
+        async for _ in self.itertimer(_interval):
+            now = loop.time()
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            cpu = usage.ru_utime + usage.ru_stime
+            self.reports.send(
+                LoadReport(
+                    worker=self.worker,
+                    pid=os.getpid(),
+                    agents=len(self.agents),
+                    running=len(
+                        [agent for agent in self.agents.values() if agent.started]
+                    ),
+                    cpu=100.0 * (cpu - last_cpu) / max(now - last_ts, 1e-6),
+                    max_rss=usage.ru_maxrss,
+                    loop_lag=max(0.0, now - last_ts - _interval),
+                )
+            )
+            last_cpu, last_ts = cpu, now
+
+
+def run_worker(
+    worker: int,
+    agents: List[AgentSpec],
+    transport: str,
+    reports: Connection,
+    interval: float,
+    loglevel: str,
+):
+    """ Entry point of worker process """
+    from mode import Worker
+
+    logging.getLogger("aio_pika").setLevel(logging.WARNING)
+
+    container = WorkerContainer(
+        worker=worker, reports=reports, interval=interval, transport=transport
+    )
+    for spec in agents:
+        container.add(spec.create())
+
+    Worker(
+        container, loglevel=loglevel, logfile=None, daemon=True, redirect_stdouts=False
+    ).execute_from_commandline()
+
+
+@dataclass
+class _WorkerProcess:
+    worker: int
+    agents: List[AgentSpec]
+    process: Optional[multiprocessing.Process] = None
+    started_at: float = 0.0
+    restarts: int = 0
+    restart_delay: float = 0.0
+    restart_at: Optional[float] = None
+    reports: Optional[Connection] = None  # receiving end of the report pipe
+
+
+class AgentHost(object):
+    """ Supervisor: starts worker processes, restarts crashed ones and collects load reports """
+
+    def __init__(self, config: dict, *, workers: int = None, loglevel: str = "info"):
+        self.config = config
+        self.agents: List[AgentSpec] = config["agents"]
+        self.transport = config.get("transport", TRANSPORT)
+        self.interval = float(config.get("report_interval", 5.0))
+        self.restart_delay = float(config.get("restart_delay", 1.0))
+        self.loglevel = loglevel
+        n = workers or config.get("workers") or multiprocessing.cpu_count()
+
+        self._ctx = multiprocessing.get_context("spawn")
+        self.workers = [
+            _WorkerProcess(worker=i, agents=agents, restart_delay=self.restart_delay)
+            for i, agents in enumerate(assign(self.agents, n))
+        ]
+        self.load: Dict[int, LoadReport] = dict()
+        self._stopping = False
+
+    def start(self) -> None:
+        _log.info(f"Starting {len(self.agents)} agents in {len(self.workers)} workers.")
+        for w in self.workers:
+            self._spawn(w)
+
+    def _spawn(self, w: _WorkerProcess) -> None:
+        reader, writer = self._ctx.Pipe(duplex=False)
+        w.process = self._ctx.Process(
+            target=run_worker,
+            args=(
+                w.worker,
+                w.agents,
+                self.transport,
+                writer,
+                self.interval,
+                self.loglevel,
+            ),
+            name=f"host.worker{w.worker}",
+            daemon=False,
+        )
+        w.process.start()
+        writer.close()  # only the worker writes: EOF when it exits
+        self._close_reports(w)
+        w.reports = reader
+        w.started_at = time.monotonic()
+        w.restart_at = None
+        _log.info(
+            f"Worker {w.worker} started: pid {w.process.pid}, agents {[a.identity for a in w.agents]}"
+        )
+
+    def supervise(self, timeout: float = 0.5) -> None:
+        """ One supervision step: collect load reports, restart crashed workers """
+        readers = {w.reports: w for w in self.workers if w.reports is not None}
+        if not readers:
+            time.sleep(timeout)
+        for reader in wait(list(readers), timeout):
+            try:
+                while reader.poll():
+                    report = reader.recv()
+                    self.load[report.worker] = report
+                    _log.info(str(report))
+            except (EOFError, OSError, pickle.UnpicklingError):
+                # worker has exited, possibly while reporting
+                self._close_reports(readers[reader])
+
+        if self._stopping:
+            return
+        now = time.monotonic()
+        for w in self.workers:
+            if w.process.is_alive():
+                continue
+            if w.restart_at is None:
+                if now - w.started_at > STABLE_AFTER:
+                    w.restart_delay = self.restart_delay
+                _log.error(
+                    f"Worker {w.worker} (pid {w.process.pid}) died with exit code {w.process.exitcode}, "
+                    f"restarting in {w.restart_delay}s."
+                )
+                self.load.pop(w.worker, None)
+                w.restart_at = now + w.restart_delay
+                w.restart_delay = min(w.restart_delay * 2, MAX_RESTART_DELAY)
+            elif now >= w.restart_at:
+                w.restarts += 1
+                self._spawn(w)
+
+    def run(self) -> None:
+        """ Runs supervisor until SIGINT/SIGTERM """
+
+        def _stop(signum, frame):
+            self._stopping = True
+
+        signal.signal(signal.SIGTERM, _stop)
+        signal.signal(signal.SIGINT, _stop)
+        self.start()
+        try:
+            while not self._stopping:
+                self.supervise()
+        finally:
+            self.stop()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """ Graceful stop via SIGTERM, kills workers which do not stop in time """
+        self._stopping = True
+        for w in self.workers:
+            if w.process is not None and w.process.is_alive():
+                w.process.terminate()
+        deadline = time.monotonic() + timeout
+        for w in self.workers:
+            if w.process is None:
+                continue
+            w.process.join(max(0.0, deadline - time.monotonic()))
+            if w.process.is_alive():
+                _log.warning(
+                    f"Worker {w.worker} (pid {w.process.pid}) does not stop, killing it."
+                )
+                w.process.kill()
+                w.process.join()
+        for w in self.workers:
+            self._close_reports(w)
+        _log.info("All workers stopped.")
+
+    @staticmethod
+    def _close_reports(w: _WorkerProcess) -> None:
+        if w.reports is not None:
+            w.reports.close()
+            w.reports = None
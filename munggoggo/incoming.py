@@ -0,0 +1,148 @@
+""" Incoming messages shared by all receivers
+
+    Core wraps every received message into one ``SharedMessage``, which is handed to the routing,
+    the system handlers, the trace store and the mailboxes of all interested behaviours. The decoded
+    text, the envelope, the deserialized objects and the trace entry are computed on first use and
+    cached, so fanout to N behaviours costs one decode instead of N.
+
+    The wrapper is read-only and offers the interface of the wrapped ``aio_pika.IncomingMessage``
+    (properties, delivery info, ``info()``). Deserialized objects are shared as well: receivers must
+    not modify them.
+
+    Compressed bodies are decoded before wrapping (``receive``): the message shows the decoded body
+    without content_encoding, the trace keeps the content_encoding of the wire.
+"""
+from __future__ import (
+    annotations,
+)  # make all type hints be strings and skip evaluating them
+
+import logging
+from typing import Any, Optional, Type
+
+from aio_pika import IncomingMessage
+
+from codec import C_TYPE_HEADER, Envelope, codec_for, has_envelope
+from content_encoding import MAX_SIZE, decompress
+from messages import (
+    SerializableDataclass,
+    TraceStoreMessage,
+    c_type_name,
+    message_types,
+)
+
+_log = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class SharedMessage(object):
+    """ Read-only view of an incoming message, decodes lazily and once """
+
+    __slots__ = ("message", "wire_encoding", "_text", "_envelope", "_objects", "_trace")
+
+    def __init__(self, message: IncomingMessage, wire_encoding: str = None):
+        _set = object.__setattr__
+        _set(self, "message", message)
+        # content_encoding before decompression
+        _set(self, "wire_encoding", wire_encoding)
+        _set(self, "_text", None)
+        _set(self, "_envelope", _MISSING)
+        _set(self, "_objects", dict())  # msg_type -> deserialized object
+        _set(self, "_trace", None)
+
+    def __getattr__(self, name: str) -> Any:
+        # message properties and delivery info of the wrapped message
+        return getattr(self.message, name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"{self.__class__.__name__} is read-only: {name}")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError(f"{self.__class__.__name__} is read-only: {name}")
+
+    @property
+    def text(self) -> str:
+        """ Body decoded as utf-8, undecodable bytes replaced """
+        if self._text is None:
+            object.__setattr__(
+                self, "_text", self.message.body.decode(errors="replace")
+            )
+        return self._text
+
+    @property
+    def envelope(self) -> Optional[Envelope]:
+        """ Decoded envelope of serialized messages, None for other bodies (no error logging) """
+        if self._envelope is _MISSING:
+            message = self.message
+            try:
+                envelope = codec_for(message.content_type, message.body).decode(
+                    message.body, message.headers
+                )
+            except (KeyError, TypeError, ValueError):  # JSONDecodeError is ValueError
+                envelope = None
+            object.__setattr__(self, "_envelope", envelope)
+        return self._envelope
+
+    @property
+    def c_type(self) -> Optional[str]:
+        """ Payload type, from headers without touching the body if the envelope travels in headers """
+        headers = self.message.headers
+        if has_envelope(headers):
+            return c_type_name(headers[C_TYPE_HEADER])
+        envelope = self.envelope
+        return None if envelope is None else c_type_name(envelope.c_type)
+
+    def extract_type(self) -> str:
+        """ Like SerializableObject.extract_type: 'NoneType' and error log for wrong format """
+        c_type = self.c_type
+        if c_type is None:
+            _log.error(
+                f"Wrong message format: {self.text}. Expected {{c_type: str, c_data: str}}."
+            )
+            return "NoneType"
+        return c_type
+
+    def deserialize(
+        self, msg_type: Type[SerializableDataclass] = None
+    ) -> Optional[SerializableDataclass]:
+        """ Payload object, like SerializableObject.deserialize, decoded once per msg_type """
+        obj = self._objects.get(msg_type, _MISSING)
+        if obj is not _MISSING:
+            return obj
+
+        obj = None
+        envelope = self.envelope
+        if envelope is None:
+            _log.error(
+                f"Wrong message format: {self.text}. Expected {{c_type: str, c_data: str}}."
+            )
+        else:
+            cls = msg_type or message_types.get(envelope.c_type)
+            if cls is None:
+                _log.error(f"Object type unknown: {c_type_name(envelope.c_type)}.")
+            else:
+                message = self.message
+                obj = codec_for(message.content_type, message.body).load(
+                    cls, envelope.payload
+                )
+        self._objects[msg_type] = obj
+        return obj
+
+    @property
+    def trace(self) -> TraceStoreMessage:
+        """ Entry of the trace store, shared by all categories """
+        if self._trace is None:
+            trace = TraceStoreMessage.from_msg(self.message, body=self.text)
+            if self.wire_encoding is not None:
+                trace.content_encoding = self.wire_encoding
+            object.__setattr__(self, "_trace", trace)
+        return self._trace
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.message!r})"
+
+
+def receive(message: IncomingMessage, max_size: int = MAX_SIZE) -> SharedMessage:
+    """ Decompresses received message (BodyTooLarge beyond max_size bytes) and wraps it for sharing """
+    wire_encoding = message.content_encoding
+    return SharedMessage(decompress(message, max_size), wire_encoding=wire_encoding)
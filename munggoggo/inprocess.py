@@ -0,0 +1,141 @@
+""" In-process delivery of messages
+
+    Messages which never leave the process (e.g. loopback sends of an agent to itself)
+    are wrapped into an ``InProcessMessage``, which offers the same interface as
+    ``aio_pika.IncomingMessage``: message properties, delivery info, ``process()``,
+    ``ack()``, ``reject()``, ``nack()`` and ``info()``.
+"""
+from __future__ import (
+    annotations,
+)  # make all type hints be strings and skip evaluating them
+
+import asyncio
+import itertools
+from contextlib import asynccontextmanager
+from typing import AsyncContextManager, Callable, Optional
+
+from aio_pika import Message
+from aio_pika.exceptions import MessageProcessError
+
+# settle callback: (message, ack, requeue)
+SettleCallback = Callable[["InProcessMessage", bool, bool], None]
+
+_delivery_tags = itertools.count(1)
+
+
+class InProcessMessage(Message):
+    """ IncomingMessage-like message delivered without broker round trip """
+
+    __slots__ = (
+        "cluster_id",
+        "consumer_tag",
+        "delivery_tag",
+        "exchange",
+        "routing_key",
+        "redelivered",
+        "message_count",
+        "_no_ack",
+        "_processed",
+        "_on_settle",
+    )
+
+    def __init__(
+        self,
+        message: Message,
+        *,
+        exchange: str = "",
+        routing_key: str = "",
+        consumer_tag: str = None,
+        no_ack: bool = False,
+        redelivered: bool = False,
+        on_settle: Optional[SettleCallback] = None,
+    ):
+        super().__init__(
+            body=message.body,
+            headers=message.headers_raw,
+            content_type=message.content_type,
+            content_encoding=message.content_encoding,
+            delivery_mode=message.delivery_mode,
+            priority=message.priority,
+            correlation_id=message.correlation_id,
+            reply_to=message.reply_to,
+            expiration=message.expiration,
+            message_id=message.message_id,
+            timestamp=message.timestamp,
+            type=message.type,
+            user_id=message.user_id,
+            app_id=message.app_id,
+        )
+        self.cluster_id = None
+        self.consumer_tag = consumer_tag
+        self.delivery_tag = next(_delivery_tags)
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.redelivered = redelivered
+        self.message_count = None
+
+        self._no_ack = no_ack
+        self._processed = no_ack
+        self._on_settle = on_settle
+        if no_ack:
+            self.lock()
+
+    @asynccontextmanager
+    async def process(
+        self, requeue=False, reject_on_redelivered=False, ignore_processed=False
+    ) -> AsyncContextManager:
+        """ Context manager for processing the message, see ``IncomingMessage.process``
+
+            Acks on success, rejects on exception (without requeue if redelivered and reject_on_redelivered).
+        """
+        try:
+            yield self
+        except BaseException:
+            if not ignore_processed or not self.processed:
+                await self.reject(
+                    requeue=requeue and not (reject_on_redelivered and self.redelivered)
+                )
+            raise
+        if not ignore_processed or not self.processed:
+            await self.ack()
+
+    def _settle(self, ack: bool, requeue: bool = False) -> asyncio.Future:
+        if self._no_ack:
+            raise TypeError('This message has "no_ack" flag.')
+        if self._processed:
+            raise MessageProcessError("Message already processed")
+
+        self._processed = True
+        if not self.locked:
+            self.lock()
+        if self._on_settle is not None:
+            self._on_settle(self, ack, requeue)
+
+        # same calling convention as IncomingMessage: awaitable, but no need to await
+        future = asyncio.get_event_loop().create_future()
+        future.set_result(None)
+        return future
+
+    def ack(self, multiple: bool = False) -> asyncio.Future:
+        return self._settle(ack=True)
+
+    def reject(self, requeue: bool = False) -> asyncio.Future:
+        return self._settle(ack=False, requeue=requeue)
+
+    def nack(self, multiple: bool = False, requeue: bool = True) -> asyncio.Future:
+        return self._settle(ack=False, requeue=requeue)
+
+    def info(self) -> dict:
+        """ Method returns dict representation of the message """
+        info = super().info()
+        info["cluster_id"] = self.cluster_id
+        info["consumer_tag"] = self.consumer_tag
+        info["delivery_tag"] = self.delivery_tag
+        info["exchange"] = self.exchange
+        info["redelivered"] = self.redelivered
+        info["routing_key"] = self.routing_key
+        return info
+
+    @property
+    def processed(self) -> bool:
+        return self._processed
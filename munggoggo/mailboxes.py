@@ -0,0 +1,101 @@
+""" Bounded behaviour mailboxes
+
+    A mailbox holds the incoming messages of a behaviour. With a size limit (MAILBOX_SIZE) the overflow
+    policy (MAILBOX_POLICY) decides what happens to a message arriving at a full mailbox:
+
+        block:       wait for space. The delivery is acknowledged only after the message is in the mailbox,
+                     so the broker prefetch limit stops the flow of deliveries (backpressure).
+        drop-oldest: remove the oldest message from the mailbox to make space
+        drop-newest: discard the arriving message
+        reject:      raise MailboxFull, the delivery is rejected to the broker. A delivery routed to several
+                     behaviours is rejected as a whole: no mailbox gets it if one of them rejects it
+                     (see ``check_accept``).
+
+    High-water mark and drop/reject counters are kept per mailbox.
+"""
+from __future__ import (
+    annotations,
+)  # make all type hints be strings and skip evaluating them
+
+import asyncio
+from enum import Enum
+from typing import Any, Union
+
+
+class MailboxFull(Exception):
+    """ Message rejected by full mailbox (policy reject) """
+
+    pass
+
+
+class OverflowPolicy(Enum):
+    BLOCK = "block"
+    DROP_OLDEST = "drop-oldest"
+    DROP_NEWEST = "drop-newest"
+    REJECT = "reject"
+
+
+class Mailbox(asyncio.Queue):
+    """ asyncio.Queue with overflow policy and statistics, maxsize <= 0: unbounded """
+
+    def __init__(
+        self,
+        maxsize: int = 0,
+        policy: Union[OverflowPolicy, str] = OverflowPolicy.BLOCK,
+        *,
+        loop: asyncio.AbstractEventLoop = None,
+    ):
+        if loop is None:
+            super().__init__(maxsize)
+        else:
+            super().__init__(maxsize, loop=loop)
+        self.policy = OverflowPolicy(policy)
+        self.high_water = 0
+        self.dropped = 0
+        self.rejected = 0
+
+    def check_accept(self) -> None:
+        """ Raises MailboxFull if an arriving message would be rejected (policy reject, mailbox full) """
+        if self.policy is OverflowPolicy.REJECT and self.full():
+            self.rejected += 1
+            raise MailboxFull(f"Mailbox full: {self.qsize()} messages.")
+
+    async def deliver(self, message: Any) -> bool:
+        """ Puts message into mailbox according to overflow policy, returns False if it was dropped """
+        if not self.full():
+            self.put_nowait(message)
+            return True
+
+        if self.policy is OverflowPolicy.BLOCK:
+            await self.put(message)
+        elif self.policy is OverflowPolicy.DROP_OLDEST:
+            self.get_nowait()
+            self.task_done()
+            self.dropped += 1
+            self.put_nowait(message)
+        elif self.policy is OverflowPolicy.DROP_NEWEST:
+            self.dropped += 1
+            return False
+        else:
+            self.rejected += 1
+            raise MailboxFull(f"Mailbox full: {self.qsize()} messages.")
+        return True
+
+    def _put(self, item):
+        super()._put(item)
+        if self.qsize() > self.high_water:
+            self.high_water = self.qsize()
+
+    @property
+    def stats(self) -> dict:
+        return dict(
+            size=self.qsize(),
+            maxsize=self.maxsize,
+            policy=self.policy.value,
+            high_water=self.high_water,
+            dropped=self.dropped,
+            rejected=self.rejected,
+        )
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.stats})"
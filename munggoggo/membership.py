@@ -0,0 +1,111 @@
+""" Heartbeat based membership of agents
+
+    Every agent broadcasts a small ``Heartbeat`` (CONTROL message) every UPDATE_PEER_INTERVAL seconds.
+    Each agent keeps a peer table with the time of the last heartbeat per peer: lookup by name is O(1),
+    peers which missed HEARTBEAT_TTL_FACTOR heartbeats expire. Joining agents ask for a reply (``join``),
+    leaving agents say goodbye (``leave``), so membership changes are incremental.
+
+    The full ``CoreStatus`` of a peer is not part of the heartbeat, it is fetched on demand (``GetStatus``).
+"""
+from __future__ import (
+    annotations,
+)  # make all type hints be strings and skip evaluating them
+
+import logging
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+from dataclasses_json import dataclass_json
+
+_log = logging.getLogger(__name__)
+
+JOIN = "join"
+LEAVE = "leave"
+
+# membership listener: (event, peer), event is JOIN or LEAVE
+Listener = Callable[[str, "Peer"], None]
+
+
+@dataclass_json
+@dataclass
+class Peer:
+    name: str
+    seq: int = 0  # sequence number of latest heartbeat
+    last_seen: float = 0.0  # time.monotonic() of latest heartbeat
+
+
+class Membership(object):
+    """ Peer table fed by heartbeats, peers expire after ``ttl`` seconds without heartbeat (None: never) """
+
+    def __init__(self, ttl: Optional[float] = None):
+        self.ttl = ttl
+        self.members: Dict[str, Peer] = dict()
+        self.joins = 0
+        self.leaves = 0
+        self._listeners: List[Listener] = list()
+
+    def add_listener(self, listener: Listener) -> None:
+        """ Registers callback for join and leave events """
+        self._listeners.append(listener)
+
+    def heartbeat(self, name: str, seq: int = 0, now: float = None) -> bool:
+        """ Records heartbeat of peer, returns True if the peer joined """
+        now = time.monotonic() if now is None else now
+        peer = self.members.get(name)
+        if peer is not None:
+            peer.seq = seq
+            peer.last_seen = now
+            return False
+
+        peer = self.members[name] = Peer(name=name, seq=seq, last_seen=now)
+        self.joins += 1
+        self._notify(JOIN, peer)
+        return True
+
+    def leave(self, name: str) -> bool:
+        """ Removes peer, returns False if it was not a member """
+        peer = self.members.pop(name, None)
+        if peer is None:
+            return False
+        self.leaves += 1
+        self._notify(LEAVE, peer)
+        return True
+
+    def expire(self, now: float = None) -> List[str]:
+        """ Removes peers without heartbeat within ttl, returns their names """
+        if self.ttl is None:
+            return []
+        now = time.monotonic() if now is None else now
+        expired = [
+            name
+            for name, peer in self.members.items()
+            if now - peer.last_seen > self.ttl
+        ]
+        for name in expired:
+            self.leave(name)
+        return expired
+
+    def get(self, name: str) -> Optional[Peer]:
+        return self.members.get(name)
+
+    def names(self) -> List[str]:
+        return sorted(self.members)
+
+    def _notify(self, event: str, peer: Peer) -> None:
+        for listener in self._listeners:
+            try:
+                listener(event, peer)
+            except Exception as e:
+                _log.exception(
+                    f"Membership listener failed on {event} of {peer.name}: {e}"
+                )
+
+    def __len__(self):
+        return len(self.members)
+
+    def __contains__(self, name: str):
+        return name in self.members
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(members={len(self.members)}, joins={self.joins}, leaves={self.leaves})"
@@ -1,6 +1,4 @@
-import importlib
 import json
-from json import JSONDecodeError
 
 import sys
 
@@ -9,12 +7,15 @@ import logging
 from dataclasses import dataclass, field
 from datetime import datetime
 from enum import Enum
-from typing import TypeVar, List, Optional, Tuple, Type, Dict
+from collections import Counter
+from typing import Any, TypeVar, List, Mapping, Optional, Tuple, Type, Dict, Union
 
 import pytz
 from aio_pika import Message, IncomingMessage
 from dataclasses_json import dataclass_json
 
+from codec import C_TYPE_HEADER, codec_for, has_envelope, type_id, Envelope
+
 _log = logging.getLogger(__name__)
 
 """ Message Definition and Serialization:
@@ -22,13 +23,21 @@ _log = logging.getLogger(__name__)
     Self describing data serialization format based on json and python dataclasses.
 
     Two stage serialization:
-    1. serialize payload by using dataclasses and marshmallow (dataclass with dataclass_json decorator)
+    1. serialize payload of dataclass (with dataclass_json decorator) by generated encoder (serializer.py)
     2. wrap result into RPC dataclass with two fields: {c_type: str, c_data: json_payload}
 
     This allows during deserialization to
     1. extract the class_type of payload from the SerializedObject (obj.c_type)
     2. deserizalize the json_payload with the class_type into the usable python object
 
+    The wire format is defined by the codec of the content_type (codec.py): nested json (default) or
+    compact binary with numeric type ids instead of class names (content_type=codec.BINARY).
+    With ``to_envelope`` the c_type and request type travel in the message headers instead and the body is
+    the plain payload; pass the headers of received messages to ``deserialize``/``from_rpc``.
+
+    Message classes are looked up in the registry ``message_types``: subclasses of SerializableObject and
+    RpcObject are registered when they are defined, so they can live in any module.
+
     Caveat when serializing dataclasses:
     As specified in the datetime docs, if your datetime object is naive, it will assume your system local timezone
     when calling .timestamp(). JSON nunbers corresponding to a datetime field in your dataclass are decoded into
@@ -61,6 +70,81 @@ _log = logging.getLogger(__name__)
 SerializableDataclass = TypeVar("SerializableDataclass")
 
 
+class UnknownMessageType(AttributeError):
+    pass
+
+
+class MessageTypes(object):
+    """ Registry of message classes by name and type id (binary codec)
+
+        Subclasses of SerializableObject and RpcObject are registered when they are defined, in any module.
+        Other dataclass_json classes can be registered with the ``message_type`` decorator.
+    """
+
+    def __init__(self):
+        self.by_name: Dict[str, Type[SerializableDataclass]] = dict()
+        self.by_id: Dict[int, Type[SerializableDataclass]] = dict()
+        self.unknown: Counter = Counter()  # decode attempts per unknown c_type
+
+    def add(self, cls: Type[SerializableDataclass]) -> Type[SerializableDataclass]:
+        name = cls.__name__
+        id_ = type_id(name)
+        other = self.by_id.get(id_)
+        if other is not None and other.__name__ != name:
+            _log.warning(
+                f"Type id of {name} collides with {other.__name__}: {name} not usable with binary codec."
+            )
+        else:
+            self.by_id[id_] = cls
+        self.by_name[name] = cls
+        return cls
+
+    def get(self, c_type: Union[str, int]) -> Optional[Type[SerializableDataclass]]:
+        return (self.by_name if isinstance(c_type, str) else self.by_id).get(c_type)
+
+    def __getitem__(self, c_type: Union[str, int]) -> Type[SerializableDataclass]:
+        """ Raises UnknownMessageType (AttributeError) for unknown types, which are counted """
+        cls = self.get(c_type)
+        if cls is None:
+            self.unknown[c_type] += 1
+            raise UnknownMessageType(f"Unknown message type: {c_type}")
+        return cls
+
+    def __contains__(self, c_type: Union[str, int]) -> bool:
+        return self.get(c_type) is not None
+
+
+message_types = MessageTypes()
+
+
+def message_type(cls: Type[SerializableDataclass]) -> Type[SerializableDataclass]:
+    """ Class decorator: registers message class, which is not derived from SerializableObject/RpcObject """
+    return message_types.add(cls)
+
+
+def message_class(c_type: Union[str, int]) -> Type[SerializableDataclass]:
+    """ Message class by name or type id (binary codec), raises UnknownMessageType for unknown types """
+    return message_types[c_type]
+
+
+def c_type_name(c_type: Union[str, int]) -> str:
+    """ Class name of c_type, type ids of unknown classes as str """
+    if isinstance(c_type, str):
+        return c_type
+    cls = message_types.get(c_type)
+    return str(c_type) if cls is None else cls.__name__
+
+
+def peek_c_type(
+    msg: Union[str, bytes], content_type: str = None, headers: Mapping = None
+) -> Optional[str]:
+    """ c_type of serialized message, None for other bodies (no error logging), from headers if present """
+    try:
+        return c_type_name(codec_for(content_type, msg).peek(msg, headers))
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
 def convert_to_utc(obj):
     # convert from local timezone to UTC
     for field in obj.__class__.__dataclass_fields__.values():
@@ -104,34 +188,54 @@ class RpcMessage:
 @dataclass_json
 @dataclass()
 class RpcObject:
-    def to_rpc(self, rt: RpcMessageTypes = None) -> str:
-        rpc_message = RpcMessage(c_type=self.__class__.__name__, c_data=self.to_json())
-        if rt is not None:
-            rpc_message.request_type = rt
-        return rpc_message.to_json()
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        message_types.add(cls)
+
+    def to_rpc(
+        self, rt: RpcMessageTypes = None, content_type: str = None
+    ) -> Union[str, bytes]:
+        rt = rt or RpcMessageTypes.RPC_REQUEST
+        return codec_for(content_type).encode(self, rt.value)
+
+    def to_envelope(
+        self, rt: RpcMessageTypes = None, content_type: str = None
+    ) -> Tuple[Union[str, bytes], Dict[str, Any]]:
+        """ (body, headers): c_type and request type in headers, body is the plain payload """
+        rt = rt or RpcMessageTypes.RPC_REQUEST
+        return codec_for(content_type).encode_headers(self, rt.value)
 
     @staticmethod
-    def from_rpc(msg: str) -> Tuple[RpcMessageTypes, SerializableDataclass]:
-        rpc_msg = RpcMessage.from_json(msg)
+    def from_rpc(
+        msg: Union[str, bytes], content_type: str = None, headers: Mapping = None
+    ) -> Tuple[RpcMessageTypes, SerializableDataclass]:
+        codec = codec_for(content_type, msg)
+        envelope = codec.decode(msg, headers)
+
+        class_ = message_class(envelope.c_type)
+        rpc_obj = codec.load(class_, envelope.payload)  # datetimes in UTC
+        return (
+            RpcMessageTypes(envelope.request_type or RpcMessageTypes.RPC_REQUEST.value),
+            rpc_obj,
+        )
 
-        module = importlib.import_module("messages")
-        class_ = getattr(module, rpc_msg.c_type)
-        rpc_obj = class_.from_json(rpc_msg.c_data)
-        rpc_obj = convert_to_utc(rpc_obj)
-        return RpcMessageTypes(rpc_msg.request_type), rpc_obj
 
+message_types.add(RpcObject)
 
-def to_rpc(obj: SerializableDataclass) -> str:
-    """ Creates self describing serialized json RPC object """
-    return RpcMessage(c_type=obj.__class__.__name__, c_data=obj.to_json()).to_json()
 
+def to_rpc(obj: SerializableDataclass, content_type: str = None) -> Union[str, bytes]:
+    """ Creates self describing serialized RPC object, default: json """
+    return codec_for(content_type).encode(obj, RpcMessageTypes.RPC_REQUEST.value)
 
-def from_rpc(msg: str) -> SerializableDataclass:
-    rpc_msg = RpcMessage.from_json(msg)
 
-    module = importlib.import_module("messages")
-    class_ = getattr(module, rpc_msg.c_type)
-    rpc_obj = class_.from_json(rpc_msg.c_data)
+def from_rpc(
+    msg: Union[str, bytes], content_type: str = None, headers: Mapping = None
+) -> SerializableDataclass:
+    codec = codec_for(content_type, msg)
+    envelope = codec.decode(msg, headers)
+
+    class_ = message_class(envelope.c_type)
+    rpc_obj = codec.load(class_, envelope.payload)
     return rpc_obj
 
 
@@ -189,6 +293,15 @@ class Shutdown(RpcObject):
     result: str = ""
 
 
+@dataclass_json
+@dataclass()
+class StreamCredit(RpcObject):
+    """ Grants the responder of a streaming RPC further chunks, cancel: caller stopped consuming """
+
+    credit: int = 0
+    cancel: bool = False
+
+
 # @api.schema("ExampleMethodParameter")
 # class ExampleMethodParameterSchema(Schema):
 #     x = fields.Float()
@@ -222,9 +335,10 @@ class TraceStoreMessage:
     routing_key: str = ""
 
     @staticmethod
-    def from_msg(msg: IncomingMessage):
+    def from_msg(msg: IncomingMessage, body: str = None):
+        """ body: decoded body, if already at hand """
         self = TraceStoreMessage(
-            body=msg.body.decode(),
+            body=msg.body.decode(errors="replace") if body is None else body,
             body_size=msg.body_size,
             headers=msg.headers_raw,
             content_type=msg.content_type,
@@ -235,7 +349,7 @@ class TraceStoreMessage:
             reply_to=msg.reply_to,
             expiration=msg.expiration,
             message_id=msg.message_id,
-            timestamp=time.mktime(msg.timestamp),
+            timestamp=time.mktime(msg.timestamp) if msg.timestamp else None,
             type=msg.type,
             user_id=msg.user_id,
             app_id=msg.app_id,
@@ -263,31 +377,44 @@ class SerializedObject:
 @dataclass_json
 @dataclass()
 class SerializableObject:
-    def serialize(self, to_dict=False) -> str:
-        """ Serializes dataclass including type into SerializedObject """
-        obj = SerializedObject(
-            c_type=self.__class__.__name__,
-            c_data=self.to_json(),  # method from dataclass_json
-        )
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        message_types.add(cls)
+
+    def serialize(self, to_dict=False, content_type: str = None) -> Union[str, bytes]:
+        """ Serializes dataclass including type into SerializedObject, default: json """
+        return codec_for(content_type).encode(self)
 
-        return obj.to_json()
+    def to_envelope(
+        self, content_type: str = None
+    ) -> Tuple[Union[str, bytes], Dict[str, Any]]:
+        """ (body, headers): c_type in headers, body is the plain payload """
+        return codec_for(content_type).encode_headers(self)
 
     @staticmethod
     def deserialize(
-        msg: str, msg_type: Type["SerializableObject"] = None
+        msg: Union[str, bytes],
+        msg_type: Type["SerializableObject"] = None,
+        content_type: str = None,
+        headers: Mapping = None,
     ) -> SerializableDataclass:
-        """ Deserializes SerializedObject into correct type """
+        """ Deserializes SerializedObject into correct type, codec by content_type or recognized by msg
+
+            The envelope is taken from headers if present, else from the nested format of msg.
+        """
 
         obj = None
-        serialized_obj = SerializableObject.extract_serialized_obj(msg)
+        codec = codec_for(content_type, msg)
+        serialized_obj = SerializableObject.extract_serialized_obj(
+            msg, content_type, headers
+        )
 
-        # load msg_type from module messages.py for deserialization
+        # look up msg_type in registry of message classes for deserialization
         if serialized_obj is not None:
             if not msg_type:
-                module = importlib.import_module("messages")
                 try:
-                    msg_type = getattr(module, serialized_obj.c_type)
-                except AttributeError as e:
+                    msg_type = message_class(serialized_obj.c_type)
+                except UnknownMessageType as e:
                     _log.error(
                         f"Object type unknown: {serialized_obj.c_type}.",
                         exc_info=sys.exc_info(),
@@ -295,16 +422,16 @@ class SerializableObject:
                     # raise WrongMessageFormatException(e).with_traceback(sys.exc_info()[2])
                     return obj
 
-            obj = msg_type.from_json(serialized_obj.c_data)
-            obj = convert_to_utc(obj)
+            obj = codec.load(msg_type, serialized_obj.payload)  # datetimes in UTC
         return obj
 
     @staticmethod
-    def extract_serialized_obj(msg):
+    def extract_serialized_obj(
+        msg, content_type: str = None, headers: Mapping = None
+    ) -> Optional[Envelope]:
         try:
-            serialized_obj = SerializedObject.from_json(msg)
-            return serialized_obj
-        except (KeyError, JSONDecodeError) as e:
+            return codec_for(content_type, msg).decode(msg, headers)
+        except (KeyError, TypeError, ValueError) as e:  # JSONDecodeError is ValueError
             _log.error(
                 f"Wrong message format: {msg}. Expected {{c_type: str, c_data: str}}.",
                 exc_info=sys.exc_info(),
@@ -313,9 +440,18 @@ class SerializableObject:
             # return SerializedObject(c_type="NoneTypeOrWrongMessageFormat", c_data="")
 
     @classmethod
-    def extract_type(cls, msg: str) -> str:
-        serialized_obj = cls.extract_serialized_obj(msg)
-        return "NoneType" if serialized_obj is None else serialized_obj.c_type
+    def extract_type(
+        cls, msg: Union[str, bytes], content_type: str = None, headers: Mapping = None
+    ) -> str:
+        if has_envelope(headers):
+            return c_type_name(headers[C_TYPE_HEADER])  # body untouched
+        serialized_obj = cls.extract_serialized_obj(msg, content_type)
+        return (
+            "NoneType" if serialized_obj is None else c_type_name(serialized_obj.c_type)
+        )
+
+
+message_types.add(SerializableObject)
 
 
 @dataclass_json
@@ -358,3 +494,50 @@ class CoreStatus:
 @dataclass
 class PongControl(SerializableObject):
     status: CoreStatus
+
+
+@dataclass_json
+@dataclass
+class Heartbeat(SerializableObject):
+    """ Presence of an agent, join: receivers reply with their heartbeat, leave: agent stops """
+
+    seq: int = 0
+    join: bool = False
+    leave: bool = False
+
+
+@dataclass_json
+@dataclass()
+class GetStatus(RpcObject):
+    status: Optional[CoreStatus] = None
+
+
+@dataclass_json
+@dataclass
+class GossipEntry:
+    """ Versioned state of an agent, status is only sent with a newer version """
+
+    name: str
+    # start time of the agent in ms: heartbeat and version restart with a new generation
+    generation: int = 0
+    heartbeat: int = 0
+    version: int = 0
+    updated: float = 0.0  # time.time() when version was created by the agent
+    status: Optional[CoreStatus] = None
+
+
+@dataclass_json
+@dataclass
+class GossipDigest(SerializableObject):
+    """ Known (generation, heartbeat, version) per agent """
+
+    digest: Dict[str, List[int]] = field(default_factory=dict)
+
+
+@dataclass_json
+@dataclass
+class GossipDelta(SerializableObject):
+    """ Entries the receiver is missing, request: digest of entries the sender wants back """
+
+    entries: List[GossipEntry] = field(default_factory=list)
+    request: Dict[str, List[int]] = field(default_factory=dict)
@@ -0,0 +1,139 @@
+""" Construction of outgoing messages
+
+    Every agent keeps a ``MessageTemplate`` with the properties which are the same for all its messages
+    (content_type, app_id, user_id). Messages are created from the template without the property
+    normalization of ``aio_pika.Message.__init__``.
+
+    Bodies can be ``str`` (encoded with utf-8) or bytes-like (``bytes``, ``bytearray``, ``memoryview``).
+    Bytes-like bodies are not copied: buffers must not be modified until the publish has completed.
+
+    The content_type is passed explicitly by the sender (e.g. ``Core.encode_message``), bodies are never
+    inspected: raw payloads get the content_type of the template, whatever their first byte.
+
+    With compression, bodies of at least ``compression_threshold`` bytes are compressed and
+    the message gets the ``content_encoding`` (see ``content_encoding.py``).
+"""
+from __future__ import (
+    annotations,
+)  # make all type hints be strings and skip evaluating them
+
+import time
+from typing import Union
+
+from aio_pika import Message
+from aio_pika.message import HeaderProxy, format_headers
+
+from content_encoding import compressor
+
+Body = Union[str, bytes, bytearray, memoryview]
+
+TRACE_BODY_LIMIT = 1024  # binary bodies up to this size are traced decoded
+
+
+def as_bytes(body: Body) -> Union[bytes, memoryview]:
+    """ Encodes str, passes bytes through, wraps other buffers in a byte view (no copy) """
+    if isinstance(body, bytes):
+        return body
+    if isinstance(body, str):
+        return body.encode()
+    view = body if isinstance(body, memoryview) else memoryview(body)
+    return view if view.format == "B" and view.ndim == 1 else view.cast("B")
+
+
+def trace_body(body: Body) -> str:
+    """ Representation of a body in the trace store """
+    if isinstance(body, str):
+        return body
+    size = memoryview(body).nbytes
+    if size > TRACE_BODY_LIMIT:
+        return f"<{size} bytes>"
+    return bytes(body).decode(errors="replace")
+
+
+class OutgoingMessage(Message):
+    """ Message created from a template, properties are taken over as they are """
+
+    __slots__ = ()
+
+    def __init__(
+        self,
+        body: Union[bytes, memoryview],
+        template: Message,
+        type: str,
+        correlation_id: str = None,
+        headers: dict = None,
+        timestamp: time.struct_time = None,
+        reply_to: str = None,
+        content_encoding: str = None,
+        content_type: str = None,
+    ):
+        # bypass the lock check of Message.__setattr__, the new message cannot be locked yet
+        _set = object.__setattr__
+        # slots of aio_pika.Message (aio-pika pinned, checked by test_outgoing.test_message_slots_of_pinned_aio_pika)
+        _set(self, "_Message__lock", False)
+        _set(self, "body", body)
+        _set(self, "body_size", len(body) if isinstance(body, bytes) else body.nbytes)
+        headers_raw = format_headers(headers) if headers else {}
+        _set(self, "headers_raw", headers_raw)
+        _set(self, "_headers", HeaderProxy(headers_raw))
+        _set(self, "content_type", content_type or template.content_type)
+        _set(self, "content_encoding", content_encoding or template.content_encoding)
+        _set(self, "delivery_mode", template.delivery_mode)
+        _set(self, "priority", template.priority)
+        _set(self, "correlation_id", correlation_id)
+        _set(self, "reply_to", reply_to or template.reply_to)
+        _set(self, "expiration", template.expiration)
+        _set(self, "message_id", template.message_id)
+        _set(self, "timestamp", timestamp)
+        _set(self, "type", type)
+        _set(self, "user_id", template.user_id)
+        _set(self, "app_id", template.app_id)
+
+
+class MessageTemplate(object):
+    """ Per-agent properties of outgoing messages """
+
+    def __init__(
+        self,
+        app_id: str,
+        *,
+        user_id: str = "guest",
+        content_type: str = "application/json",
+        timestamp: bool = True,
+        compression: str = None,
+        compression_threshold: int = 1024,
+    ):
+        self.template = Message(
+            body=b"", content_type=content_type, app_id=app_id, user_id=user_id
+        )
+        self.timestamp = timestamp
+        self.compression = compression
+        self.compression_threshold = compression_threshold
+        self._compress = compressor(compression) if compression else None
+
+    def create(
+        self,
+        body: Body,
+        msg_type: str,
+        correlation_id: str = None,
+        headers: dict = None,
+        reply_to: str = None,
+        content_type: str = None,
+    ) -> OutgoingMessage:
+        """ Message with body, content_type defaults to the one of the template """
+        body = as_bytes(body)
+        content_encoding = None
+        if self._compress is not None and len(body) >= self.compression_threshold:
+            body = self._compress(body)
+            content_encoding = self.compression
+        return OutgoingMessage(
+            body,
+            self.template,
+            type=msg_type,
+            correlation_id=correlation_id,
+            headers=headers,
+            timestamp=time.localtime() if self.timestamp else None,
+            reply_to=reply_to,
+            content_encoding=content_encoding,
+            content_type=content_type,
+        )
@@ -0,0 +1,130 @@
+""" Routing of incoming messages to behaviours
+
+    Behaviours declare their interest as ``Subscription``s: message ``type``, ``c_type`` of the serialized
+    payload (message header or body) and/or AMQP routing key pattern (``*``, ``#``). Core keeps a ``RoutingTable`` indexed by
+    message type and hands each message only to matching behaviours.
+
+    Behaviours without subscriptions receive all messages (broadcast).
+"""
+from __future__ import (
+    annotations,
+)  # make all type hints be strings and skip evaluating them
+
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from incoming import SharedMessage
+from messages import peek_c_type
+from utils import topic_matches
+
+if TYPE_CHECKING:
+    from aio_pika import IncomingMessage
+    from behaviour import Behaviour
+
+_NOT_PARSED = object()
+
+
+@dataclass(frozen=True)
+class Subscription:
+    """ Matches messages by all given fields, None matches everything """
+
+    type: Optional[str] = None  # message type property, e.g. msg_type of direct_send
+    # payload type of SerializableObject/RpcObject messages
+    c_type: Optional[str] = None
+    routing_key: Optional[str] = None  # AMQP topic pattern
+
+    def matches(self, message: IncomingMessage, c_type: Optional[str]) -> bool:
+        if self.type is not None and message.type != self.type:
+            return False
+        if self.c_type is not None and c_type != self.c_type:
+            return False
+        if self.routing_key is not None and not topic_matches(
+            self.routing_key, message.routing_key or ""
+        ):
+            return False
+        return True
+
+
+def extract_c_type(
+    body: bytes, content_type: str = None, headers: Mapping = None
+) -> Optional[str]:
+    """ c_type of serialized payload, None for other bodies (no error logging)
+
+        Taken from headers without touching the body if the envelope travels in headers.
+    """
+    return peek_c_type(body, content_type, headers)
+
+
+def message_c_type(message: IncomingMessage) -> Optional[str]:
+    """ c_type of message, shared messages decode their envelope once for routing and behaviours """
+    if isinstance(message, SharedMessage):
+        return message.c_type
+    return extract_c_type(message.body, message.content_type, message.headers)
+
+
+class RoutingTable(object):
+    """ Behaviours by subscription, indexed by message type """
+
+    def __init__(self):
+        self.broadcast: List[Behaviour] = list()
+        self.by_type: Dict[str, List[Tuple[Subscription, Behaviour]]] = dict()
+        self.any_type: List[Tuple[Subscription, Behaviour]] = list()
+
+    def add(
+        self, behaviour: Behaviour, subscriptions: Iterable[Subscription] = None
+    ) -> None:
+        """ Registers behaviour, without subscriptions it receives all messages """
+        self.remove(behaviour)
+        if subscriptions is None:
+            self.broadcast.append(behaviour)
+            return
+        for subscription in subscriptions:
+            if subscription.type is None:
+                self.any_type.append((subscription, behaviour))
+            else:
+                self.by_type.setdefault(subscription.type, list()).append(
+                    (subscription, behaviour)
+                )
+
+    def remove(self, behaviour: Behaviour) -> None:
+        if behaviour in self.broadcast:
+            self.broadcast.remove(behaviour)
+        self.any_type = [entry for entry in self.any_type if entry[1] is not behaviour]
+        for msg_type in list(self.by_type):
+            entries = [
+                entry for entry in self.by_type[msg_type] if entry[1] is not behaviour
+            ]
+            if entries:
+                self.by_type[msg_type] = entries
+            else:
+                del self.by_type[msg_type]
+
+    def route(self, message: IncomingMessage) -> List[Behaviour]:
+        """ Behaviours interested in message, each at most once """
+        candidates = self.by_type.get(message.type)
+        if not candidates and not self.any_type:
+            return self.broadcast
+
+        behaviours = list(self.broadcast)
+        c_type = _NOT_PARSED
+        for entries in (candidates or (), self.any_type):
+            for subscription, behaviour in entries:
+                if behaviour in behaviours:
+                    continue
+                if subscription.c_type is not None and c_type is _NOT_PARSED:
+                    c_type = message_c_type(message)  # once per message
+                if subscription.matches(
+                    message, None if c_type is _NOT_PARSED else c_type
+                ):
+                    behaviours.append(behaviour)
+        return behaviours
+
+    def __len__(self):
+        return (
+            len(self.broadcast)
+            + len(self.any_type)
+            + sum(map(len, self.by_type.values()))
+        )
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(broadcast={len(self.broadcast)}, types={sorted(self.by_type)}, any_type={len(self.any_type)})"
@@ -0,0 +1,191 @@
+""" Pending RPC calls and streams of a Core
+
+    All outstanding calls share one deadline heap and one timer (``loop.call_at``) for the earliest
+    deadline, instead of one timeout context per call. Replies arriving after the timeout are
+    dropped and counted.
+
+    Streaming RPC: the response is sent as a sequence of chunks with the correlation_id of the request.
+    Flow control is credit based: the caller announces a window of chunks in the request headers and
+    grants further credit (``StreamCredit``) as it consumes chunks. The responder never has more chunks
+    in flight than granted.
+"""
+from __future__ import (
+    annotations,
+)  # make all type hints be strings and skip evaluating them
+
+import asyncio
+import heapq
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+# request: initial credit of caller, marks streaming request
+STREAM_WINDOW_HEADER = "x-stream-window"
+STREAM_END_HEADER = "x-stream-end"  # response: 1 for last chunk
+
+_log = logging.getLogger(__name__)
+
+
+class PendingCalls(object):
+    """ Futures of outstanding RPC calls by correlation_id, expired by a single timer """
+
+    def __init__(self):
+        self.calls: Dict[str, asyncio.Future] = dict()
+        self.late_replies = 0  # replies without pending call: timed out or unknown
+        self.timeouts = 0
+        # heap, entries of resolved calls are skipped
+        self._deadlines: List[Tuple[float, str]] = list()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._timer_at: Optional[float] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def add(self, correlation_id: str, timeout: Optional[float]) -> asyncio.Future:
+        """ Registers call, the future raises asyncio.TimeoutError after timeout seconds (None: no timeout) """
+        if correlation_id in self.calls:
+            raise ValueError(f"Duplicate correlation_id: {correlation_id}")
+        if self._loop is None:
+            self._loop = asyncio.get_event_loop()
+
+        future = self.calls[correlation_id] = self._loop.create_future()
+        if timeout is not None:
+            deadline = self._loop.time() + timeout
+            heapq.heappush(self._deadlines, (deadline, correlation_id))
+            if self._timer_at is None or deadline < self._timer_at:
+                self._schedule(deadline)
+        return future
+
+    def resolve(self, correlation_id: str, result: Any) -> bool:
+        """ Sets result of pending call, returns False for late or unknown replies """
+        future = self.calls.pop(correlation_id, None)
+        if future is None or future.done():
+            self.late_replies += 1
+            return False
+        future.set_result(result)
+        self._compact()
+        return True
+
+    def discard(self, correlation_id: str) -> None:
+        """ Forgets call, e.g. when the request could not be sent """
+        future = self.calls.pop(correlation_id, None)
+        if future is not None and not future.done():
+            future.cancel()
+
+    def cancel_all(self) -> None:
+        for future in self.calls.values():
+            if not future.done():
+                future.cancel()
+        self.calls.clear()
+        self._deadlines.clear()
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = self._timer_at = None
+
+    def _schedule(self, deadline: float) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = self._loop.call_at(deadline, self._expire)
+        self._timer_at = deadline
+
+    def _expire(self) -> None:
+        self._timer = self._timer_at = None
+        now = self._loop.time()
+        deadlines = self._deadlines
+        while deadlines and deadlines[0][0] <= now:
+            _, correlation_id = heapq.heappop(deadlines)
+            future = self.calls.pop(correlation_id, None)
+            if future is not None and not future.done():
+                future.set_exception(asyncio.TimeoutError())
+                self.timeouts += 1
+        if deadlines:
+            self._schedule(deadlines[0][0])
+
+    def _compact(self) -> None:
+        """ Drops heap entries of resolved calls, keeps memory bounded by the number of pending calls """
+        if len(self._deadlines) > 2 * len(self.calls) + 64:
+            self._deadlines = [
+                entry for entry in self._deadlines if entry[1] in self.calls
+            ]
+            heapq.heapify(self._deadlines)
+
+    def __len__(self):
+        return len(self.calls)
+
+    def __contains__(self, correlation_id: str):
+        return correlation_id in self.calls
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}(pending={len(self.calls)}, timeouts={self.timeouts}, "
+            f"late_replies={self.late_replies})"
+        )
+
+
+class OutgoingStream(object):
+    """ Responder side of a streaming RPC: credit granted by the caller """
+
+    def __init__(self, credit: int):
+        self.credit = credit
+        self.task: Optional[asyncio.Task] = None
+        self._granted = asyncio.Event()
+
+    def grant(self, credit: int) -> None:
+        self.credit += credit
+        self._granted.set()
+
+    async def acquire(self, timeout: Optional[float]) -> None:
+        """ Takes one credit, raises asyncio.TimeoutError if caller does not grant credit in time """
+        while self.credit <= 0:
+            self._granted.clear()
+            await asyncio.wait_for(self._granted.wait(), timeout)
+        self.credit -= 1
+
+
+class PendingStreams(object):
+    """ Streaming RPC calls by correlation_id: chunk queues of the caller, credits of the responder """
+
+    def __init__(self):
+        self.incoming: Dict[str, asyncio.Queue] = dict()
+        self.outgoing: Dict[str, OutgoingStream] = dict()
+
+    def open_incoming(self, correlation_id: str) -> asyncio.Queue:
+        if correlation_id in self.incoming:
+            raise ValueError(f"Duplicate correlation_id: {correlation_id}")
+        queue = self.incoming[correlation_id] = asyncio.Queue()
+        return queue
+
+    def deliver(self, correlation_id: str, chunk: Any, end: bool) -> bool:
+        """ Enqueues chunk for caller, returns False if there is no such stream """
+        queue = self.incoming.get(correlation_id)
+        if queue is None:
+            return False
+        queue.put_nowait((chunk, end))
+        return True
+
+    def close_incoming(self, correlation_id: str) -> None:
+        self.incoming.pop(correlation_id, None)
+
+    def open_outgoing(self, correlation_id: str, credit: int) -> OutgoingStream:
+        stream = self.outgoing[correlation_id] = OutgoingStream(credit)
+        return stream
+
+    def grant(self, correlation_id: str, credit: int) -> bool:
+        stream = self.outgoing.get(correlation_id)
+        if stream is None:
+            return False
+        stream.grant(credit)
+        return True
+
+    def cancel_outgoing(self, correlation_id: str) -> None:
+        stream = self.outgoing.pop(correlation_id, None)
+        if stream is not None and stream.task is not None:
+            stream.task.cancel()
+
+    def close_outgoing(self, correlation_id: str) -> None:
+        self.outgoing.pop(correlation_id, None)
+
+    def cancel_all(self) -> None:
+        for correlation_id in list(self.outgoing):
+            self.cancel_outgoing(correlation_id)
+        self.incoming.clear()
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(incoming={len(self.incoming)}, outgoing={len(self.outgoing)})"
@@ -0,0 +1,201 @@
+""" Generated encoders/decoders of message dataclasses
+
+    For every message class an ``encode(obj) -> dict`` and ``decode(dict) -> obj`` function is generated
+    from its fields on first use and cached. They produce the same values as dataclasses_json
+    (``to_dict(encode_json=False)`` with datetime as timestamp, ``from_dict``), without schema machinery
+    and reflection per message:
+
+    - datetime: timestamp, decoded as UTC datetime (like messages.convert_to_utc)
+    - nested dataclasses, List/Dict of them, Optional: generated code of the nested class
+    - Enum: value
+    - str, int, float, bool: passed through
+    - other lists, dicts, Any: converted like dataclasses_json, which converts dataclasses, tuples and
+      datetimes found in untyped containers as well (e.g. ListTraceStore.traces), passed through on decode
+
+    Classes with other field types or with dataclasses_json field configuration fall back to
+    dataclasses_json.
+"""
+from __future__ import (
+    annotations,
+)  # make all type hints be strings and skip evaluating them
+
+import dataclasses
+import typing
+from collections.abc import Mapping
+from datetime import datetime
+from enum import Enum
+from typing import Any, Callable, Dict, Tuple, Type
+
+import pytz
+
+Encoder = Callable[[Any], Dict[str, Any]]
+Decoder = Callable[[Dict[str, Any]], Any]
+
+_SCALARS = (str, int, float, bool)
+
+_serializers: Dict[Type, Tuple[Encoder, Decoder]] = dict()
+
+
+class Unsupported(TypeError):
+    pass
+
+
+def _from_timestamp(value):
+    return (
+        value
+        if value is None or isinstance(value, datetime)
+        else datetime.fromtimestamp(value, pytz.UTC)
+    )
+
+
+def _to_utc(value):
+    return None if value is None else value.astimezone(pytz.UTC)
+
+
+def _plain(value):
+    """ Generic conversion of untyped values into json/binary codec values """
+    if value is None or isinstance(value, _SCALARS):
+        return value
+    if isinstance(value, datetime):
+        return value.timestamp()
+    if dataclasses.is_dataclass(value):
+        return serializer(type(value))[0](value)
+    if isinstance(value, Mapping):
+        return {key: _plain(item) for key, item in value.items()}
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [_plain(item) for item in value]
+    return value
+
+
+class _Generator(object):
+    """ Python expressions converting a value of a field type, helpers are collected in namespace """
+
+    def __init__(self, compiling: tuple):
+        self.namespace = {"_from_timestamp": _from_timestamp, "_plain": _plain}
+        # classes being compiled: recursive types are not supported
+        self.compiling = compiling
+
+    def _add(self, value) -> str:
+        name = f"_h{len(self.namespace)}"
+        self.namespace[name] = value
+        return name
+
+    def expr(self, tp, value: str, encode: bool, depth: int = 0) -> str:
+        """ Expression converting value, returns value itself for pass through """
+        origin = getattr(tp, "__origin__", None)
+        args = getattr(tp, "__args__", ()) or ()
+        if origin is typing.Union:
+            members = [arg for arg in args if arg is not type(None)]
+            if len(members) != 1:
+                raise Unsupported(f"Union type: {tp}")
+            return self.expr(members[0], value, encode, depth)
+
+        if tp in _SCALARS:
+            return value
+        if tp is datetime:
+            if not encode:
+                return f"_from_timestamp({value})"  # handles None
+            converted = f"{value}.timestamp()"
+        elif dataclasses.is_dataclass(tp):
+            if tp in self.compiling:
+                raise Unsupported(f"Recursive type: {tp}")
+            encoder, decoder = _compile(tp, self.compiling)
+            converted = f"{self._add(encoder if encode else decoder)}({value})"
+        elif isinstance(tp, type) and issubclass(tp, Enum):
+            converted = f"{value}.value" if encode else f"{self._add(tp)}({value})"
+        elif (
+            origin in (list, dict) and args and not isinstance(args[-1], typing.TypeVar)
+        ):
+            item = f"_i{depth}"
+            item_expr = self.expr(args[-1], item, encode, depth + 1)
+            if item_expr == item:
+                return f"_plain({value})" if encode else value
+            if origin is list:
+                converted = f"[{item_expr} for {item} in {value}]"
+            else:
+                converted = f"{{_k{depth}: {item_expr} for _k{depth}, {item} in {value}.items()}}"
+        elif (
+            tp in (list, dict, Any)
+            or origin in (list, dict)
+            or isinstance(tp, typing.TypeVar)
+        ):
+            return f"_plain({value})" if encode else value
+        else:
+            raise Unsupported(f"Field type: {tp}")
+        # fields may be None, even if not declared as Optional
+        return f"(None if {value} is None else {converted})"
+
+
+def _compile(cls: Type, compiling: tuple = ()) -> Tuple[Encoder, Decoder]:
+    if cls in _serializers:
+        return _serializers[cls]
+
+    hints = typing.get_type_hints(cls)
+    generator = _Generator(compiling + (cls,))
+    encoded, decoded = list(), list()
+    for field in dataclasses.fields(cls):
+        if not field.init or field.metadata.get("dataclasses_json"):
+            raise Unsupported(f"Field configuration of {cls.__name__}.{field.name}")
+        tp = hints[field.name]
+        name = repr(field.name)
+        encoded.append(
+            f"{name}: {generator.expr(tp, f'obj.{field.name}', encode=True)}"
+        )
+
+        if field.default is not dataclasses.MISSING:
+            value = f"d.get({name}, {generator._add(field.default)})"
+        elif field.default_factory is not dataclasses.MISSING:
+            value = f"(d[{name}] if {name} in d else {generator._add(field.default_factory)}())"
+        else:
+            value = f"d[{name}]"
+        decoded.append(f"{field.name}={generator.expr(tp, value, encode=False)}")
+
+    cls_name = generator._add(cls)
+    source = (
+        f"def encode(obj):\n    return {{{', '.join(encoded)}}}\n\n"
+        f"def decode(d):\n    return {cls_name}({', '.join(decoded)})\n"
+    )
+    namespace = generator.namespace
+    exec(compile(source, f"<serializer {cls.__qualname__}>", "exec"), namespace)
+    _serializers[cls] = namespace["encode"], namespace["decode"]
+    return _serializers[cls]
+
+
+def _fallback(cls: Type) -> Tuple[Encoder, Decoder]:
+    """ dataclasses_json, datetimes converted to UTC """
+    datetimes = [
+        field.name
+        for field in dataclasses.fields(cls)
+        if field.type in (datetime, "datetime")
+    ]
+
+    def encode(obj):
+        return _plain(obj.to_dict(encode_json=False))
+
+    def decode(d):
+        obj = cls.from_dict(d)
+        for name in datetimes:
+            setattr(obj, name, _to_utc(getattr(obj, name)))
+        return obj
+
+    return encode, decode
+
+
+def serializer(cls: Type) -> Tuple[Encoder, Decoder]:
+    """ (encode, decode) of message class, generated on first use """
+    try:
+        return _serializers[cls]
+    except KeyError:
+        pass
+    try:
+        return _compile(cls)
+    except (Unsupported, NameError):  # NameError: unresolvable type hint
+        _serializers[cls] = _fallback(cls)
+        return _serializers[cls]
+
+
+def is_generated(cls: Type) -> bool:
+    """ False if cls falls back to dataclasses_json """
+    return serializer(cls)[0].__code__.co_filename.startswith("<serializer")
@@ -1,7 +1,9 @@
 from __future__ import annotations  # make all type hints be strings and skip evaluating them
 from typing import TYPE_CHECKING, Any, Optional, ClassVar
 
-from messages import TraceStoreMessage
+from content_encoding import BodyTooLarge
+from mailboxes import MailboxFull
+from incoming import receive
 from mode.utils.logging import CompositeLogger, get_logger
 
 if TYPE_CHECKING:
@@ -13,7 +15,6 @@ import inspect
 import logging
 
 from aio_pika import Queue, IncomingMessage
-from aio_pika.patterns import RPC
 
 
 class SubSystem(object):
@@ -80,7 +81,7 @@ class PubSub(SubSystem):
 
     async def _configure_pubsub(self):
         await self.core.configure_exchanges()
-        self.pubsub_queue = await self.core.channel.declare_queue(
+        self.pubsub_queue = await self.behaviour.channel.declare_queue(
             name=self.queue_name, auto_delete=False, durable=False
         )
         self.log.info(f"Queue declared: {self.queue_name}")
@@ -103,12 +104,19 @@ class PubSub(SubSystem):
         """
         on_message doesn't necessarily have to be defined as async.
         """
-        async with message.process():
-            self.log.debug(f"Received:")
-            self.log.debug(f"   {message.info()}")
-            self.log.debug(f"   {message.body}")
-            self.core.traces.append(TraceStoreMessage.from_msg(message), category="incoming")
-            await self.behaviour.enqueue(message)
+        try:
+            # ack only after message is in mailbox: a blocking mailbox holds back the ack
+            async with message.process():
+                message = receive(message, self.core.max_decompressed_size)
+                if self.log.logger.isEnabledFor(logging.DEBUG):
+                    self.log.debug(f"Received:")
+                    self.log.debug(f"   {message.info()}")
+                    self.log.debug(f"   {message.text}")
+                self.core.message_log("received", message)
+                self.core.traces.append(message.trace, category="incoming")
+                await self.behaviour.enqueue(message)
+        except (MailboxFull, BodyTooLarge) as e:
+            self.log.warning(f"Message rejected: {e}")
 
     async def on_end(self):
         self.log.info(f"on_end: deleting queue {self.pubsub_queue}")
@@ -166,7 +174,7 @@ class RPC_SubSystem(SubSystem):
         await self._configure_rpc()
 
     async def _configure_rpc(self):
-        self.rpc = await RPC.create(self.core.channel)
+        self.rpc = await self.core.transport.create_rpc(self.behaviour.channel)
         for rpc_method in list_rpc_methods(self.behaviour):
             self.log.info(f"Registering RPC: {rpc_method.__name__}")
             await self.rpc.register(rpc_method.__name__, rpc_method, auto_delete=False)
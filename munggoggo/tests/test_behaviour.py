@@ -1,6 +1,7 @@
 import asyncio
 import logging
 from datetime import datetime
+from types import SimpleNamespace
 
 import pytest
 import pytz
@@ -9,6 +10,7 @@ from twpy import utcnow
 
 from dataclasses import dataclass
 from behaviour import Behaviour, SqlBehav
+from routing import Subscription
 from messages import DemoData, SerializableObject, CoreStatus
 from model import json_data
 
@@ -64,6 +66,108 @@ class TestBasics:
         assert behav.mailbox_size() == 0
 
 
+@pytest.mark.asyncio
+class TestSubscriptions:
+    async def test_routing(self, core1):
+        # given behaviours with and without subscription
+        all_msgs = Behaviour(core1)
+        custom = Behaviour(core1, subscriptions=[Subscription(type="CUSTOM")])
+        await core1.add_runtime_dependency(all_msgs)
+        await core1.add_runtime_dependency(custom)
+
+        # when messages of different type arrive
+        await core1.direct_send(msg="xxxxx", msg_type="xxx")
+        await core1.direct_send(msg="yyyyy", msg_type="CUSTOM")
+        await asyncio.sleep(0.1)  # relinquish cpu
+
+        # then behaviour with subscription gets only matching ones
+        assert all_msgs.mailbox_size() == 2
+        assert custom.mailbox_size() == 1
+        assert "yyyyy" in (await custom.receive()).body.decode()
+
+    async def test_shared_message(self, core1):
+        # given two behaviours subscribed to the same payload type
+        b1 = Behaviour(core1, subscriptions=[Subscription(c_type="DemoData")])
+        b2 = Behaviour(core1, subscriptions=[Subscription(c_type="DemoData")])
+        await core1.add_runtime_dependency(b1)
+        await core1.add_runtime_dependency(b2)
+
+        # when message arrives
+        await core1.direct_send(
+            msg=DemoData(message="Hallo").serialize(), msg_type="xxx"
+        )
+        await asyncio.sleep(0.1)  # relinquish cpu
+
+        # then both get the same message, decoded once
+        msg1, msg2 = await b1.receive(), await b2.receive()
+        assert msg1 is msg2
+        assert msg1.deserialize() is msg2.deserialize()
+        assert msg1.deserialize() == DemoData(message="Hallo")
+
+    async def test_stopped_behaviour_is_not_routed(self, core1):
+        b = Behaviour(core1)
+        await core1.add_runtime_dependency(b)
+        await b.stop()
+
+        assert (
+            core1.routes.route(
+                SimpleNamespace(type="xxx", routing_key="", body=b"", content_type=None)
+            )
+            == []
+        )
+
+
+@pytest.mark.asyncio
+class TestMailbox:
+    async def test_drop_newest(self, core1):
+        # given behaviour with bounded mailbox
+        b = Behaviour(core1, mailbox_size=1, mailbox_policy="drop-newest")
+        await core1.add_runtime_dependency(b)
+
+        # when more messages arrive than fit
+        for i in range(3):
+            await b.direct_send(msg=f"{i}:xxxxx", msg_type="xxx")
+        await asyncio.sleep(0.1)  # relinquish cpu
+
+        # then surplus is dropped and counted
+        assert b.mailbox_size() == 1
+        assert b.mailbox_stats()["dropped"] == 2
+        assert b.mailbox_stats()["high_water"] == 1
+
+    async def test_reject_all_or_nothing(self, core1):
+        # given two behaviours with policy reject, the second one gets full
+        first = Behaviour(core1, mailbox_size=10, mailbox_policy="reject")
+        second = Behaviour(core1, mailbox_size=1, mailbox_policy="reject")
+        await core1.add_runtime_dependency(first)
+        await core1.add_runtime_dependency(second)
+        await first.direct_send(msg="0:xxxxx", msg_type="xxx")
+        await asyncio.sleep(0.1)  # relinquish cpu
+
+        # when next message arrives
+        await first.direct_send(msg="1:xxxxx", msg_type="xxx")
+        await asyncio.sleep(0.1)  # relinquish cpu
+
+        # then it is rejected as a whole: no behaviour gets it
+        assert (first.mailbox_size(), second.mailbox_size()) == (1, 1)
+        assert second.mailbox_stats()["rejected"] == 1
+
+    async def test_block_holds_ack(self, core1):
+        # given behaviour with full blocking mailbox
+        b = Behaviour(core1, mailbox_size=1, mailbox_policy="block")
+        await core1.add_runtime_dependency(b)
+        await b.direct_send(msg="0:xxxxx", msg_type="xxx")
+        await asyncio.sleep(0.1)  # relinquish cpu
+
+        # when next message arrives, it waits in the delivery
+        await b.direct_send(msg="1:xxxxx", msg_type="xxx")
+        await asyncio.sleep(0.1)  # relinquish cpu
+        assert b.mailbox_size() == 1
+
+        # when behaviour receives, waiting message follows
+        assert "0:xxxxx" in (await b.receive(timeout=1)).body.decode()
+        assert "1:xxxxx" in (await b.receive(timeout=1)).body.decode()
+
+
 @pytest.fixture()
 async def sql_behav(core1):
     topics = ["x.y", "x.z", "a.#"]
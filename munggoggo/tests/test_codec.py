@@ -0,0 +1,147 @@
+from datetime import datetime
+
+import pytest
+import pytz
+
+from codec import (
+    BINARY,
+    C_TYPE_HEADER,
+    JSON,
+    MAGIC,
+    REQUEST_TYPE_HEADER,
+    BinaryCodec,
+    codec_for,
+    type_id,
+)
+from messages import (
+    CoreStatus,
+    DemoData,
+    GossipDelta,
+    GossipEntry,
+    Ping,
+    PongControl,
+    RpcMessageTypes,
+    RpcObject,
+    SerializableObject,
+    ServiceStatus,
+)
+from outgoing import MessageTemplate
+
+STATUS = CoreStatus(
+    name="core1",
+    state="running",
+    behaviours=[ServiceStatus(name="behav", state="running")],
+)
+
+
+@pytest.mark.parametrize(
+    "obj",
+    [
+        DemoData(message="Hallo", date=datetime(2019, 1, 1, tzinfo=pytz.UTC)),
+        PongControl(status=STATUS),
+        GossipDelta(
+            entries=[GossipEntry(name="core1", version=2, status=STATUS)],
+            request={"core2": [1, 0]},
+        ),
+    ],
+)
+def test_binary_roundtrip(obj):
+    # given binary serialized object
+    msg = obj.serialize(content_type=BINARY)
+    assert msg[0] == MAGIC
+
+    # then it is smaller than json and deserialized into equal object
+    assert len(msg) < len(obj.serialize())
+    assert SerializableObject.deserialize(msg, content_type=BINARY) == obj
+    assert SerializableObject.extract_type(msg, BINARY) == obj.__class__.__name__
+
+
+def test_binary_recognized_without_content_type():
+    msg = PongControl(status=STATUS).serialize(content_type=BINARY)
+    assert codec_for(None, msg).content_type == BINARY
+    assert codec_for(None, PongControl(status=STATUS).serialize()).content_type == JSON
+    assert SerializableObject.deserialize(msg) == PongControl(status=STATUS)
+
+
+def test_content_type_explicit_on_send():
+    # given raw body starting with the magic byte of the binary codec
+    template = MessageTemplate("core1")
+    raw = template.create(bytes([MAGIC]) + b"raw payload", "CUSTOM")
+
+    # then it keeps the content_type of the template, binary only if passed explicitly
+    assert raw.content_type == JSON
+    assert codec_for(raw.content_type, raw.body).content_type == JSON
+    msg = PongControl(status=STATUS).serialize(content_type=BINARY)
+    assert template.create(msg, "CUSTOM", content_type=BINARY).content_type == BINARY
+
+
+def test_binary_rpc():
+    msg = Ping(ping="Hallo").to_rpc(
+        rt=RpcMessageTypes.RPC_RESPONSE, content_type=BINARY
+    )
+
+    # then type id and request type travel in the header
+    envelope = BinaryCodec().decode(msg)
+    assert envelope.c_type == type_id("Ping")
+    assert envelope.request_type == RpcMessageTypes.RPC_RESPONSE.value
+
+    rt, ping = RpcObject.from_rpc(msg, BINARY)
+    assert rt is RpcMessageTypes.RPC_RESPONSE
+    assert ping == Ping(ping="Hallo")
+
+
+@pytest.mark.parametrize(
+    "msg",
+    [
+        b"\xb7",
+        b"\xb7\x00\x00\x00\x00\x00\x63",
+        bytes([MAGIC, 0, 0, 0, 0, 0, 9, 200]) + b"ab",
+    ],
+)
+def test_binary_wrong_format(msg):
+    assert SerializableObject.deserialize(msg, content_type=BINARY) is None
+
+
+def test_binary_unknown_type():
+    msg = bytes([MAGIC, 0, 0, 0, 0, 1, 11, 0])
+    assert SerializableObject.deserialize(msg) is None
+    assert SerializableObject.extract_type(msg) == "1"
+
+
+@pytest.mark.parametrize("content_type", [JSON, BINARY])
+def test_envelope_headers(content_type):
+    # given object with envelope in headers
+    obj = PongControl(status=STATUS)
+    body, headers = obj.to_envelope(content_type)
+
+    # then the body is the plain payload and the type travels in headers
+    assert headers == {C_TYPE_HEADER: codec_for(content_type).header_c_type(obj)}
+    assert len(body) < len(obj.serialize(content_type=content_type))
+    assert (
+        SerializableObject.deserialize(body, content_type=content_type, headers=headers)
+        == obj
+    )
+    assert (
+        SerializableObject.extract_type(b"not parsed", content_type, headers)
+        == "PongControl"
+    )
+
+
+@pytest.mark.parametrize("content_type", [JSON, BINARY])
+def test_envelope_headers_rpc(content_type):
+    body, headers = Ping(ping="Hallo").to_envelope(
+        RpcMessageTypes.RPC_RESPONSE, content_type
+    )
+    assert headers[REQUEST_TYPE_HEADER] == RpcMessageTypes.RPC_RESPONSE.value
+
+    rt, ping = RpcObject.from_rpc(body, content_type, headers)
+    assert rt is RpcMessageTypes.RPC_RESPONSE
+    assert ping == Ping(ping="Hallo")
+
+
+def test_nested_format_without_headers():
+    # nested format is still decoded when headers carry no envelope
+    msg = DemoData(message="Hallo").serialize()
+    assert SerializableObject.deserialize(msg, headers={"other": 1}) == DemoData(
+        message="Hallo"
+    )
@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+from container import AgentContainer
+from core import Core
+from transport import MemoryBroker, MemoryTransport, SharedTransport
+
+
+@pytest.fixture()
+def broker():
+    return MemoryBroker()
+
+
+@pytest.mark.asyncio
+class TestAgentContainer:
+    async def test_container(self, broker):
+        # given container with many agents
+        container = AgentContainer(transport=MemoryTransport(broker))
+        agents = [
+            container.add(Core(identity=f"core{i}", config=dict(PUBLISH_CHANNELS=0)))
+            for i in range(20)
+        ]
+
+        # when container is started
+        async with container:
+            # then all agents run on one connection
+            assert all(agent.started for agent in agents)
+            assert {id(agent.connection) for agent in agents} == {
+                id(container.connection)
+            }
+            assert len(container.connection.channels) == 20
+
+            # then agents can talk to each other
+            await agents[0].direct_send(msg="Hallo", msg_type="type", target="core19")
+            await asyncio.sleep(0.01)
+            received = [
+                msg for (ts, msg, cat) in agents[19].traces.filter(category="incoming")
+            ]
+            assert any(msg.type == "type" for msg in received)
+
+            # when agent is removed, its queues are deleted but connection is still open
+            await container.remove("core19")
+            assert "core19" not in broker.queues
+            assert not container.connection.is_closed
+
+        # then connection is closed after container has stopped
+        assert container.connection is None
+        assert not broker.queues
+
+    async def test_add_to_running_container(self, broker):
+        async with AgentContainer(transport=MemoryTransport(broker)) as container:
+            # when agent is added to running container
+            agent = container.add(Core(identity="late"))
+            await asyncio.sleep(0.01)
+
+            # then it is started on the shared connection
+            assert agent.started
+            assert agent.connection is container.connection
+
+    async def test_identity_conflict(self, broker):
+        container = AgentContainer(transport=MemoryTransport(broker))
+        container.add(Core(identity="core1"))
+
+        with pytest.raises(ValueError):
+            container.add(Core(identity="core1"))
+
+        with pytest.raises(ValueError):
+            container.add(Core(identity="core2", channel_number=7))
+            container.add(Core(identity="core3", channel_number=7))
+
+    async def test_shared_transport(self, broker):
+        # given shared transport
+        transport = SharedTransport(MemoryTransport(broker))
+        assert transport.shared
+
+        # then connect always returns the same connection
+        connections = await asyncio.gather(*(transport.connect() for _ in range(5)))
+        assert len({id(connection) for connection in connections}) == 1
+
+        await transport.close()
+        assert connections[0].is_closed
@@ -0,0 +1,70 @@
+import pytest
+from aio_pika import Message
+
+import zlib
+
+from content_encoding import BodyTooLarge, UnknownEncoding, compress, decompress
+from outgoing import MessageTemplate
+
+BODY = b'{"c_type": "DemoData", "c_data": "{\\"message\\": \\"Hallo\\"}"}' * 50
+
+
+@pytest.mark.parametrize("encoding", ["deflate", "gzip"])
+def test_compress_decompress(encoding):
+    # given compressed message
+    message = Message(body=compress(BODY, encoding), content_encoding=encoding)
+    assert message.body_size < len(BODY) / 5
+
+    # when received
+    decompress(message)
+
+    # then body is decoded
+    assert message.body == BODY
+    assert message.body_size == len(BODY)
+    assert message.content_encoding is None
+
+
+@pytest.mark.parametrize("encoding", ["deflate", "gzip"])
+def test_decompress_limit(encoding):
+    # given compressed body which decodes to 1 MB
+    message = Message(
+        body=compress(b"\0" * 1024 * 1024, encoding), content_encoding=encoding
+    )
+
+    # then it is rejected above the limit, accepted up to it
+    with pytest.raises(BodyTooLarge):
+        decompress(message, max_size=1024 * 1024 - 1)
+    assert decompress(message, max_size=1024 * 1024).body_size == 1024 * 1024
+
+
+def test_decompress_truncated():
+    message = Message(body=compress(BODY, "deflate")[:-10], content_encoding="deflate")
+    with pytest.raises(zlib.error):
+        decompress(message)
+
+
+def test_decompress_passes_other_encodings():
+    message = Message(body=b"Hallo", content_encoding="utf-8")
+    assert decompress(message).body == b"Hallo"
+    assert message.content_encoding == "utf-8"
+
+
+def test_template_threshold():
+    # given template with compression
+    template = MessageTemplate(
+        "core1", compression="deflate", compression_threshold=100
+    )
+
+    # then only large bodies are compressed
+    small = template.create(b"Hallo", "CUSTOM")
+    assert small.body == b"Hallo"
+    assert small.content_encoding is None
+
+    large = template.create(BODY, "CUSTOM")
+    assert large.content_encoding == "deflate"
+    assert decompress(large).body == BODY
+
+
+def test_unknown_encoding():
+    with pytest.raises(UnknownEncoding):
+        MessageTemplate("core1", compression="brotli")
@@ -1,14 +1,27 @@
 import asyncio
+import logging
+from types import SimpleNamespace
 
 import pytest
 from async_timeout import timeout
 
 from behaviour import Behaviour
 from core import Core
-from messages import CoreStatus
+from handler import RmqMessageTypes
+from codec import BINARY, C_TYPE_HEADER, REQUEST_TYPE_HEADER
+from messages import CoreStatus, GetStatus, Ping, Pong, RpcMessageTypes
 from settings import UPDATE_PEER_INTERVAL
 
 
+def traced(core, category, msg_type="type"):
+    """ traced messages of given type, excludes peer ping/pong """
+    return [
+        msg
+        for (ts, msg, cat) in core.traces.filter(category=category)
+        if msg.type == msg_type
+    ]
+
+
 @pytest.mark.asyncio
 class TestBasics:
     async def test_core(self):
@@ -53,6 +66,27 @@ class TestBasics:
         peers = await ctrl.list_peers()
         assert len(peers) == 3
 
+    async def test_peer_leave(self, ctrl):
+        # given peer which has joined
+        async with Core(identity="core1") as a:
+            await asyncio.sleep(0.1)  # relinquish cpu
+            assert "core1" in ctrl.peers
+
+        # when peer stops, then it leaves
+        await asyncio.sleep(0.1)
+        assert "core1" not in ctrl.peers
+        assert ctrl.peers.leaves == 1
+
+    async def test_peer_status(self, core1, ctrl):
+        await asyncio.sleep(0.1)  # relinquish cpu
+
+        # when full status is fetched on demand
+        stati = await ctrl.peer_status()
+
+        # then all peers answer
+        assert [status.name for status in stati] == ["core1", "ctrl"]
+        assert all(isinstance(status, CoreStatus) for status in stati)
+
 
 @pytest.mark.usefixtures("init_rmq")
 @pytest.mark.asyncio
@@ -98,6 +132,296 @@ class TestCommunication:
 
         assert ctrl.loop is core1.loop is core2.loop
 
+    async def test_loopback_bypass(self, core1, mocker):
+        # given broker publish is observed
+        publish = mocker.spy(core1.control_channel.channel.default_exchange, "publish")
+
+        # when message is sent to itself
+        await core1.direct_send(msg="Hallo Thomas", msg_type="type")
+        await asyncio.sleep(0.1)  # relinquish cpu
+
+        # then it is delivered without broker and traced in and out
+        assert publish.call_count == 0
+        (msg,) = traced(core1, "incoming")
+        assert "Hallo" in msg.body
+        assert msg.app_id == "core1"
+        assert len(traced(core1, "outgoing")) == 1
+
+    async def test_loopback_bypass_disabled(self):
+        config = dict(LOOPBACK_BYPASS=False)
+        async with Core(identity="core1", config=config) as a:
+            await a.direct_send(msg="Hallo Thomas", msg_type="type")
+            await asyncio.sleep(0.1)  # relinquish cpu
+
+            # then message went through broker
+            (msg,) = traced(a, "incoming")
+            assert "Hallo" in msg.body
+
+    async def test_binary_body(self, core1, core2):
+        # given binary payload
+        frame = bytearray(range(256)) * 8
+
+        # when bytes and memoryview bodies are sent
+        await core1.direct_send(msg=bytes(frame), msg_type="type", target="core2")
+        await core1.direct_send(msg=memoryview(frame), msg_type="type", target="core2")
+        await asyncio.sleep(0.1)  # relinquish cpu
+
+        # then payload arrives unchanged and large bodies are traced by size only
+        assert [msg.body for msg in traced(core1, "outgoing")] == ["<2048 bytes>"] * 2
+        assert [msg.body_size for msg in traced(core2, "incoming")] == [2048] * 2
+
+    async def test_message_template(self, core1):
+        # when message is created from template
+        view = memoryview(b"Hallo Thomas")
+        message = core1._create_message(view, "type", "corr_id", headers=dict(a="b"))
+
+        # then agent properties are set and the body is not copied
+        assert message.body is view
+        assert message.body_size == 12
+        assert (message.app_id, message.user_id, message.content_type) == (
+            "core1",
+            "guest",
+            "application/json",
+        )
+        assert (message.type, message.correlation_id) == ("type", "corr_id")
+        assert message.headers == dict(a="b")
+        assert message.timestamp is not None
+        assert not message.locked
+
+    async def test_message_without_timestamp(self):
+        config = dict(MESSAGE_TIMESTAMP=False)
+        async with Core(identity="core1", config=config) as a:
+            await a.direct_send(msg="Hallo Thomas", msg_type="type")
+            await asyncio.sleep(0.1)  # relinquish cpu
+
+            # then message is received without timestamp
+            (msg,) = traced(a, "incoming")
+            assert msg.timestamp is None
+
+    async def test_compression(self):
+        # given agent compressing bodies of at least 100 bytes
+        config = dict(COMPRESSION="deflate", COMPRESSION_THRESHOLD=100)
+        async with Core(identity="core1", config=config) as a:
+            behav = Behaviour(a)
+            await a.add_runtime_dependency(behav)
+
+            # when large message is sent
+            msg = "Hallo Thomas " * 100
+            await a.direct_send(msg=msg, msg_type="type")
+            await asyncio.sleep(0.1)  # relinquish cpu
+
+            # then behaviour and trace store get the decoded body
+            message = await behav.receive()
+            assert message.body.decode() == msg
+            assert message.content_encoding is None
+            (traced_msg,) = traced(a, "incoming")
+            assert traced_msg.body == msg
+            assert traced_msg.content_encoding == "deflate"  # as on the wire
+
+    async def test_decompressed_size_limit(self):
+        # given agent accepting decompressed bodies up to 1000 bytes
+        config = dict(
+            COMPRESSION="deflate", COMPRESSION_THRESHOLD=100, MAX_DECOMPRESSED_SIZE=1000
+        )
+        async with Core(identity="core1", config=config) as a:
+            behav = Behaviour(a)
+            await a.add_runtime_dependency(behav)
+
+            # when message decoding to more is received
+            await a.direct_send(msg="x" * 10000, msg_type="type")
+            await asyncio.sleep(0.1)  # relinquish cpu
+
+            # then it is rejected
+            assert behav.mailbox_size() == 0
+            assert traced(a, "incoming") == []
+
+    async def test_binary_system_messages(self):
+        # given agent sending system messages with binary codec
+        config = dict(CONTENT_TYPE=BINARY)
+        async with Core(identity="core1", config=config) as a:
+            await asyncio.sleep(0.1)  # relinquish cpu
+
+            # then heartbeats are understood and binary RPC is answered
+            assert "core1" in a.peers
+            result = await a.call(
+                Ping(ping="ping").to_rpc(content_type=BINARY), content_type=BINARY
+            )
+            assert isinstance(result, Pong)
+            (request,) = [
+                msg
+                for (ts, msg, cat) in a.traces.filter(category="incoming")
+                if msg.type == "RPC"
+            ]
+            assert request.content_type == BINARY
+
+    async def test_envelope_headers(self):
+        # given agent sending system messages with envelope in headers
+        config = dict(ENVELOPE_HEADERS=True)
+        async with Core(identity="core1", config=config) as a:
+            await asyncio.sleep(0.1)  # relinquish cpu
+
+            # then heartbeats are understood and RPC is answered in the format of the request
+            assert "core1" in a.peers
+            msg, headers, content_type = a.encode_message(Ping(ping="ping"))
+            assert headers == {
+                C_TYPE_HEADER: "Ping",
+                REQUEST_TYPE_HEADER: RpcMessageTypes.RPC_REQUEST.value,
+            }
+            result = await a.call(msg, headers=headers, content_type=content_type)
+            assert isinstance(result, Pong)
+            assert [status.name for status in await a.peer_status()] == ["core1"]
+
+    async def test_message_log_sampled(self, caplog):
+        caplog.set_level(logging.INFO)
+        config = dict(MESSAGE_LOG_SAMPLE=3)
+        async with Core(identity="core1", config=config) as a:
+            # startup traffic (join heartbeat) is sampled as well
+            await asyncio.sleep(0.1)
+            count = a.message_log.count
+            logged = len([r for r in caplog.records if "Message log" in r.getMessage()])
+
+            # when 3 messages are sent to itself
+            for i in range(3):
+                await a.direct_send(msg=f"Hallo {i}", msg_type="type")
+            await asyncio.sleep(0.1)  # relinquish cpu
+
+            # then every 3rd message sent or received is logged
+            assert a.message_log.count - count == 6
+            assert (
+                len([r for r in caplog.records if "Message log" in r.getMessage()])
+                - logged
+                == 2
+            )
+
+    async def test_send_many(self, core1):
+        # when batch of messages is sent with small window
+        msgs = [f"{i}: Hallo Thomas" for i in range(10)]
+        result = await core1.send_many(msgs, msg_type="type", window=3)
+        await asyncio.sleep(0.1)  # relinquish cpu
+
+        # then all messages are confirmed and traced in and out
+        assert result.ok
+        assert result.sent == 10
+        assert len(traced(core1, "outgoing")) == 10
+        assert len(traced(core1, "incoming")) == 10
+
+    async def test_send_many_invalid_window(self, core1):
+        with pytest.raises(ValueError):
+            await core1.send_many(["Hallo"], msg_type="type", target="core2", window=0)
+
+    async def test_send_many_aborted(self, core1):
+        # given exchange with publishes which are never confirmed
+        class Unconfirmed:
+            started, cancelled = 0, 0
+
+            async def publish(self, message, routing_key, timeout=None):
+                self.started += 1
+                try:
+                    await asyncio.Event().wait()
+                except asyncio.CancelledError:
+                    self.cancelled += 1
+                    raise
+
+        # when the batch is cancelled while waiting for a free slot of the window
+        exchange = Unconfirmed()
+        msgs = [core1._create_message(f"{i}", "type") for i in range(3)]
+        batch = asyncio.ensure_future(
+            core1._publish_many(exchange, msgs, "core1", window=2)
+        )
+        await asyncio.sleep(0.01)
+        batch.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await batch
+
+        # then the publishes in flight are cancelled and awaited
+        assert exchange.started == exchange.cancelled == 2
+
+    async def test_publish_many(self, pubsub_behav):
+        # when batch of messages is published to subscribed topic
+        msgs = [f"{i}: xxxxx" for i in range(10)]
+        result = await pubsub_behav.publish_many(msgs, "x.y")
+        await asyncio.sleep(0.1)  # relinquish cpu
+
+        # then all messages end up in mailbox
+        assert result.sent == 10
+        assert pubsub_behav.mailbox_size() == 10
+
+
+@pytest.mark.usefixtures("init_rmq")
+@pytest.mark.asyncio
+class TestConcurrentConsumer:
+    async def test_concurrent_processing(self):
+        # given agent with concurrent consumer workers
+        config = dict(PREFETCH=20, CONSUMER_CONCURRENCY=4)
+
+        async with Core(identity="core1", config=config) as a:
+            assert len(a._deliveries) == 1  # shared queue without ordering
+
+            # when batch of messages is sent
+            msgs = [f"{i}: Hallo Thomas" for i in range(20)]
+            await a.send_many(msgs, msg_type="type")
+            await asyncio.sleep(0.2)  # relinquish cpu
+
+            # then all messages are processed
+            assert len(traced(a, "incoming")) == 20
+
+    async def test_ordering_per_sender(self):
+        # given agent with ordered concurrent consumer workers
+        config = dict(PREFETCH=20, CONSUMER_CONCURRENCY=4, CONSUMER_ORDERING="app_id")
+
+        async with Core(identity="core1", config=config) as a:
+            assert len(a._deliveries) == 4
+
+            # when batch of messages is sent by one sender
+            msgs = [f"{i}" for i in range(20)]
+            await a.send_many(msgs, msg_type="type")
+            await asyncio.sleep(0.2)  # relinquish cpu
+
+            # then messages are processed in sending order
+            received = [msg.body for msg in traced(a, "incoming")]
+            assert received == msgs
+
+
+@pytest.mark.usefixtures("init_rmq")
+@pytest.mark.asyncio
+class TestChannelPool:
+    async def test_publish_channels(self):
+        # given agent with two publish channels
+        config = dict(PUBLISH_CHANNELS=2)
+
+        async with Core(identity="core1", config=config) as a:
+            assert len(a.publish_channels) == 2
+
+            # then control traffic stays on consume channel, data is spread over publish channels by target
+            assert a._publisher(RmqMessageTypes.RPC.name, "agent1").channel is a.channel
+            channels = {a._publisher("type", f"agent{i}").channel for i in range(8)}
+            assert len(channels) == 2
+            assert a.channel not in channels
+
+            # then messages to the same target always take the same channel (order is kept)
+            assert len({a._publisher("type", "agent1").channel for _ in range(4)}) == 1
+
+            # when messages are sent via publish channels
+            for i in range(4):
+                await a.direct_send(msg=f"{i}: Hallo Thomas", msg_type="type")
+            await asyncio.sleep(0.1)  # relinquish cpu
+
+            # then all arrive on consume channel
+            assert len(traced(a, "incoming")) == 4
+
+    async def test_behaviour_dedicated_channel(self, core1):
+        # given behaviour with own channel
+        b = Behaviour(core1, binding_keys=["x.y"], dedicated_channel=True)
+        await core1.add_runtime_dependency(b)
+        assert b.channel is not core1.channel
+
+        # when message is published to subscribed topic
+        await core1.publish("xxxxx", "x.y")
+        await asyncio.sleep(0.1)  # relinquish cpu
+
+        # then message is in mailbox
+        assert b.mailbox_size() == 1
+
 
 @pytest.mark.asyncio
 async def test_get_behaviour(core1):
@@ -144,9 +468,7 @@ class TestPeriodicPeerUpdate:
         await asyncio.sleep(0.2)
 
         # then peerlist contains self
-        assert len(core1.peers.all()) == 1
-        identities = [status.name for (date, status, category) in core1.peers.all()]
-        assert "core1" in identities
+        assert core1.peers.names() == ["core1"]
 
     async def test_periodic_update_peers(self):
         identity = "core1"
@@ -163,10 +485,40 @@ class TestPeriodicPeerUpdate:
             # when waited for at least one update interval
             await asyncio.sleep(0.2)
 
-            # then peerlist contains self multiple times
-            identities = [status.name for (date, status, category) in a.peers.all()]
-            assert "core1" in identities
-            assert len(a.peers.all()) > 1
+            # then own heartbeat has been received multiple times
+            assert "core1" in a.peers
+            assert a.peers.get("core1").seq > 1
+
+    async def test_ws_status_does_not_block_heartbeat(self):
+        # given web-connected agent and a peer which answers GetStatus slowly
+        class Ws:
+            def __init__(self):
+                self.sent = list()
+
+            async def send_json(self, msg):
+                self.sent.append(msg)
+
+        config = dict(
+            UPDATE_PEER_INTERVAL=0.05, WS_STATUS_INTERVAL=1.0, WS_STATUS_TIMEOUT=0.1
+        )
+        async with Core(identity="core1", config=config) as a, Core(
+            identity="core2", config=dict(UPDATE_PEER_INTERVAL=0.05)
+        ) as b:
+
+            @b.handlers.rpc_command(GetStatus)
+            async def slow_status(core, rpc_obj):
+                await asyncio.sleep(0.5)
+                return GetStatus(status=core.status)
+
+            a.web = SimpleNamespace(ws=Ws())
+            seq = a._heartbeat_seq
+
+            # when the status is published to the websocket
+            await asyncio.sleep(1.3)
+
+            # then heartbeats went on meanwhile and the slow peer is skipped
+            assert a._heartbeat_seq - seq > 15
+            assert [peer["name"] for peer in a.web.ws.sent[0]["peers"]] == ["core1"]
 
     async def test_update_peers_two(self, ctrl):
         identity = "core1"
@@ -183,7 +535,5 @@ class TestPeriodicPeerUpdate:
             # when waited for at least one update interval
             await asyncio.sleep(0.2)
 
-            # then peerlist contains self multiple times
-            identities = [status.name for (date, status, category) in a.peers.all()]
-            assert "core1" in identities
-            assert "ctrl" in identities
+            # then peerlist contains self and peer
+            assert a.peers.names() == ["core1", "ctrl"]
@@ -0,0 +1,143 @@
+import asyncio
+
+import pytest
+
+from core import Core
+from gossip import Gossip
+from membership import Membership
+from messages import CoreStatus, ServiceStatus
+
+
+def status(name, state="running", behaviours=None):
+    return CoreStatus(name=name, state=state, behaviours=behaviours or [])
+
+
+def exchange(a: Gossip, b: Gossip):
+    """ push-pull exchange a -> b -> a -> b """
+    entries, request = b.delta(a.digest())
+    a.merge(entries)
+    b.merge(a.entries_for(request, complete=True))
+
+
+def test_update_local_versions():
+    gossip = Gossip("core1", Membership())
+
+    # when status does not change, only heartbeat increases
+    gossip.update_local(status("core1"))
+    entry = gossip.update_local(status("core1"))
+    assert (entry.heartbeat, entry.version) == (2, 1)
+
+    # when status changes, new version
+    entry = gossip.update_local(
+        status("core1", behaviours=[ServiceStatus("b", "running")])
+    )
+    assert (entry.heartbeat, entry.version) == (3, 2)
+    assert "core1" in gossip.membership
+
+
+def test_exchange_converges():
+    # given agents which know only themselves
+    agents = [Gossip(f"core{i}", Membership()) for i in range(3)]
+    for agent in agents:
+        agent.update_local(status(agent.identity))
+
+    # when exchanging along a chain
+    exchange(agents[0], agents[1])
+    exchange(agents[1], agents[2])
+    exchange(agents[0], agents[1])
+
+    # then all know all
+    for agent in agents:
+        assert [s.name for s in agent.status()] == ["core0", "core1", "core2"]
+        assert agent.membership.names() == ["core0", "core1", "core2"]
+
+
+def test_only_deltas_travel():
+    a, b = Gossip("core1", Membership()), Gossip("core2", Membership())
+    a.update_local(status("core1"))
+    b.update_local(status("core2"))
+    exchange(a, b)
+
+    # when only heartbeat has changed
+    a.update_local(status("core1"))
+    entries, request = b.delta(a.digest())
+
+    # then b asks for core1 and a sends heartbeat without status
+    assert entries == []
+    assert list(request) == ["core1"]
+    delta = a.entries_for(request)
+    assert len(delta) == 1 and delta[0].status is None
+
+    # when applied, b has new heartbeat
+    assert b.merge(delta) == 1
+    assert b.get("core1").heartbeat == 2
+
+
+def test_left_agent_is_not_revived():
+    a, b = Gossip("core1", Membership()), Gossip("core2", Membership())
+    a.update_local(status("core1"))
+    b.update_local(status("core2"))
+    exchange(a, b)
+    stale = b.entries_for({"core1": [0, 0, 0]})
+
+    # when core1 leaves
+    b.membership.leave("core1")
+
+    # then stale entries do not bring it back
+    assert b.merge(stale) == 0
+    assert "core1" not in b.membership
+
+
+def test_restarted_agent_is_not_ignored():
+    a, b = Gossip("core1", Membership(), generation=1), Gossip("core2", Membership())
+    for _ in range(5):
+        a.update_local(status("core1"))
+    b.update_local(status("core2"))
+    exchange(a, b)
+    assert (b.get("core1").heartbeat, b.get("core1").version) == (5, 1)
+
+    # when core1 restarts within its TTL: heartbeat and version start again
+    restarted = Gossip("core1", Membership(), generation=2)
+    restarted.update_local(status("core1", state="starting"))
+    exchange(restarted, b)
+
+    # then b takes over the new generation, old news do not override it
+    entry = b.get("core1")
+    assert (entry.generation, entry.heartbeat, entry.version) == (2, 1, 1)
+    assert entry.status.state == "starting"
+    assert b.merge(a.entries_for({"core1": [0, 0, 0]})) == 0
+    assert b.get("core1").generation == 2
+
+
+def test_restarted_agent_after_leave():
+    a, b = Gossip("core1", Membership(), generation=1), Gossip("core2", Membership())
+    for _ in range(5):
+        a.update_local(status("core1"))
+    b.update_local(status("core2"))
+    exchange(a, b)
+    b.membership.leave("core1")
+
+    # when core1 comes back with a lower heartbeat
+    restarted = Gossip("core1", Membership(), generation=2)
+    restarted.update_local(status("core1"))
+
+    # then it is a member again
+    assert b.merge(restarted.entries_for({}, complete=True)) == 1
+    assert "core1" in b.membership
+
+
+@pytest.mark.asyncio
+class TestGossipCore:
+    async def test_gossip_mode(self):
+        config = dict(PEER_GOSSIP=True, UPDATE_PEER_INTERVAL=0.05)
+        async with Core(identity="core1", config=config) as a, Core(
+            identity="core2", config=config
+        ) as b:
+            # when some gossip rounds have passed
+            await asyncio.sleep(0.3)
+
+            # then both know each other's status
+            assert [s.name for s in a.gossip.status()] == ["core1", "core2"]
+            assert [s.name for s in b.gossip.status()] == ["core1", "core2"]
+            assert a.gossip.stats.messages_sent > 0
+            assert a.gossip.stats.rounds > 1
@@ -8,10 +8,12 @@ import pytz
 
 from behaviour import Behaviour, EmptyBehav
 from core import Core
-from handler import Control, RmqMessageTypes
+from handler import Control, RmqMessageTypes, RpcHandler
 from messages import (
     ControlMessage,
+    DemoData,
     DemoObj,
+    GetStatus,
     ListBehav,
     ListTraceStore,
     ManageBehav,
@@ -89,10 +91,13 @@ class TestControl:
         )
         await asyncio.sleep(0.2)
 
-        # then response from itself with list of 2 behaviours
-        dt, latest, correlation_id = core1.peers.latest()
-        assert latest.name == "core1"
-        assert len(latest.behaviours) == 2
+        # then response from itself
+        assert "core1" in core1.peers
+
+        # then full status with list of 2 behaviours is available on demand
+        result = await core1.call(GetStatus().to_rpc())
+        assert result.status.name == "core1"
+        assert len(result.status.behaviours) == 2
 
     async def test_ping_pong_presence_fanout(self, ctrl, core1):
         # Given control ping message
@@ -107,11 +112,8 @@ class TestControl:
         )
         await asyncio.sleep(0.2)
 
-        # then peers store should have pong answers from all peers (ctrl, core) and itself from startup
-        assert len(ctrl.peers.all()) == 3
-        identities = [status.name for (ts, status, cor_id) in ctrl.peers.all()]
-        assert "ctrl" in identities
-        assert "core1" in identities
+        # then peer table should have all peers (ctrl, core)
+        assert ctrl.peers.names() == ["core1", "ctrl"]
 
 
 @pytest.mark.asyncio
@@ -200,9 +202,9 @@ class TestRpcHandler:
         # when called
         result = await core1.call(obj.to_rpc())
 
-        # then TraceStore has got 3 incoming messages: ListTraceStore, ping, pong
+        # then TraceStore has got join heartbeat and ListTraceStore, each outgoing and incoming
         assert isinstance(result, ListTraceStore)
-        assert len(result.traces) == 6
+        assert len(result.traces) == 4
         assert result.traces[0][2] == "outgoing"
         assert result.traces[1][2] == "incoming"
 
@@ -240,3 +242,72 @@ class TestRpcHandler:
             assert isinstance(result, Shutdown)
             assert "initiated" in result.result
             await asyncio.sleep(2)
+
+
+@pytest.mark.asyncio
+class TestRegistry:
+    async def test_system_handler_singleton(self, core1):
+        # given two lookups of the same message type
+        dispatch = core1.handlers.dispatcher(RmqMessageTypes.RPC.name)
+
+        # then handler is created once and cached
+        assert dispatch is core1.handlers.dispatcher(RmqMessageTypes.RPC.name)
+        assert isinstance(dispatch.__self__, RpcHandler)
+
+    async def test_user_rpc_command(self, core1, core2, mocker):
+        mocker.patch("core.TIMEOUT", None)
+
+        # given RPC command registered on core1 only
+        @core1.handlers.rpc_command(DemoObj)
+        async def echo(core, rpc_obj):
+            rpc_obj.message = f"{core.identity}: {rpc_obj.message}"
+            return rpc_obj
+
+        # when called
+        result = await core2.call(DemoObj(message="Hallo").to_rpc(), target="core1")
+
+        # then command of core1 has replied
+        assert isinstance(result, DemoObj)
+        assert result.message == "core1: Hallo"
+        assert "DemoObj" not in core2.handlers.rpc_commands
+
+    async def test_user_streaming_command(self, core1, mocker):
+        mocker.patch("core.TIMEOUT", None)
+
+        # given streaming RPC command (async generator)
+        @core1.handlers.rpc_command(DemoObj)
+        async def count(core, rpc_obj, chunk_size=None):
+            for i in range(3):
+                yield DemoObj(message=f"{rpc_obj.message} {i}")
+
+        # when called as stream, then all chunks arrive
+        chunks = [
+            chunk
+            async for chunk in core1.call_stream(DemoObj(message="Hallo").to_rpc())
+        ]
+        assert [chunk.message for chunk in chunks] == ["Hallo 0", "Hallo 1", "Hallo 2"]
+
+        # when called unary, then the surplus chunks are not dropped silently
+        result = await core1.call(DemoObj(message="Hallo").to_rpc())
+        assert isinstance(result, RpcError)
+        assert "use call_stream" in result.error
+
+    async def test_user_control_command(self, core1):
+        received = list()
+
+        # given control command for DemoData
+        @core1.handlers.control_command(DemoData)
+        async def on_demo(core, ctrl_obj, msg):
+            received.append((msg.app_id, ctrl_obj.message))
+
+        # when control message is sent
+        msg = DemoData(
+            message="Hallo", date=datetime(2019, 1, 1, tzinfo=pytz.UTC)
+        ).serialize()
+        await core1.direct_send(
+            msg=msg, msg_type=RmqMessageTypes.CONTROL.name, target=core1.identity
+        )
+        await asyncio.sleep(0.1)
+
+        # then command got it
+        assert received == [("core1", "Hallo")]
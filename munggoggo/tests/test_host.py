@@ -0,0 +1,88 @@
+import os
+import time
+
+import pytest
+
+from core import Core
+from host import AgentHost, AgentSpec, assign, load_class, load_host_config
+
+CONFIG_PATH = f"{os.getenv('PROJ_DIR')}/munggoggo/tests/agent_host.yaml"
+
+
+def test_load_host_config():
+    config = load_host_config(CONFIG_PATH)
+
+    assert config["workers"] == 2
+    assert [agent.identity for agent in config["agents"]] == [
+        "host.agent1",
+        "host.agent2",
+        "host.agent3",
+    ]
+    assert config["agents"][1].config == dict(PUBLISH_CHANNELS=0)
+
+
+def test_load_host_config_duplicates(tmp_path):
+    path = tmp_path / "host.yaml"
+    path.write_text("agents:\n  - identity: a\n  - identity: a\n")
+
+    with pytest.raises(ValueError):
+        load_host_config(str(path))
+
+
+@pytest.mark.parametrize("path", ["core:Core", "core.Core"])
+def test_load_class(path):
+    assert load_class(path) is Core
+    assert isinstance(AgentSpec(identity="x", cls=path).create(), Core)
+
+
+def test_assign():
+    agents = [AgentSpec(identity=str(i)) for i in range(5)]
+
+    assert [[a.identity for a in w] for w in assign(agents, 2)] == [
+        ["0", "2", "4"],
+        ["1", "3"],
+    ]
+    assert len(assign(agents, 10)) == 5
+
+
+def wait_for(condition, host, timeout=20.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        host.supervise(timeout=0.1)
+        if condition():
+            return True
+    return False
+
+
+def ready(host, worker, not_pid=None):
+    """ worker has reported with all its agents running (and a new pid after restart) """
+    report = host.load.get(worker)
+    return (
+        report is not None and report.pid != not_pid and report.running == report.agents
+    )
+
+
+def test_agent_host():
+    # given host with two workers
+    host = AgentHost(load_host_config(CONFIG_PATH), loglevel="warning")
+    host.start()
+    try:
+        # then both workers report their load when all their agents are running
+        assert wait_for(lambda: ready(host, 0) and ready(host, 1), host)
+        assert sorted(report.agents for report in host.load.values()) == [1, 2]
+
+        # when worker crashes
+        crashed = host.workers[0]
+        pid = crashed.process.pid
+        crashed.process.kill()
+
+        # then it is restarted and reports again, the other worker is not affected
+        assert wait_for(
+            lambda: crashed.restarts == 1 and ready(host, 0, not_pid=pid), host
+        )
+        assert host.load[0].running == 2
+        assert wait_for(lambda: host.load[1].ts > host.load[0].ts, host)
+    finally:
+        host.stop()
+
+    assert all(not w.process.is_alive() for w in host.workers)
@@ -0,0 +1,62 @@
+import pytest
+from aio_pika import Message
+
+from codec import BINARY, C_TYPE_HEADER
+from incoming import SharedMessage
+from inprocess import InProcessMessage
+from messages import DemoData
+
+
+def shared(body, content_type=None, headers=None) -> SharedMessage:
+    message = Message(
+        body=body,
+        content_type=content_type,
+        headers=headers,
+        type="xxx",
+        app_id="core1",
+    )
+    return SharedMessage(InProcessMessage(message, routing_key="core1"))
+
+
+def test_properties():
+    msg = shared(b"Hallo")
+    assert msg.text == "Hallo"
+    assert msg.type == "xxx"
+    assert msg.app_id == "core1"
+    assert msg.routing_key == "core1"
+
+
+def test_read_only():
+    msg = shared(b"Hallo")
+    with pytest.raises(AttributeError):
+        msg.body = b"xxx"
+    with pytest.raises(AttributeError):
+        del msg.text
+
+
+def test_decoded_once():
+    msg = shared(DemoData(message="Hallo").serialize().encode())
+
+    assert msg.c_type == "DemoData"
+    assert msg.deserialize() is msg.deserialize()
+    assert msg.deserialize(DemoData) == DemoData(message="Hallo")
+    assert msg.trace is msg.trace
+    assert msg.trace.body == msg.text
+
+
+def test_envelope_headers():
+    body, headers = DemoData(message="Hallo").to_envelope(BINARY)
+    msg = shared(body, BINARY, headers)
+
+    assert msg.c_type == "DemoData"
+    assert msg.deserialize() == DemoData(message="Hallo")
+    assert shared(b"not parsed", headers={C_TYPE_HEADER: "Ping"}).c_type == "Ping"
+
+
+def test_wrong_format(caplog):
+    msg = shared(b"Hallo")
+
+    assert msg.c_type is None
+    assert msg.extract_type() == "NoneType"
+    assert msg.deserialize() is None
+    assert "Wrong message format: Hallo" in caplog.text
@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+
+from mailboxes import Mailbox, MailboxFull, OverflowPolicy
+
+
+@pytest.mark.asyncio
+class TestMailbox:
+    async def test_unbounded(self):
+        mailbox = Mailbox()
+        for i in range(100):
+            assert await mailbox.deliver(i)
+        assert mailbox.qsize() == 100
+        assert mailbox.high_water == 100
+
+    async def test_block(self):
+        # given full mailbox
+        mailbox = Mailbox(maxsize=1, policy="block")
+        await mailbox.deliver(1)
+
+        # when message arrives, delivery waits
+        delivery = asyncio.ensure_future(mailbox.deliver(2))
+        await asyncio.sleep(0.01)
+        assert not delivery.done()
+
+        # when space is made, delivery completes
+        assert mailbox.get_nowait() == 1
+        assert await delivery
+        assert mailbox.get_nowait() == 2
+        assert mailbox.high_water == 1
+
+    async def test_drop_oldest(self):
+        mailbox = Mailbox(maxsize=2, policy=OverflowPolicy.DROP_OLDEST)
+        for i in range(5):
+            assert await mailbox.deliver(i)
+
+        assert [mailbox.get_nowait() for _ in range(2)] == [3, 4]
+        assert mailbox.dropped == 3
+
+    async def test_drop_newest(self):
+        mailbox = Mailbox(maxsize=2, policy="drop-newest")
+        results = [await mailbox.deliver(i) for i in range(5)]
+
+        assert results == [True, True, False, False, False]
+        assert [mailbox.get_nowait() for _ in range(2)] == [0, 1]
+        assert mailbox.dropped == 3
+
+    async def test_reject(self):
+        mailbox = Mailbox(maxsize=1, policy="reject")
+        await mailbox.deliver(1)
+
+        with pytest.raises(MailboxFull):
+            await mailbox.deliver(2)
+        assert mailbox.rejected == 1
+        assert mailbox.stats == dict(
+            size=1, maxsize=1, policy="reject", high_water=1, dropped=0, rejected=1
+        )
+
+    async def test_invalid_policy(self):
+        with pytest.raises(ValueError):
+            Mailbox(maxsize=1, policy="xxx")
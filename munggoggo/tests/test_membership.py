@@ -0,0 +1,62 @@
+from membership import JOIN, LEAVE, Membership
+
+
+def test_heartbeat_join():
+    events = []
+    membership = Membership()
+    membership.add_listener(lambda event, peer: events.append((event, peer.name)))
+
+    # when first heartbeat arrives, peer joins
+    assert membership.heartbeat("core1", seq=1, now=0.0)
+
+    # when further heartbeat arrives, peer is updated only
+    assert not membership.heartbeat("core1", seq=2, now=1.0)
+
+    assert membership.get("core1").seq == 2
+    assert membership.get("core1").last_seen == 1.0
+    assert events == [(JOIN, "core1")]
+    assert membership.joins == 1
+
+
+def test_leave():
+    events = []
+    membership = Membership()
+    membership.add_listener(lambda event, peer: events.append((event, peer.name)))
+    membership.heartbeat("core1")
+
+    assert membership.leave("core1")
+    assert not membership.leave("core1")
+
+    assert "core1" not in membership
+    assert events == [(JOIN, "core1"), (LEAVE, "core1")]
+
+
+def test_expire():
+    # given peers with ttl
+    membership = Membership(ttl=3)
+    membership.heartbeat("core1", now=0.0)
+    membership.heartbeat("core2", now=2.0)
+
+    # when ttl of first peer has passed
+    expired = membership.expire(now=4.0)
+
+    # then only that one is removed
+    assert expired == ["core1"]
+    assert membership.names() == ["core2"]
+    assert membership.leaves == 1
+
+
+def test_no_expire_without_ttl():
+    membership = Membership()
+    membership.heartbeat("core1", now=0.0)
+
+    assert membership.expire(now=1000.0) == []
+    assert len(membership) == 1
+
+
+def test_listener_error_is_logged(caplog):
+    membership = Membership()
+    membership.add_listener(lambda event, peer: 1 / 0)
+
+    assert membership.heartbeat("core1")
+    assert "Membership listener failed" in caplog.text
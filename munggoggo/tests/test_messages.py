@@ -6,6 +6,7 @@ import pytest
 import pytz
 from dataclasses_json import dataclass_json
 
+from codec import BINARY
 from messages import (
     CoreStatus,
     DemoData,
@@ -18,8 +19,12 @@ from messages import (
     SerializableObject,
     ServiceStatus,
     TraceStoreMessage,
+    UnknownMessageType,
     WrongMessageFormatException,
     from_rpc,
+    message_class,
+    message_type,
+    message_types,
     to_rpc,
 )
 
@@ -226,3 +231,47 @@ def test_core_status():
     y = PongControl.from_json(msg)
     print(y)
     assert y.status == status
+
+
+class TestMessageTypes:
+    def test_registered_on_definition(self):
+        # given a new message type outside of messages.py
+        @dataclass_json
+        @dataclass
+        class MyRegisteredData(SerializableObject):
+            message: str
+
+        # then it is deserialized without type parameter, with both codecs
+        msg = MyRegisteredData(message="Hallo").serialize()
+        assert SerializableObject.deserialize(msg) == MyRegisteredData(message="Hallo")
+        msg = MyRegisteredData(message="Hallo").serialize(content_type=BINARY)
+        assert SerializableObject.deserialize(msg) == MyRegisteredData(message="Hallo")
+
+    def test_registered_rpc_object(self):
+        @dataclass_json
+        @dataclass
+        class MyRequest(RpcObject):
+            x: int = 0
+
+        assert message_types.get("MyRequest") is MyRequest
+        _, obj = RpcObject.from_rpc(MyRequest(x=1).to_rpc())
+        assert obj == MyRequest(x=1)
+
+    def test_message_type_decorator(self):
+        @message_type
+        @dataclass_json
+        @dataclass
+        class Plain:
+            x: int = 0
+
+        assert message_class("Plain") is Plain
+        assert from_rpc(to_rpc(Plain(x=1))) == Plain(x=1)
+
+    def test_unknown_type_counted(self):
+        count = message_types.unknown["NotDefinedAnywhere"]
+        msg = '{"c_type": "NotDefinedAnywhere", "c_data": "{}"}'
+
+        assert SerializableObject.deserialize(msg) is None
+        assert message_types.unknown["NotDefinedAnywhere"] == count + 1
+        with pytest.raises(UnknownMessageType):
+            message_class("NotDefinedAnywhere")
@@ -0,0 +1,58 @@
+import aio_pika
+import pytest
+from aio_pika import Message
+
+from outgoing import MessageTemplate, OutgoingMessage
+
+
+def test_message_slots_of_pinned_aio_pika():
+    # OutgoingMessage sets the slots of aio_pika.Message directly (aio-pika is pinned in requirements.txt):
+    # when this fails after an upgrade of aio-pika, OutgoingMessage.__init__ must be adapted
+    assert set(Message.__slots__) == {
+        "app_id",
+        "body",
+        "body_size",
+        "content_encoding",
+        "content_type",
+        "correlation_id",
+        "delivery_mode",
+        "expiration",
+        "_headers",
+        "headers_raw",
+        "message_id",
+        "priority",
+        "reply_to",
+        "timestamp",
+        "type",
+        "user_id",
+        "__lock",
+    }, f"aio-pika {aio_pika.__version__}"
+
+
+def test_outgoing_message_equals_message():
+    # given message created from template and the same message built by aio_pika
+    template = MessageTemplate("core1", timestamp=False)
+    outgoing = template.create(
+        "Hallo", "CUSTOM", correlation_id="1", headers={"x": 1}, reply_to="core2"
+    )
+    message = Message(
+        b"Hallo",
+        headers={"x": 1},
+        content_type="application/json",
+        correlation_id="1",
+        reply_to="core2",
+        type="CUSTOM",
+        user_id="guest",
+        app_id="core1",
+    )
+
+    # then all properties are equal
+    assert isinstance(outgoing, OutgoingMessage)
+    assert outgoing.info() == message.info()
+    assert outgoing.headers == message.headers
+    assert outgoing.headers_raw == message.headers_raw
+
+    # and it can be locked like any message
+    outgoing.lock()
+    with pytest.raises(ValueError):
+        outgoing.type = "OTHER"
@@ -0,0 +1,86 @@
+from types import SimpleNamespace
+
+from codec import BINARY, C_TYPE_HEADER
+from messages import DemoData
+from routing import RoutingTable, Subscription, extract_c_type
+
+
+def message(type="CUSTOM", routing_key="", body=b"", content_type=None, headers=None):
+    return SimpleNamespace(
+        type=type,
+        routing_key=routing_key,
+        body=body,
+        content_type=content_type,
+        headers=headers,
+    )
+
+
+DEMO = b'{"c_type": "DemoData", "c_data": "{}"}'
+
+
+def test_extract_c_type():
+    assert extract_c_type(DEMO) == "DemoData"
+    assert extract_c_type(b"Hallo") is None
+    assert extract_c_type(b"[1, 2]") is None
+    assert (
+        extract_c_type(DemoData(message="Hallo").serialize(content_type=BINARY))
+        == "DemoData"
+    )
+
+
+def test_extract_c_type_from_headers():
+    # body is not parsed if the envelope travels in headers
+    assert (
+        extract_c_type(b"not parsed", headers={C_TYPE_HEADER: "DemoData"}) == "DemoData"
+    )
+    body, headers = DemoData(message="Hallo").to_envelope(BINARY)
+    assert extract_c_type(b"not parsed", BINARY, headers) == "DemoData"
+
+
+def test_subscription_matches():
+    assert Subscription().matches(message(), None)
+    assert Subscription(type="CUSTOM").matches(message(), None)
+    assert not Subscription(type="OTHER").matches(message(), None)
+    assert Subscription(c_type="DemoData").matches(message(), "DemoData")
+    assert not Subscription(c_type="DemoData").matches(message(), None)
+    assert Subscription(routing_key="x.*").matches(message(routing_key="x.y"), None)
+    assert not Subscription(routing_key="x.*").matches(message(routing_key="a.y"), None)
+
+
+def test_route():
+    # given behaviours with different subscriptions
+    table = RoutingTable()
+    table.add("all")
+    table.add("custom", [Subscription(type="CUSTOM")])
+    table.add("demo", [Subscription(c_type="DemoData")])
+    table.add("topic", [Subscription(type="PUBSUB", routing_key="x.#")])
+
+    # then messages are routed to matching behaviours only
+    assert table.route(message(type="CUSTOM")) == ["all", "custom"]
+    assert table.route(message(type="CUSTOM", body=DEMO)) == ["all", "custom", "demo"]
+    assert table.route(message(type="CUSTOM", headers={C_TYPE_HEADER: "DemoData"})) == [
+        "all",
+        "custom",
+        "demo",
+    ]
+    assert table.route(message(type="PUBSUB", routing_key="x.y.z")) == ["all", "topic"]
+    assert table.route(message(type="PUBSUB", routing_key="a.b")) == ["all"]
+
+
+def test_route_once_per_behaviour():
+    table = RoutingTable()
+    table.add("b", [Subscription(type="CUSTOM"), Subscription(c_type="DemoData")])
+
+    assert table.route(message(type="CUSTOM", body=DEMO)) == ["b"]
+
+
+def test_remove():
+    table = RoutingTable()
+    table.add("all")
+    table.add("custom", [Subscription(type="CUSTOM"), Subscription(c_type="DemoData")])
+
+    table.remove("custom")
+    table.remove("all")
+
+    assert len(table) == 0
+    assert table.route(message(type="CUSTOM", body=DEMO)) == []
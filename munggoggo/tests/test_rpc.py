@@ -0,0 +1,283 @@
+import asyncio
+
+import pytest
+
+from core import Core
+from messages import (
+    ListTraceStore,
+    Ping,
+    Pong,
+    RpcError,
+    RpcMessageTypes,
+    TraceStoreMessage,
+)
+from rpc import PendingCalls
+
+
+@pytest.mark.asyncio
+class TestPendingCalls:
+    async def test_resolve(self):
+        # given pending call
+        calls = PendingCalls()
+        future = calls.add("1", timeout=1.0)
+        assert "1" in calls
+
+        # when reply arrives
+        assert calls.resolve("1", "result")
+
+        # then future has result and call is gone
+        assert await future == "result"
+        assert len(calls) == 0
+
+        # when same reply arrives again, it is counted as late
+        assert not calls.resolve("1", "result")
+        assert calls.late_replies == 1
+
+    async def test_timeouts_single_timer(self):
+        # given calls with different timeouts
+        calls = PendingCalls()
+        futures = {
+            timeout: calls.add(str(timeout), timeout=timeout)
+            for timeout in (0.05, 0.01, 10)
+        }
+        no_timeout = calls.add("none", timeout=None)
+
+        # then only earliest deadline is scheduled
+        assert calls._timer_at == pytest.approx(
+            asyncio.get_event_loop().time() + 0.01, abs=0.01
+        )
+
+        # when short timeouts have expired
+        await asyncio.sleep(0.1)
+
+        # then those futures raise TimeoutError, others are still pending
+        for timeout in (0.05, 0.01):
+            with pytest.raises(asyncio.TimeoutError):
+                await futures[timeout]
+        assert not futures[10].done() and not no_timeout.done()
+        assert calls.timeouts == 2
+        assert len(calls) == 2
+
+        # when late reply arrives
+        assert not calls.resolve("0.05", "late")
+        assert calls.late_replies == 1
+
+        calls.cancel_all()
+        assert futures[10].cancelled()
+
+    async def test_compact(self):
+        # given many resolved calls with long timeout
+        calls = PendingCalls()
+        for i in range(1000):
+            calls.add(str(i), timeout=60)
+            calls.resolve(str(i), i)
+
+        # then deadline heap does not grow
+        assert len(calls._deadlines) <= 64 + 1
+
+    async def test_duplicate(self):
+        calls = PendingCalls()
+        calls.add("1", timeout=None)
+        with pytest.raises(ValueError):
+            calls.add("1", timeout=None)
+
+
+@pytest.mark.asyncio
+class TestCall:
+    async def test_call_timeout_argument(self, core1):
+        # when calling non existing agent with short timeout
+        result = await core1.call(Ping().to_rpc(), target="non-existing", timeout=0.05)
+
+        # then call times out and leaves no pending call
+        assert isinstance(result, RpcError)
+        assert "TimeoutError after 0.05s" in result.error
+        assert len(core1.pending_calls) == 0
+
+    async def test_cancelled_call_is_discarded(self, core1):
+        # given call to non existing agent which waits for its timeout
+        task = asyncio.ensure_future(
+            core1.call(Ping().to_rpc(), target="non-existing", timeout=10)
+        )
+        await asyncio.sleep(0.05)
+        assert len(core1.pending_calls) == 1
+
+        # when caller is cancelled
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        # then no pending call is left
+        assert len(core1.pending_calls) == 0
+
+    async def test_late_reply_is_dropped(self, core1):
+        # given call which has timed out
+        future = core1.pending_calls.add("late", timeout=0)
+        await asyncio.sleep(0.01)
+        with pytest.raises(asyncio.TimeoutError):
+            await future
+
+        # when response arrives late
+        await core1.direct_send(
+            Pong().to_rpc(rt=RpcMessageTypes.RPC_RESPONSE),
+            msg_type="RPC",
+            correlation_id="late",
+        )
+        await asyncio.sleep(0.1)
+
+        # then it is counted, not raised
+        assert core1.pending_calls.late_replies == 1
+
+    async def test_concurrent_calls(self, core1):
+        results = await asyncio.gather(
+            *(core1.call(Ping().to_rpc()) for _ in range(100))
+        )
+
+        assert all(isinstance(result, Pong) for result in results)
+        assert len(core1.pending_calls) == 0
+
+
+@pytest.mark.asyncio
+class TestCallMany:
+    async def test_call_many(self, core1, core2):
+        # when calling several agents
+        results = [
+            (target, result)
+            async for target, result in core1.call_many(
+                Ping().to_rpc(), ["core1", "core2"]
+            )
+        ]
+
+        # then every target answers
+        assert sorted(target for target, _ in results) == ["core1", "core2"]
+        assert all(isinstance(result, Pong) for _, result in results)
+        assert len(core1.pending_calls) == 0
+
+    async def test_call_many_quorum(self, core1, core2):
+        # given one target which never answers
+        targets = ["core1", "core2", "non-existing"]
+
+        # when quorum is reached
+        start = asyncio.get_event_loop().time()
+        results = [
+            result
+            async for _, result in core1.call_many(
+                Ping().to_rpc(), targets, quorum=2, timeout=10
+            )
+        ]
+
+        # then iteration stops without waiting for the timeout
+        assert len(results) == 2
+        assert asyncio.get_event_loop().time() - start < 1
+        assert len(core1.pending_calls) == 0
+
+    async def test_call_many_first(self, core1, core2):
+        results = [
+            result
+            async for _, result in core1.call_many(
+                Ping().to_rpc(), ["core1", "core2"], first=1
+            )
+        ]
+
+        assert len(results) == 1
+        assert len(core1.pending_calls) == 0
+
+    async def test_call_many_timeout(self, core1):
+        # when target does not answer
+        results = [
+            (target, result)
+            async for target, result in core1.call_many(
+                Ping().to_rpc(), ["core1", "non-existing"], timeout=0.05
+            )
+        ]
+
+        # then it is reported as RpcError
+        results = dict(results)
+        assert isinstance(results["core1"], Pong)
+        assert isinstance(results["non-existing"], RpcError)
+        assert "TimeoutError after 0.05s" in results["non-existing"].error
+
+
+@pytest.mark.asyncio
+class TestReplyQueue:
+    async def test_reply_on_reply_queue(self, core1, core2):
+        # given dedicated reply queue
+        assert core1.reply_queue is not None
+
+        # when calling other agent
+        result = await core1.call(Ping().to_rpc(), target="core2")
+
+        # then response bypasses on_message: not traced as incoming
+        assert isinstance(result, Pong)
+        incoming = [trace for _, trace, _ in core1.traces.filter(category="incoming")]
+        assert not any(trace.type == "RPC" for trace in incoming)
+
+    async def test_no_reply_queue(self, core2):
+        # given agent without reply queue
+        async with Core(identity="core1", config=dict(RPC_REPLY_QUEUE=False)) as a:
+            assert a.reply_queue is None
+
+            # then response comes back on direct queue
+            result = await a.call(Ping().to_rpc(), target="core2")
+            assert isinstance(result, Pong)
+
+
+@pytest.mark.asyncio
+class TestCallStream:
+    async def test_call_stream_chunks(self, core1, core2):
+        # given more traces than fit into one chunk
+        core2.config["STREAM_CHUNK_SIZE"] = 10
+        for i in range(35):
+            core2.traces.append(TraceStoreMessage(body=str(i)), category="test")
+
+        # when streaming with small window
+        chunks = [
+            chunk
+            async for chunk in core1.call_stream(
+                ListTraceStore(category="test").to_rpc(), target="core2", window=2
+            )
+        ]
+
+        # then all traces arrive in chunks
+        assert [len(chunk.traces) for chunk in chunks] == [10, 10, 10, 5]
+        assert len(core1.streams.incoming) == 0
+        await asyncio.sleep(0.1)
+        assert len(core2.streams.outgoing) == 0
+
+    async def test_call_stream_single_chunk(self, core1):
+        # requests without chunking are answered with one chunk
+        chunks = [chunk async for chunk in core1.call_stream(Ping().to_rpc())]
+
+        assert len(chunks) == 1
+        assert isinstance(chunks[0], Pong)
+
+    async def test_call_stream_flow_control(self, core1):
+        # given slow consumer
+        core1.config["STREAM_CHUNK_SIZE"] = 1
+        for i in range(20):
+            core1.traces.append(TraceStoreMessage(body=str(i)), category="test")
+        stream = core1.call_stream(ListTraceStore(category="test").to_rpc(), window=4)
+
+        # when consuming one chunk only
+        await stream.__anext__()
+        await asyncio.sleep(0.1)
+
+        # then responder has not sent more than the window
+        assert len(core1.streams.incoming) == 1
+        chunks = list(core1.streams.incoming.values())[0]
+        assert chunks.qsize() <= 3
+
+        # when consumer stops, responder is cancelled
+        await stream.aclose()
+        await asyncio.sleep(0.1)
+        assert len(core1.streams.outgoing) == 0
+
+    async def test_call_stream_timeout(self, core1):
+        chunks = [
+            chunk
+            async for chunk in core1.call_stream(
+                Ping().to_rpc(), target="non-existing", timeout=0.05
+            )
+        ]
+
+        assert len(chunks) == 1
+        assert isinstance(chunks[0], RpcError)
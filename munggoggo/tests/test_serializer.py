@@ -0,0 +1,91 @@
+import json
+from dataclasses import dataclass
+from datetime import datetime
+
+import pytest
+import pytz
+from dataclasses_json import dataclass_json
+
+from messages import (
+    CoreStatus,
+    DemoData,
+    GetStatus,
+    GossipDelta,
+    GossipEntry,
+    Heartbeat,
+    ListTraceStore,
+    PongControl,
+    ServiceStatus,
+    TraceStoreMessage,
+)
+from serializer import is_generated, serializer
+
+STATUS = CoreStatus(
+    name="core1",
+    state="running",
+    behaviours=[ServiceStatus(name="behav", state="running")],
+)
+
+OBJECTS = [
+    DemoData(message="Hallo", date=datetime(2019, 1, 1, tzinfo=pytz.UTC)),
+    DemoData(message="Hallo"),
+    PongControl(status=STATUS),
+    Heartbeat(seq=3, join=True),
+    GetStatus(),
+    GetStatus(status=STATUS),
+    GossipDelta(
+        entries=[GossipEntry(name="core1", version=2, status=STATUS)],
+        request={"core2": [1, 0]},
+    ),
+]
+
+
+@pytest.mark.parametrize("obj", OBJECTS)
+def test_same_format_as_dataclasses_json(obj):
+    encode, decode = serializer(type(obj))
+    assert is_generated(type(obj))
+
+    # then generated code gives the same json and object as dataclasses_json
+    assert json.dumps(encode(obj)) == obj.to_json()
+    assert decode(json.loads(obj.to_json())) == obj
+
+
+def test_datetime_decoded_as_utc():
+    _, decode = serializer(DemoData)
+    obj = decode({"message": "Hallo", "date": 1546300800.0})
+    assert obj.date == datetime(2019, 1, 1, tzinfo=pytz.UTC)
+    assert obj.date.tzinfo == pytz.UTC
+
+
+def test_untyped_values_like_dataclasses_json():
+    # given trace entries in a field declared as List[str]
+    traces = [
+        (
+            datetime(2019, 1, 1, tzinfo=pytz.UTC),
+            TraceStoreMessage(body="Hallo"),
+            "incoming",
+        )
+    ]
+    obj = ListTraceStore(limit=1, traces=traces)
+
+    encode, _ = serializer(ListTraceStore)
+    assert json.dumps(encode(obj)) == obj.to_json()
+
+
+def test_defaults_of_missing_fields():
+    _, decode = serializer(GossipDelta)
+    assert decode({}) == GossipDelta()
+
+
+def test_fallback_to_dataclasses_json():
+    # given a message class with a field type not supported by the generator
+    @dataclass_json
+    @dataclass
+    class Unusual:
+        value: complex = None
+
+    encode, decode = serializer(Unusual)
+
+    # then dataclasses_json is used
+    assert not is_generated(Unusual)
+    assert decode(encode(Unusual())) == Unusual()
@@ -31,8 +31,8 @@ class TestPubSub:
         await pubsub_behav.publish("yyyyy", "x.z")
         await asyncio.sleep(0)  # relinquish cpu
 
-        # then trace store has got both messages + ping/pong
-        assert len(pubsub_behav.core.traces.store) == 8
+        # then trace store has got both messages + join heartbeat, each outgoing and incoming
+        assert len(pubsub_behav.core.traces.store) == 6
 
     async def test_receive(self, pubsub_behav):
         # Given
@@ -0,0 +1,232 @@
+import asyncio
+
+import pytest
+from aio_pika import ExchangeType, Message
+from aiormq import ChannelLockedResource
+
+from core import Core
+from messages import Ping, Pong
+from transport import (
+    AmqpTransport,
+    MemoryBroker,
+    MemoryTransport,
+    create_transport,
+)
+
+
+@pytest.fixture()
+def broker():
+    return MemoryBroker()
+
+
+@pytest.fixture()
+async def channel(broker):
+    connection = await MemoryTransport(broker).connect()
+    channel = await connection.channel()
+    yield channel
+    await connection.close()
+
+
+async def consume(queue, received: list, no_ack=False):
+    async def on_message(message):
+        async with message.process(ignore_processed=no_ack):
+            received.append(message.body.decode())
+
+    return await queue.consume(on_message, no_ack=no_ack)
+
+
+def test_create_transport():
+    assert isinstance(create_transport("amqp"), AmqpTransport)
+    assert isinstance(create_transport("memory"), MemoryTransport)
+    transport = MemoryTransport()
+    assert create_transport(transport) is transport
+
+    with pytest.raises(ValueError):
+        create_transport("xxx")
+
+
+@pytest.mark.asyncio
+class TestMemoryBroker:
+    async def test_default_exchange(self, channel):
+        # given queue
+        queue = await channel.declare_queue("q1")
+        received = list()
+        await consume(queue, received)
+
+        # when message is published with queue name as routing key
+        await channel.default_exchange.publish(Message(b"hallo"), routing_key="q1")
+        await channel.default_exchange.publish(Message(b"lost"), routing_key="xxx")
+        await asyncio.sleep(0)
+
+        # then only queue receives it
+        assert received == ["hallo"]
+
+    async def test_fanout_exchange(self, channel):
+        # given two queues bound to fanout exchange
+        exchange = await channel.declare_exchange("admin", type=ExchangeType.FANOUT)
+        received = list()
+        for name in ("q1", "q2"):
+            queue = await channel.declare_queue(name)
+            await queue.bind(exchange, routing_key="admin")
+            await consume(queue, received)
+
+        # when message is published
+        await exchange.publish(Message(b"hallo"), routing_key="anything")
+        await asyncio.sleep(0)
+
+        # then both queues get it
+        assert received == ["hallo", "hallo"]
+
+    async def test_topic_exchange(self, channel):
+        # given queue bound with wildcards
+        exchange = await channel.declare_exchange("topic", type=ExchangeType.TOPIC)
+        queue = await channel.declare_queue("")
+        assert queue.name.startswith("amq.gen-")
+        await queue.bind(exchange, routing_key="x.*")
+        await queue.bind(exchange, routing_key="a.#")
+        received = list()
+        await consume(queue, received)
+
+        # when messages are published to several topics
+        for routing_key in ("x.y", "x.y.z", "a", "a.b.c", "b"):
+            await exchange.publish(
+                Message(routing_key.encode()), routing_key=routing_key
+            )
+        await asyncio.sleep(0)
+
+        # then only matching ones are delivered
+        assert received == ["x.y", "a", "a.b.c"]
+        assert sorted(binding[1] for binding in queue._bindings) == ["a.#", "x.*"]
+
+        # when queue is unbound
+        await queue.unbind(exchange, routing_key="x.*")
+        await exchange.publish(Message(b"x.z"), routing_key="x.z")
+        await asyncio.sleep(0)
+
+        # then no more messages
+        assert received == ["x.y", "a", "a.b.c"]
+
+    async def test_exclusive_queue(self, broker, channel):
+        # given exclusive queue
+        await channel.declare_queue("agent", exclusive=True)
+
+        # when other connection declares it
+        connection = await MemoryTransport(broker).connect()
+        other = await connection.channel()
+
+        # then resource is locked
+        with pytest.raises(ChannelLockedResource):
+            await other.declare_queue("agent", exclusive=True)
+
+        # when owning connection closes, queue is deleted and can be declared again
+        await channel.connection.close()
+        assert "agent" not in broker.queues
+        await other.declare_queue("agent", exclusive=True)
+        await connection.close()
+
+    async def test_prefetch_and_ack(self, channel):
+        # given consumer with prefetch 1 which does not ack
+        await channel.set_qos(prefetch_count=1)
+        queue = await channel.declare_queue("q1")
+        pending = list()
+
+        async def on_message(message):
+            pending.append(message)
+
+        await queue.consume(on_message)
+
+        # when two messages are published
+        await channel.default_exchange.publish(Message(b"1"), routing_key="q1")
+        await channel.default_exchange.publish(Message(b"2"), routing_key="q1")
+        await asyncio.sleep(0)
+
+        # then only one message is delivered until it is acked
+        assert [message.body for message in pending] == [b"1"]
+        await pending[0].ack()
+        await asyncio.sleep(0)
+        assert [message.body for message in pending] == [b"1", b"2"]
+
+    async def test_reject_requeue(self, channel):
+        # given consumer which rejects first delivery with requeue
+        queue = await channel.declare_queue("q1")
+        deliveries = list()
+
+        async def on_message(message):
+            deliveries.append((message.body, message.redelivered))
+            if not message.redelivered:
+                message.reject(requeue=True)
+            else:
+                message.ack()
+
+        await queue.consume(on_message)
+
+        # when message is published
+        await channel.default_exchange.publish(Message(b"1"), routing_key="q1")
+        await asyncio.sleep(0.01)
+
+        # then it is redelivered
+        assert deliveries == [(b"1", False), (b"1", True)]
+
+    async def test_process_rejects_on_error(self, channel):
+        # given consumer which fails on first delivery within process()
+        queue = await channel.declare_queue("q1")
+        deliveries = list()
+
+        async def on_message(message):
+            deliveries.append((message.body, message.redelivered))
+            async with message.process(requeue=True, reject_on_redelivered=True):
+                raise RuntimeError("failed")
+
+        await queue.consume(on_message)
+
+        # when message is published
+        await channel.default_exchange.publish(Message(b"1"), routing_key="q1")
+        await asyncio.sleep(0.01)
+
+        # then it is requeued once, rejected without requeue when redelivered
+        assert deliveries == [(b"1", False), (b"1", True)]
+
+    async def test_rpc(self, channel):
+        # given registered RPC method
+        rpc = await MemoryTransport().create_rpc(channel)
+
+        async def multiply(x, y):
+            return x * y
+
+        await rpc.register("multiply", multiply)
+        assert list(rpc.routes.keys()) == ["multiply"]
+
+        # then it can be called
+        assert await rpc.call("multiply", kwargs=dict(x=3, y=2)) == 6
+
+        # when channel is closed, method is gone
+        await channel.close()
+        assert not channel.broker.rpc_routes["multiply"]
+
+
+@pytest.mark.asyncio
+class TestCoreOnMemoryTransport:
+    async def test_direct_and_rpc(self, broker):
+        # given two agents on same in-memory broker
+        transport = MemoryTransport(broker)
+        async with Core(identity="core1", transport=transport) as a, Core(
+            identity="core2", transport=transport
+        ) as b:
+            # when message is sent from a to b
+            await a.direct_send(msg="Hallo Thomas", msg_type="type", target="core2")
+            await asyncio.sleep(0.01)
+
+            # then b has received it
+            received = [msg for (ts, msg, cat) in b.traces.filter(category="incoming")]
+            assert any("Hallo" in msg.body for msg in received if msg.type == "type")
+
+            # then RPC works across agents
+            result = await a.call(Ping().to_rpc(), target="core2")
+            assert isinstance(result, Pong)
+
+            # then both are peers
+            await a._update_peers()
+            await asyncio.sleep(0.01)
+            assert [peer["name"] for peer in await a.list_peers()] == ["core1", "core2"]
+
+        assert not broker.queues.get("core1")
@@ -7,7 +7,9 @@ import pytest
 import sys
 from async_timeout import timeout
 
-from utils import AgentFormatter, AgentFilter, load_config
+from types import SimpleNamespace
+
+from utils import AgentFormatter, AgentFilter, MessageLog, load_config, topic_matches
 
 
 def get_logger(name: str, with_formatter=False) -> logging.Logger:
@@ -105,3 +107,58 @@ def test_load_config(path):
     print(config)
     assert config == {'Key': 'value', 'Array': [1, 2, 'drei']}
 
+
+
+@pytest.mark.parametrize(
+    "binding_key, routing_key, expected",
+    [
+        ("x.y", "x.y", True),
+        ("x.y", "x.z", False),
+        ("x.*", "x.y", True),
+        ("x.*", "x.y.z", False),
+        ("*.y", "y", False),
+        ("a.#", "a", True),
+        ("a.#", "a.b.c", True),
+        ("a.#", "b.a", False),
+        ("#", "a.b.c", True),
+        ("#.c", "c", True),
+        ("#.c", "a.b.c", True),
+        ("a.#.c", "a.c", True),
+        ("a.#.c", "a.b.b.c", True),
+        ("a.#.c", "a.b.b", False),
+        ("#.#", "a", True),
+        ("#.#", "a.b", True),
+        ("a.#.#.c", "a.c", True),
+        ("a.#.#.c", "a.b.c", True),
+    ],
+)
+def test_topic_matches(binding_key, routing_key, expected):
+    assert topic_matches(binding_key, routing_key) is expected
+
+
+def test_message_log_sampled(caplog):
+    caplog.set_level(logging.INFO)
+    message = SimpleNamespace(
+        type="CUSTOM", app_id="core1", correlation_id=None, body=b"Hallo"
+    )
+
+    # given message log of every 3rd message
+    log = MessageLog(logging.getLogger("message_log"), every=3)
+
+    # when 7 messages pass
+    for _ in range(7):
+        log("received", message)
+
+    # then 2 are logged
+    assert len(caplog.records) == 2
+    assert "Message log received (3)" in caplog.records[0].getMessage()
+
+
+def test_message_log_off(caplog):
+    caplog.set_level(logging.INFO)
+    log = MessageLog(logging.getLogger("message_log"))
+
+    log("received", None)
+
+    assert log.count == 0
+    assert not caplog.records
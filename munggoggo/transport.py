@@ -0,0 +1,572 @@
+""" Transport layer of Core
+
+    Core, PubSub and RPC_SubSystem do not talk to aio_pika directly but to a connection
+    created by a ``Transport``:
+
+    - ``AmqpTransport``: RabbitMQ via ``aio_pika.connect_robust`` (default)
+    - ``MemoryTransport``: in-process broker, no RabbitMQ required
+    - ``SharedTransport``: one connection of another transport shared by many agents
+
+    The in-memory broker implements the subset of AMQP used by munggoggo:
+    default/direct, fanout and topic (``*``/``#``) exchanges, exclusive and auto-delete queues,
+    consumers with prefetch, ack/reject/requeue and the RPC pattern.
+    All agents of one process using a ``MemoryTransport`` share ``MemoryBroker.default()``
+    unless a broker is passed explicitly.
+
+    Select the transport per agent via config ``TRANSPORT`` ("amqp", "memory")
+    or pass a ``Transport`` instance to Core.
+"""
+from __future__ import (
+    annotations,
+)  # make all type hints be strings and skip evaluating them
+
+import asyncio
+import inspect
+import itertools
+import logging
+import uuid
+from collections import defaultdict, deque
+from typing import Callable, ClassVar, Deque, Dict, List, Optional, Set, Tuple, Union
+
+from aio_pika import ExchangeType, Message, connect_robust
+from aio_pika.patterns import RPC
+from aiormq.exceptions import (
+    ChannelLockedResource,
+    ChannelNotFoundEntity,
+    ChannelPreconditionFailed,
+    DeliveryError,
+)
+
+from inprocess import InProcessMessage
+from settings import RMQ_URL
+from utils import topic_matches
+
+_log = logging.getLogger(__name__)
+
+
+class Transport(object):
+    """ Creates connections for Core, PubSub and RPC_SubSystem """
+
+    name: ClassVar[str] = ""
+    shared: ClassVar[bool] = False  # connection is not owned by the agent
+
+    async def connect(self):
+        """ Returns connection, which provides ``channel()`` and ``close()`` """
+        raise NotImplementedError
+
+    async def create_rpc(self, channel):
+        """ Returns RPC pattern bound to channel, which provides ``register()``, ``call()``, ``routes``, ``queues`` """
+        raise NotImplementedError
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}()"
+
+
+class AmqpTransport(Transport):
+    """ RabbitMQ transport """
+
+    name = "amqp"
+
+    def __init__(self, url: str = RMQ_URL):
+        self.url = url
+
+    async def connect(self):
+        return await connect_robust(url=self.url)
+
+    async def create_rpc(self, channel):
+        return await RPC.create(channel)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.url})"
+
+
+class MemoryTransport(Transport):
+    """ In-process transport, all connections share one MemoryBroker """
+
+    name = "memory"
+
+    def __init__(self, broker: MemoryBroker = None):
+        self.broker = broker or MemoryBroker.default()
+
+    async def connect(self) -> MemoryConnection:
+        return MemoryConnection(self.broker)
+
+    async def create_rpc(self, channel: MemoryChannel) -> MemoryRPC:
+        return MemoryRPC(channel)
+
+
+class SharedTransport(Transport):
+    """ Hands out one connection of the wrapped transport to all agents using it
+
+        The connection is opened by the first ``connect()``. Agents only close their channels,
+        the connection is closed by the owner of the transport, e.g. ``AgentContainer``.
+    """
+
+    shared = True
+
+    def __init__(self, transport: Union[str, Transport]):
+        self.transport = create_transport(transport)
+        self.connection = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def connect(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self.connection is None:
+                self.connection = await self.transport.connect()
+                _log.info(f"Shared connection opened: {self.connection}")
+        return self.connection
+
+    async def create_rpc(self, channel):
+        return await self.transport.create_rpc(channel)
+
+    async def close(self):
+        if self.connection is not None:
+            await self.connection.close()
+            self.connection = None
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.transport!r})"
+
+
+TRANSPORTS = {
+    AmqpTransport.name: AmqpTransport,
+    MemoryTransport.name: MemoryTransport,
+}
+
+
+def create_transport(transport: Union[str, Transport]) -> Transport:
+    """ Creates transport by name, Transport instances are passed through """
+    if isinstance(transport, Transport):
+        return transport
+    try:
+        return TRANSPORTS[transport]()
+    except KeyError:
+        raise ValueError(
+            f"Unknown transport: {transport}. Expected one of {list(TRANSPORTS.keys())}."
+        )
+
+
+################################################################################
+# In-memory broker
+################################################################################
+class _Exchange(object):
+    """ Broker side exchange: bindings (binding_key, queue_name) """
+
+    def __init__(self, name: str, type: ExchangeType):
+        self.name = name
+        self.type = type
+        self.bindings: Set[Tuple[str, str]] = set()
+
+    def matches(self, binding_key: str, routing_key: str) -> bool:
+        if self.type == ExchangeType.FANOUT:
+            return True
+        if self.type == ExchangeType.TOPIC:
+            return topic_matches(binding_key, routing_key)
+        return binding_key == routing_key
+
+
+class _Consumer(object):
+    """ Broker side consumer, honours prefetch of its channel """
+
+    def __init__(
+        self, queue: _Queue, channel: MemoryChannel, callback, tag: str, no_ack: bool
+    ):
+        self.queue = queue
+        self.channel = channel
+        self.callback = callback
+        self.tag = tag
+        self.no_ack = no_ack
+        self.prefetch = channel.prefetch_count
+        self.unacked = 0
+
+    @property
+    def has_capacity(self) -> bool:
+        return self.no_ack or not self.prefetch or self.unacked < self.prefetch
+
+    def deliver(
+        self, message: Message, exchange: str, routing_key: str, redelivered: bool
+    ):
+        incoming = InProcessMessage(
+            message,
+            exchange=exchange,
+            routing_key=routing_key,
+            consumer_tag=self.tag,
+            no_ack=self.no_ack,
+            redelivered=redelivered,
+            on_settle=self._on_settle,
+        )
+        if not self.no_ack:
+            self.unacked += 1
+
+        result = self.callback(incoming)
+        if inspect.isawaitable(result):
+            task = asyncio.ensure_future(result)
+            task.add_done_callback(self._on_callback_done)
+
+    def _on_settle(self, message: InProcessMessage, ack: bool, requeue: bool):
+        self.unacked -= 1
+        if not ack and requeue:
+            self.queue.messages.appendleft(
+                (message, message.exchange, message.routing_key, True)
+            )
+        self.queue.dispatch()
+
+    def _on_callback_done(self, task: asyncio.Future):
+        if not task.cancelled() and task.exception() is not None:
+            _log.error(
+                f"Consumer {self.tag} of {self.queue.name} failed: {task.exception()}"
+            )
+
+
+class _Queue(object):
+    """ Broker side queue """
+
+    def __init__(self, broker: MemoryBroker, name: str, owner=None, auto_delete=False):
+        self.broker = broker
+        self.name = name
+        self.owner = owner  # connection of exclusive queue
+        self.auto_delete = auto_delete
+        self.messages: Deque[Tuple[Message, str, str, bool]] = deque()
+        self.consumers: List[_Consumer] = list()
+
+    def put(self, message: Message, exchange: str, routing_key: str):
+        self.messages.append((message, exchange, routing_key, False))
+        self.dispatch()
+
+    def dispatch(self):
+        """ Delivers messages round-robin to consumers with free prefetch capacity """
+        while self.messages and self.consumers:
+            for _ in range(len(self.consumers)):
+                consumer = self.consumers[0]
+                self.consumers.append(self.consumers.pop(0))  # rotate
+                if consumer.has_capacity:
+                    break
+            else:
+                return  # all consumers busy
+            consumer.deliver(*self.messages.popleft())
+
+    def add_consumer(self, consumer: _Consumer):
+        self.consumers.append(consumer)
+        self.dispatch()
+
+    def remove_consumer(self, tag: str):
+        self.consumers = [
+            consumer for consumer in self.consumers if consumer.tag != tag
+        ]
+        if self.auto_delete and not self.consumers:
+            self.broker.delete_queue(self.name)
+
+
+class MemoryBroker(object):
+    """ In-process message broker """
+
+    _default: ClassVar[Optional[MemoryBroker]] = None
+
+    def __init__(self):
+        self.exchanges: Dict[str, _Exchange] = {"": _Exchange("", ExchangeType.DIRECT)}
+        self.queues: Dict[str, _Queue] = dict()
+        self.rpc_routes: Dict[str, Deque[Callable]] = defaultdict(deque)
+
+    @classmethod
+    def default(cls) -> MemoryBroker:
+        """ Process wide broker """
+        if cls._default is None:
+            cls._default = cls()
+        return cls._default
+
+    def declare_exchange(self, name: str, type: ExchangeType) -> _Exchange:
+        exchange = self.exchanges.get(name)
+        if exchange is None:
+            exchange = self.exchanges[name] = _Exchange(name, ExchangeType(type))
+        elif exchange.type != ExchangeType(type):
+            raise ChannelPreconditionFailed(
+                f"inequivalent arg 'type' for exchange '{name}'"
+            )
+        return exchange
+
+    def delete_exchange(self, name: str):
+        self.exchanges.pop(name, None)
+
+    def declare_queue(
+        self, name: str, connection, exclusive=False, auto_delete=False
+    ) -> _Queue:
+        if not name:
+            name = f"amq.gen-{uuid.uuid4()}"
+
+        queue = self.queues.get(name)
+        if queue is None:
+            queue = self.queues[name] = _Queue(
+                self,
+                name,
+                owner=connection if exclusive else None,
+                auto_delete=auto_delete,
+            )
+        elif queue.owner is not None and queue.owner is not connection:
+            raise ChannelLockedResource(
+                f"cannot obtain exclusive access to locked queue '{name}'"
+            )
+        return queue
+
+    def delete_queue(self, name: str) -> int:
+        queue = self.queues.pop(name, None)
+        if queue is None:
+            return 0
+        for exchange in self.exchanges.values():
+            exchange.bindings = {
+                binding for binding in exchange.bindings if binding[1] != name
+            }
+        queue.consumers = list()
+        return len(queue.messages)
+
+    def bind(self, exchange_name: str, queue_name: str, binding_key: str):
+        try:
+            self.exchanges[exchange_name].bindings.add((binding_key, queue_name))
+        except KeyError:
+            raise ChannelNotFoundEntity(f"no exchange '{exchange_name}'")
+
+    def unbind(self, exchange_name: str, queue_name: str, binding_key: str):
+        exchange = self.exchanges.get(exchange_name)
+        if exchange is not None:
+            exchange.bindings.discard((binding_key, queue_name))
+
+    def route(self, exchange_name: str, routing_key: str, message: Message) -> int:
+        """ Routes message to all matching queues, returns number of queues """
+        try:
+            exchange = self.exchanges[exchange_name]
+        except KeyError:
+            raise ChannelNotFoundEntity(f"no exchange '{exchange_name}'")
+
+        if exchange_name == "":
+            queue = self.queues.get(routing_key)
+            queues = [queue] if queue is not None else list()
+        else:
+            names = {
+                queue_name
+                for (binding_key, queue_name) in exchange.bindings
+                if exchange.matches(binding_key, routing_key)
+            }
+            queues = [self.queues[name] for name in names if name in self.queues]
+
+        for queue in queues:
+            queue.put(message, exchange_name, routing_key)
+        return len(queues)
+
+    def close_connection(self, connection):
+        """ Exclusive queues are deleted with their connection """
+        for queue in [
+            queue for queue in self.queues.values() if queue.owner is connection
+        ]:
+            self.delete_queue(queue.name)
+
+
+class MemoryConnection(object):
+    def __init__(self, broker: MemoryBroker):
+        self.broker = broker
+        self.channels: Dict[int, MemoryChannel] = dict()
+        self._channel_numbers = itertools.count(1)
+        self.is_closed = False
+
+    async def channel(self, channel_number: int = None, **kwargs) -> MemoryChannel:
+        if channel_number is None:
+            channel_number = next(
+                n for n in self._channel_numbers if n not in self.channels
+            )
+        elif channel_number in self.channels:
+            raise ValueError(f"Channel {channel_number} already exists")
+
+        channel = self.channels[channel_number] = MemoryChannel(self, channel_number)
+        return channel
+
+    async def close(self, exc=None):
+        if self.is_closed:
+            return
+        for channel in list(self.channels.values()):
+            await channel.close()
+        self.broker.close_connection(self)
+        self.is_closed = True
+
+    def __str__(self):
+        return f"memory://{id(self.broker):x}"
+
+
+class MemoryChannel(object):
+    def __init__(self, connection: MemoryConnection, number: int):
+        self.connection = connection
+        self.number = number
+        self.prefetch_count = 0
+        self.consumers: Dict[str, _Queue] = dict()  # consumer_tag -> queue
+        self.rpc_routes: List[Tuple[str, Callable]] = list()
+        self.default_exchange = MemoryExchange(self, "", ExchangeType.DIRECT)
+        self.is_closed = False
+
+    @property
+    def broker(self) -> MemoryBroker:
+        return self.connection.broker
+
+    async def set_qos(self, prefetch_count: int = 0, **kwargs):
+        self.prefetch_count = prefetch_count
+
+    async def declare_exchange(
+        self, name: str, type: ExchangeType = ExchangeType.DIRECT, **kwargs
+    ) -> MemoryExchange:
+        self.broker.declare_exchange(name, type)
+        return MemoryExchange(self, name, type)
+
+    async def declare_queue(
+        self,
+        name: str = None,
+        *,
+        exclusive: bool = False,
+        auto_delete: bool = False,
+        **kwargs,
+    ) -> MemoryQueue:
+        state = self.broker.declare_queue(
+            name, self.connection, exclusive=exclusive, auto_delete=auto_delete
+        )
+        return MemoryQueue(self, state)
+
+    async def exchange_delete(self, exchange_name: str, **kwargs):
+        self.broker.delete_exchange(exchange_name)
+
+    async def queue_delete(self, queue_name: str, **kwargs) -> int:
+        return self.broker.delete_queue(queue_name)
+
+    async def close(self, exc=None):
+        if self.is_closed:
+            return
+        for tag, queue in list(self.consumers.items()):
+            queue.remove_consumer(tag)
+        self.consumers = dict()
+        for method_name, func in self.rpc_routes:
+            if func in self.broker.rpc_routes.get(method_name, ()):
+                self.broker.rpc_routes[method_name].remove(func)
+        self.rpc_routes = list()
+        self.connection.channels.pop(self.number, None)
+        self.is_closed = True
+
+    def __str__(self):
+        return f"{self.connection}/{self.number}"
+
+
+class MemoryExchange(object):
+    def __init__(self, channel: MemoryChannel, name: str, type: ExchangeType):
+        self.channel = channel
+        self.name = name
+        self.type = type
+
+    async def publish(
+        self,
+        message: Message,
+        routing_key: str,
+        *,
+        mandatory: bool = True,
+        timeout=None,
+        **kwargs,
+    ) -> None:
+        if self.channel.is_closed:
+            raise RuntimeError(f"Channel closed: {self.channel}")
+        routed = self.channel.broker.route(self.name, routing_key, message)
+        if not routed and mandatory:
+            _log.debug(f"Message returned, no route: {self.name}:{routing_key}")
+
+    def __str__(self):
+        return self.name
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__}({self.name}): type={self.type}>"
+
+
+class MemoryQueue(object):
+    def __init__(self, channel: MemoryChannel, state: _Queue):
+        self.channel = channel
+        self.name = state.name
+        self._state = state
+        self._bindings: Dict[Tuple[MemoryExchange, str], dict] = dict()
+
+    @staticmethod
+    def _exchange_name(exchange: Union[MemoryExchange, str]) -> str:
+        return exchange if isinstance(exchange, str) else exchange.name
+
+    async def bind(
+        self, exchange: Union[MemoryExchange, str], routing_key: str = None, **kwargs
+    ):
+        if routing_key is None:
+            routing_key = self.name
+        self.channel.broker.bind(self._exchange_name(exchange), self.name, routing_key)
+        self._bindings[(exchange, routing_key)] = kwargs
+
+    async def unbind(
+        self, exchange: Union[MemoryExchange, str], routing_key: str = None, **kwargs
+    ):
+        if routing_key is None:
+            routing_key = self.name
+        self.channel.broker.unbind(
+            self._exchange_name(exchange), self.name, routing_key
+        )
+        self._bindings.pop((exchange, routing_key), None)
+
+    async def consume(
+        self, callback, no_ack: bool = False, consumer_tag: str = None, **kwargs
+    ) -> str:
+        consumer_tag = consumer_tag or f"ctag-{uuid.uuid4()}"
+        self.channel.consumers[consumer_tag] = self._state
+        self._state.add_consumer(
+            _Consumer(self._state, self.channel, callback, consumer_tag, no_ack)
+        )
+        return consumer_tag
+
+    async def cancel(self, consumer_tag: str, **kwargs):
+        self.channel.consumers.pop(consumer_tag, None)
+        self._state.remove_consumer(consumer_tag)
+
+    async def purge(self, **kwargs) -> int:
+        purged = len(self._state.messages)
+        self._state.messages.clear()
+        return purged
+
+    async def delete(
+        self, *, if_unused: bool = True, if_empty: bool = True, **kwargs
+    ) -> int:
+        return self.channel.broker.delete_queue(self.name)
+
+    def __str__(self):
+        return f"{self.name}"
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__}({self.name}): channel={self.channel}>"
+
+
+class MemoryRPC(object):
+    """ RPC pattern of the in-memory broker
+
+        Like the AMQP RPC pattern there is one route per method name shared by all registrants,
+        calls are distributed round-robin. Calls are executed directly, without request/response messages.
+    """
+
+    def __init__(self, channel: MemoryChannel):
+        self.channel = channel
+        self.routes: Dict[str, Callable] = dict()
+        self.queues: Dict[Callable, MemoryQueue] = dict()
+
+    async def register(self, method_name: str, func: Callable, **kwargs):
+        if method_name in self.routes:
+            raise RuntimeError(
+                f"Method name already used for {self.routes[method_name]}"
+            )
+
+        self.queues[func] = await self.channel.declare_queue(method_name, **kwargs)
+        self.routes[method_name] = func
+        self.channel.broker.rpc_routes[method_name].append(func)
+        self.channel.rpc_routes.append((method_name, func))
+
+    async def call(self, method_name: str, kwargs: dict = None, **_):
+        funcs = self.channel.broker.rpc_routes.get(method_name)
+        if not funcs:
+            raise DeliveryError(None, None)
+        funcs.rotate(-1)
+        result = funcs[-1](**(kwargs or {}))
+        if inspect.isawaitable(result):
+            result = await result
+        return result
@@ -1,7 +1,8 @@
 import asyncio
 import logging
 import os
-from functools import wraps
+import re
+from functools import lru_cache, wraps
 
 from typing import NewType, Dict, List, Union, Any
 
@@ -79,6 +80,35 @@ def setup_logging(level=logging.DEBUG, agent_name: str = None, agent_log_filter=
     root.setLevel(level)
 
 
+class MessageLog(object):
+    """ Sampled message log: logs every n-th message at INFO, for debugging under load
+
+        Arguments are formatted only for sampled messages.
+    """
+
+    def __init__(self, log, every: int = 0):
+        self.log = log
+        self.every = every
+        self.count = 0
+
+    def __call__(self, direction: str, message) -> None:
+        if not self.every:
+            return
+        self.count += 1
+        if self.count % self.every:
+            return
+        self.log.info(
+            "Message log %s (%d): type: %s, app_id: %s, routing_key: %s, correlation_id: %s, body: %s",
+            direction,
+            self.count,
+            message.type,
+            message.app_id,
+            getattr(message, "routing_key", None),
+            message.correlation_id,
+            message.body,
+        )
+
+
 def shield(func):
     """ shield decorator """
 
@@ -109,3 +139,34 @@ def load_config(config_path):
         raise
 
 
+@lru_cache(maxsize=1024)
+def topic_pattern(binding_key: str):
+    """ Compiles AMQP topic binding key into regex
+
+        Words are separated by dots, ``*`` matches exactly one word, ``#`` matches zero or more words.
+    """
+    words = binding_key.split(".")
+    # repeated '#' match the same as a single one
+    words = [
+        word
+        for i, word in enumerate(words)
+        if word != "#" or i == 0 or words[i - 1] != "#"
+    ]
+    if words == ["#"]:
+        return re.compile(r".*")
+
+    regex, needs_separator = "", False
+    for word in words:
+        if word == "#":
+            # a leading '#' consumes the separator of the following word
+            regex += r"(?:\.[^.]+)*" if needs_separator else r"(?:[^.]+\.)*"
+        else:
+            regex += r"\." if needs_separator else ""
+            regex += r"[^.]+" if word == "*" else re.escape(word)
+            needs_separator = True
+    return re.compile(f"^{regex}$")
+
+
+def topic_matches(binding_key: str, routing_key: str) -> bool:
+    """ Tests whether routing key matches AMQP topic binding key """
+    return topic_pattern(binding_key).match(routing_key) is not None
@@ -202,3 +202,59 @@ def test_call_stop_start(caplog):
     expected = r"result='SqlAgent.SqlBehav already running.'"
     assert result.exit_code == 0
     assert expected in result.output
+
+
+def test_batch(tmp_path):
+    start = datetime.now()
+    runner = CliRunner()
+
+    # given file with several commands
+    commands = tmp_path / "commands.txt"
+    commands.write_text(
+        "# comment\n"
+        "list-peers\n"
+        "list-behaviour SqlAgent\n"
+        "list-traces SqlAgent --limit 1\n"
+        "call start SqlAgent SqlBehav\n"
+    )
+
+    # when run in one session
+    result = runner.invoke(
+        cli, ["batch", str(commands), "--concurrency", 2], obj=dict(start=start)
+    )
+
+    # then all commands succeed
+    assert result.exit_code == 0
+    assert "SqlAgent.SqlBehav" in result.output
+    assert "Total number of records: 1." in result.output
+    assert "Commands: 4, failed: 0." in result.output
+
+
+def test_batch_invalid_command(tmp_path):
+    start = datetime.now()
+    runner = CliRunner()
+
+    commands = tmp_path / "commands.txt"
+    commands.write_text("xxx\nlist-behaviour xxx\n")
+
+    result = runner.invoke(cli, ["batch", str(commands)], obj=dict(start=start))
+
+    assert result.exit_code == 1
+    assert "Invalid command: xxx" in result.output
+    assert "Invalid target: xxx" in result.output
+    assert "Commands: 2, failed: 2." in result.output
+
+
+def test_shell():
+    start = datetime.now()
+    runner = CliRunner()
+
+    result = runner.invoke(
+        cli,
+        ["shell"],
+        input="list-peers\nlist-behaviour SqlAgent\nexit\n",
+        obj=dict(start=start),
+    )
+
+    assert result.exit_code == 0
+    assert "SqlAgent.SqlBehav" in result.output